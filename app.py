@@ -1,14 +1,17 @@
 import asyncio
-from src.grafana.grafana_api import GrafanaAPI
+import datetime
+import os
 
 from src.loger import log_call, log_msg, LogLevel
-from src.models import Env, Marketplace
+from src.models import Marketplace, MetricResult, CelaryData, ProblemRegion
 
-from src.menu import Menu
-from src.config_mg import Config_mg
-from src.grafana.grafana import GrafanaClient
-from src.redash.redash import RedashClient
+from src.menu import Menu, in_thread
 from src.config_mg import Config_mg
+from src.pipeline import AnaliticPipeline
+from src.fleet import FleetRunner
+from src.http_pool import SESSIONS
+from src.metrics import METRICS
+from src import tracing
 
 class App:
     
@@ -16,18 +19,74 @@ class App:
         self.MAIN_MENU = [
             "-→ Запустить аналитику", # пункт меню 0
             "↓ Добавить маркетплейс", # пункт меню 1
+            "-→ Запустить аналитику по всем активным МП", # пункт меню 2
+            "× Выход", # пункт меню 3
         ]
+        # действия могут возвращать корутину - меню ее дождется в общем event loop
         self.MAIN_ACTIONS = {
-            0 : lambda: asyncio.run(self._start_analitic()), # эти функции будут вызываться при выборе пункта меню 0
-            1 : lambda: self.cfg.create_marketplace_interactively(), # эти функции будут вызываться при выборе пункта меню 1
+            0 : lambda: self._start_analitic(), # эти функции будут вызываться при выборе пункта меню 0
+            1 : lambda: in_thread(self.cfg.create_marketplace_interactively), # input() внутри - уводим в поток что бы не блокировать loop
+            2 : lambda: self._start_fleet(), # эти функции будут вызываться при выборе пункта меню 2
+            3 : lambda: self.stop(), # эти функции будут вызываться при выборе пункта меню 3
         }
 
         self.MENU = Menu()
         self.cfg = Config_mg()
+        self.pipeline = AnaliticPipeline()
+        self.fleet = FleetRunner(pipeline=self.pipeline)
 
-    def start_app(self):
-            self.MENU.menu(self.MAIN_MENU, self.MAIN_ACTIONS) # главное меню
+        self._running = False
+        self._background : set[asyncio.Task] = set()
 
+    def start_app(self):
+        """
+        Запускает приложение в одном долгоживущем event loop
+        """
+        asyncio.run(self.run())
+
+    async def run(self) -> None:
+        """
+        Главный цикл приложения. Все действия меню выполняются в этом loop, поэтому между ними живут
+        общий пул соединений, кэши и фоновые задачи (см. spawn)
+        """
+        self._running = True
+        try:
+            while self._running:
+                try:
+                    await self.MENU.menu(self.MAIN_MENU, self.MAIN_ACTIONS) # главное меню
+                except Exception as e:
+                    log_msg(f"Ошибка при выполнении действия: {e}", LogLevel.ERORR)
+        finally:
+            await self._shutdown()
+
+    def stop(self) -> None:
+        self._running = False
+
+    def spawn(self, coro, name: str | None = None) -> asyncio.Task:
+        """
+        Запускает фоновую задачу (обновление кэша, префетч, keep-alive и т.п.), которая работает пока оператор ходит по меню.
+        Ссылка на задачу хранится в приложении, при выходе задачи отменяются
+        """
+        task = asyncio.create_task(coro, name=name)
+        self._background.add(task)
+        task.add_done_callback(self._on_background_done)
+        return task
+
+    def _on_background_done(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log_msg(f"Фоновая задача {task.get_name()} упала: {task.exception()}", LogLevel.ERORR)
+
+    async def _shutdown(self) -> None:
+        """
+        Отменяет фоновые задачи и закрывает общий пул HTTP соединений
+        """
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        log_msg(f"HTTP пул: {SESSIONS.format_stats()}", LogLevel.DEBUG)
+        log_msg(lambda: f"Метрики вызовов:\n{METRICS.format_stats()}", LogLevel.DEBUG)
+        await SESSIONS.close()
 
     async def _start_analitic(self) -> None:
         marketplaces = self.cfg.read_config()
@@ -41,64 +100,106 @@ class App:
         # генерируем действия для каждого МП из меню
         actions = {}
         for i, mp in enumerate(marketplaces): # тут создаем динамическое меню для выбора маркетплейса
-            actions[i] = lambda: asyncio.run(self._do_analitic(mp))
-        actions[(len(marketplaces))] = lambda: self.start_app() # возврат в главное меню
+            actions[i] = lambda mp=mp: self._do_analitic(mp) # mp=mp - иначе все лямбды возьмут последний МП
+        actions[(len(marketplaces))] = lambda: None # возврат в главное меню (главный цикл покажет его снова)
 
-        self.MENU.menu(marketplaces_menu, actions)
+        await self.MENU.menu(marketplaces_menu, actions)
     
+    async def _start_fleet(self) -> None:
+        """
+        Прогон по всем активным МП из конфига: отчеты печатаются по мере готовности, в конце - статистика прогона
+        """
+        async for item in self.fleet.run():
+            print(f"\n========== {item.marketplace.name} ({item.marketplace.env.value}) ==========")
+            if item.error is not None:
+                log_msg(f"Отчет не собран: {item.error}", LogLevel.ERORR)
+                continue
+            self._report_from_results(item.results, item.timings)
+        log_msg(self.fleet.format_stats(), LogLevel.SUCCESS)
+
     @log_call
     async def _do_analitic(self, marketplace: Marketplace) -> None:
-        grafana = GrafanaClient()
-        redash = RedashClient()
-        
-        # нужен для получения информации о обменах по заказам, остаткам и ценам
-        req_map = [
-            {
-            Env.LTS.value : GrafanaAPI.LuceneRequestes.ELK_LTS_ORDERS_LUCENE,
-            Env.LATEST.value : GrafanaAPI.LuceneRequestes.ELK_LATEST_ORDERS_LUCENE
-            },
-            {
-            Env.LTS.value : GrafanaAPI.LuceneRequestes.ELK_LTS_STOCKS_LUCENE,
-            Env.LATEST.value : GrafanaAPI.LuceneRequestes.ELK_LATEST_STOCKS_LUCENE
-            },
-            {
-            Env.LTS.value : GrafanaAPI.LuceneRequestes.ELK_LTS_PRICES_LUCENE,
-            Env.LATEST.value : GrafanaAPI.LuceneRequestes.ELK_LATEST_PRICES_LUCENE
-            }
-        ]
-
-        # --------------------------------------------- GRAFANA ↓
-        async with grafana as g:
-            stors = await g.get_count_stors(marketplace)
-
-            if isinstance(res := await g.get_status_cache(marketplace), tuple):
-                cache, details = res
-            else:
-                cache = res
-                details = {}
-
-            exchanges = []
-            for req in req_map:
-                hits, time = await g.get_value_exchanges_by_req(marketplace, req)
-                exchanges.append((hits, time))
-
-        # ↑ GRAFANA --------------------------------------------- REDASH ↓
-        async with redash as r:
-            history = await r.get_info_about_history(marketplace)
-            problem_regions = await r.get_info_about_problem_regions(marketplace)
-            schedules_by_region = await r.get_schedules_by_mp(marketplace)
-            discrepancy_stors = await r.get_info_discrepancy_stors_by_regions(marketplace)
+        with tracing.trace(f"report {marketplace.name}", marketplace=marketplace.name, env=marketplace.env.value) as trace:
+            results = await self.pipeline.collect(marketplace)
+        self._report_from_results(results, trace.summary())
+        await self._save_trace(trace, marketplace)
+
+    async def _save_trace(self, trace: tracing.Trace, marketplace: Marketplace) -> None:
+        """
+        Если задан TRACE_DIR - сохраняет трассу отчета в Chrome trace-event JSON (chrome://tracing, ui.perfetto.dev)
+        """
+        trace_dir = os.getenv("TRACE_DIR")
+        if not trace_dir:
+            return
+        path = os.path.join(trace_dir, f"{marketplace.name}_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+        try:
+            os.makedirs(trace_dir, exist_ok=True)
+            await asyncio.to_thread(trace.save, path)
+            log_msg(f"Трасса отчета сохранена: {path}", LogLevel.INFO)
+        except OSError as e:
+            log_msg(f"Не удалось сохранить трассу {path}: {e}", LogLevel.WARN)
+
+    def _report_from_results(self, results: dict[str, MetricResult], timings: dict[str, float] | None = None) -> None:
+        """
+        Раскладывает результаты конвейера по аргументам _create_report
+        """
+        # упавшая метрика попадает в отчет текстом ошибки, остальные выводятся как обычно
+        values = {name: (res.value if res.ok else f"Ошибка: {res.error}") for name, res in results.items()}
+
+        if isinstance(res := values["cache"], tuple):
+            cache, details = res
+        else:
+            cache = res
+            details = {}
+
+        exchanges = {}
+        for name in self.pipeline.EXCHANGES_REQ_MAP:
+            value = values[name]
+            exchanges[name] = value if isinstance(value, tuple) else (value, 0)
 
         self._create_report(
-            stors = stors,
+            stors = values["stors"],
             cache = cache,
             details = details,
-            orders = exchanges[0][0], time_orders = exchanges[0][1],
-            stocks = exchanges[1][0], time_stocks = exchanges[1][1],
-            prices = exchanges[2][0], time_prices = exchanges[2][1],
-            history = history,
-            problem_regions = problem_regions,
-            discrepancy_stors = discrepancy_stors)
+            orders = exchanges["orders"][0], time_orders = exchanges["orders"][1],
+            stocks = exchanges["stocks"][0], time_stocks = exchanges["stocks"][1],
+            prices = exchanges["prices"][0], time_prices = exchanges["prices"][1],
+            history = values["history"],
+            problem_regions = values["problem_regions"],
+            discrepancy_stors = values["discrepancy_stors"],
+            schedules_by_region = values["schedules_by_region"],
+            celary = values["celary"],
+            timings = timings or {})
+
+    def _format_celary(self, celary : dict | str) -> str:
+        """
+        Кратко про очереди Celery: текущий backlog, прирост в минуту и самые длинные очереди
+        """
+        if not isinstance(celary, dict):
+            return str(celary)
+
+        lines = []
+        for namespace, data in celary.items():
+            if not isinstance(data, CelaryData):
+                lines.append(f"{namespace}: {data}")
+                continue
+            backlog = data.vlaues[-1] if data.vlaues else 0
+            growth = f"{data.growth_rate:+.1f}/мин" if data.growth_rate is not None else "н/д"
+            top = sorted(((values[-1] if values else 0, name) for name, values in data.queues.items()), reverse=True)[:3]
+            lines.append(f"{namespace}: в очередях {backlog}, прирост {growth}, больше всего: {', '.join(f'{name}={count}' for count, name in top)}")
+        return "\n".join(lines)
+
+    def _format_timings(self, timings : dict[str, float]) -> str:
+        """
+        Тайминги фаз отчета: фазы и метрики с отступом по вложенности, потом суммарное время HTTP запросов и состояний Job'ов
+        """
+        lines = []
+        for name, duration in timings.items():
+            if name.startswith("Σ"):
+                lines.append(f"{name}: {duration * 1000:.0f}мс")
+            else:
+                lines.append(f"{'  ' * name.count('.')}{name.rsplit('.', 1)[-1]}: {duration * 1000:.0f}мс")
+        return "\n".join(lines)
 
     @log_call
     def _create_report(self, stors : dict[str, str],
@@ -108,10 +209,14 @@ class App:
                   stocks: int | str, time_stocks: int,
                   prices: int | str, time_prices: int,
                   history: dict,
-                  problem_regions: list[dict],
-                  discrepancy_stors: dict,
-                  schedules_by_region: dict = {}) -> None:
-        print(f"ТВЗ: {stors}\n\nКэш: {cache}\nДетали: {details}\n\nЗаказы: {orders}\nВременной отрезок: {time_orders}мин\n\nОстатки: {stocks}\nВременной отрезок: {time_stocks}мин\n\nЦены: {prices}\nВременной отрезок: {time_prices}мин\n\nИсторические данные: {history}\n\nПроблемные РК: {problem_regions}\n\nРасхождения ТВЗ:{discrepancy_stors}")
+                  problem_regions: list[ProblemRegion],
+                  discrepancy_stors: dict | str,
+                  schedules_by_region: dict | str = {},
+                  celary: dict | str = {},
+                  timings: dict[str, float] = {}) -> None:
+        print(f"ТВЗ: {stors}\n\nКэш: {cache}\nДетали: {details}\n\nЗаказы: {orders}\nВременной отрезок: {time_orders}мин\n\nОстатки: {stocks}\nВременной отрезок: {time_stocks}мин\n\nЦены: {prices}\nВременной отрезок: {time_prices}мин\n\nИсторические данные: {history}\n\nПроблемные РК: {problem_regions}\n\nРасхождения ТВЗ:{discrepancy_stors}\n\nРасписания по РК: {schedules_by_region}\n\nОчереди Celery:\n{self._format_celary(celary)}")
+        if timings:
+            print(f"\nТайминги:\n{self._format_timings(timings)}")
 
 # if __name__ == "__main__":
 #     try: 
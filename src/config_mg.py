@@ -1,69 +1,162 @@
 import json
+import os
+import threading
+
+from pydantic import TypeAdapter, ValidationError
+
+from src.config_store import ConfigStore, latest_records
 from src.loger import log_call, log_msg, LogLevel
-from src.models import Marketplace
+from src.models import Env, Marketplace
+from src.regions import Region
+
+_MARKETPLACES = TypeAdapter(list[Marketplace]) # схема строится один раз, а не на каждое чтение
+_MARKETPLACE = TypeAdapter(Marketplace)
+
+class ConfigSnapshot:
+    """
+    Разобранный и провалидированный конфиг с индексами.
+    Привязан к (mtime, size, inode) файла - пока файл не менялся, снимок переиспользуется всеми Config_mg процесса
+    """
+    __slots__ = ("stamp", "marketplaces", "by_id", "by_guid", "by_name", "by_elk_name", "by_env", "by_region")
+
+    def __init__(self, stamp : tuple[int, int, int], marketplaces : list[Marketplace]) -> None:
+        self.stamp = stamp
+        self.marketplaces = marketplaces
+        # повторы id/guid уже схлопнуты в _parse (последняя запись журнала побеждает)
+        self.by_id : dict[int, Marketplace] = {mp.id: mp for mp in marketplaces}
+        self.by_guid : dict[str, Marketplace] = {mp.guid: mp for mp in marketplaces}
+        self.by_name : dict[str, Marketplace] = {mp.name: mp for mp in marketplaces}
+        self.by_elk_name : dict[str, Marketplace] = {mp.elk_name: mp for mp in marketplaces}
+        self.by_env : dict[Env, list[Marketplace]] = {}
+        self.by_region : dict[Region, list[Marketplace]] = {}
+        for mp in marketplaces:
+            self.by_env.setdefault(mp.env, []).append(mp)
+            for region in mp.regions:
+                self.by_region.setdefault(region, []).append(mp)
 
 class Config_mg:
+    _SNAPSHOTS : dict[str, ConfigSnapshot] = {} # абсолютный путь → снимок (общий для всех экземпляров)
+    _LOCK = threading.Lock() # создание МП идет из потока (in_thread)
 
-    @log_call
-    def read_config(self, file_path: str = "marcetplaces_config.jsonl") -> list[Marketplace]:
-        """
-        Читает jsonl файл и возвращает список валидированных Marketplace объектов
+    @staticmethod
+    def _stamp(file_path : str) -> tuple[int, int, int]:
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
 
-        Args:
-            file_path(str): Путь до файла конфига
-        Returns:
-            list[src.models.Marketplace]: Список маркетплейсов вытащеных из конгфига
+    def _parse(self, file_path : str) -> list[Marketplace]:
         """
-        marketplaces = []
-        
+        Читает jsonl и валидирует все строки разом. Если где-то ошибка - валидирует построчно что бы пропустить только плохие строки.
+        Конфиг - журнал ConfigStore: на каждый id/guid берется последняя запись
+        """
+        items = []
+        line_numbers = []
         with open(file_path, 'r', encoding='utf-8') as file:
             for line_number, line in enumerate(file, 1):
                 line = line.strip()
                 if not line:  # пропускаем пустые строки
                     continue
-
                 try:
-                    data = json.loads(line)
-                    marketplace = Marketplace(**data)
-                    marketplaces.append(marketplace)
+                    items.append(json.loads(line))
+                    line_numbers.append(line_number)
                 except json.JSONDecodeError as e:
                     log_msg(f"Ошибка JSON в строке {line_number}: {e}", LogLevel.ERORR)
-                except Exception as e:
-                    log_msg(f"Ошибка валидации в строке {line_number}: {e}", LogLevel.ERORR)
-        
+
+        if all(isinstance(item, dict) for item in items):
+            latest = latest_records(list(zip(items, line_numbers)))
+            items = [item for item, _ in latest]
+            line_numbers = [line_number for _, line_number in latest]
+
+        try:
+            return _MARKETPLACES.validate_python(items)
+        except ValidationError:
+            pass
+
+        marketplaces = []
+        for line_number, data in zip(line_numbers, items):
+            try:
+                marketplaces.append(_MARKETPLACE.validate_python(data))
+            except Exception as e:
+                log_msg(f"Ошибка валидации в строке {line_number}: {e}", LogLevel.ERORR)
         return marketplaces
+
+    def snapshot(self, file_path: str = "marcetplaces_config.jsonl") -> ConfigSnapshot:
+        """
+        Текущий снимок конфига. Файл перечитывается только если изменились его mtime, размер или inode
+
+        Args:
+            file_path(str): Путь до файла конфига
+        Returns:
+            ConfigSnapshot: маркетплейсы и индексы по id, guid, name, elk_name, окружению и РК
+        """
+        key = os.path.abspath(file_path)
+        with self._LOCK:
+            stamp = self._stamp(file_path)
+            cached = self._SNAPSHOTS.get(key)
+            if cached is not None and cached.stamp == stamp:
+                return cached
+            snapshot = ConfigSnapshot(stamp, self._parse(file_path))
+            self._SNAPSHOTS[key] = snapshot
+            log_msg(f"Конфиг {file_path} перечитан: {len(snapshot.marketplaces)} МП", LogLevel.DEBUG)
+            return snapshot
+
+    @log_call
+    def read_config(self, file_path: str = "marcetplaces_config.jsonl") -> list[Marketplace]:
+        """
+        Возвращает список валидированных Marketplace объектов из jsonl конфига (из снимка, файл читается только если изменился)
+
+        Args:
+            file_path(str): Путь до файла конфига
+        Returns:
+            list[src.models.Marketplace]: Список маркетплейсов вытащеных из конгфига
+                - Объекты общие со снимком - не изменяйте их
+        """
+        return list(self.snapshot(file_path).marketplaces)
+
+    def get_marketplace(self, id : int | None = None, guid : str | None = None, name : str | None = None, elk_name : str | None = None,
+                        file_path : str = "marcetplaces_config.jsonl") -> Marketplace | None:
+        """
+        Маркетплейс по id, guid, имени или имени в ELK (по первому указанному ключу). None если не найден.
+        Только чтение: берется из снимка (битые строки пропускаются с ошибкой в логе), файлы рядом с конфигом не пишутся
+        """
+        snapshot = self.snapshot(file_path)
+        for value, index in ((id, snapshot.by_id), (guid, snapshot.by_guid), (name, snapshot.by_name), (elk_name, snapshot.by_elk_name)):
+            if value is not None:
+                return index.get(value)
+        raise ValueError("Нужно указать id, guid, name или elk_name")
+
+    def marketplaces_by_env(self, env : Env, file_path : str = "marcetplaces_config.jsonl") -> list[Marketplace]:
+        return list(self.snapshot(file_path).by_env.get(env, []))
+
+    def marketplaces_by_region(self, region : Region, file_path : str = "marcetplaces_config.jsonl") -> list[Marketplace]:
+        return list(self.snapshot(file_path).by_region.get(region, []))
     
     @log_call
     def add_marketplace_to_config(self, marketplace_data: dict, file_path: str = "marcetplaces_config.jsonl") -> bool:
         """
-        Добавляет новый маркетплейс в конфиг файл (JSONL)
-        
+        Добавляет маркетплейс в конфиг файл (JSONL) или обновляет существующий с тем же id/guid.
+        Запись идет через ConfigStore: под блокировкой файла, новой строкой журнала, со сжатием когда устаревших строк много
+
         Args:
             marketplace_data: Данные маркетплейса в виде словаря
             file_path: Путь к файлу конфигурации
-        
+
         Returns:
             bool: True если успешно добавлено, False если ошибка
         """
         try:
             # Валидируем данные через Pydantic модель
             marketplace = Marketplace(**marketplace_data)
-            
-            # Преобразуем обратно в dict для сохранения, преобразуя Enum в строки
-            data_to_save = marketplace.model_dump()
-            
-            # Преобразуем Region и Env объекты в строки для JSON сериализации
-            data_to_save["regions"] = [region.name for region in data_to_save["regions"]]
-            data_to_save["env"] = data_to_save["env"].value
-            
-            # Добавляем в конец файла как новую строку JSON
-            with open(file_path, 'a', encoding='utf-8') as file:
-                json_line = json.dumps(data_to_save, ensure_ascii=False)
-                file.write(json_line + '\n')
-            
-            log_msg(f"Маркетплейс '{marketplace.name}' успешно добавлен в конфиг", LogLevel.SUCCESS)
+
+            store = ConfigStore(file_path)
+            existed = store.get(id=marketplace.id) is not None or store.get(guid=marketplace.guid) is not None
+            if not store.upsert(marketplace):
+                log_msg(f"Маркетплейс '{marketplace.name}' уже есть в конфиге без изменений", LogLevel.INFO)
+            elif existed:
+                log_msg(f"Маркетплейс '{marketplace.name}' обновлен в конфиге", LogLevel.SUCCESS)
+            else:
+                log_msg(f"Маркетплейс '{marketplace.name}' успешно добавлен в конфиг", LogLevel.SUCCESS)
             return True
-            
+
         except Exception as e:
             log_msg(f"Ошибка при добавлении маркетплейса: {e}", LogLevel.ERORR)
             return False
@@ -0,0 +1,300 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from pydantic import ValidationError
+
+from src.loger import log_msg, LogLevel
+from src.models import Marketplace
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+@contextmanager
+def file_lock(path : str, timeout : float = 10.0) -> Iterator[None]:
+    """
+    Межпроцессная эксклюзивная блокировка через отдельный lock файл (flock на Unix, msvcrt.locking на Windows)
+
+    Raises:
+        TimeoutError: если блокировку не удалось взять за timeout секунд
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Не удалось заблокировать {path} за {timeout} секунд")
+                time.sleep(0.05)
+        yield
+    finally:
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        os.close(fd)
+
+def record_keys(record : dict) -> list[str]:
+    """
+    Ключи записи в индексе: id и guid (по любому из них запись обновляется)
+    """
+    keys = []
+    if record.get("id") is not None:
+        keys.append(f"id:{record['id']}")
+    if record.get("guid"):
+        keys.append(f"guid:{record['guid']}")
+    return keys
+
+def latest_records(records : list[Any]) -> list[Any]:
+    """
+    Оставляет последнюю запись на каждый ключ (id/guid) в порядке первого появления ключа.
+    Если новая запись совпала по id с одной старой, а по guid с другой - обе старые заменяются ею.
+    Элементы - dict или (dict, что угодно) - второе значение просто переносится вместе с записью
+    """
+    slots : list[Any | None] = []
+    slot_by_key : dict[str, int] = {}
+    for item in records:
+        record = item[0] if isinstance(item, tuple) else item
+        keys = record_keys(record)
+        matched = sorted({slot_by_key[key] for key in keys if key in slot_by_key})
+        if not matched:
+            slot = len(slots)
+            slots.append(item)
+        else:
+            slot = matched[0]
+            for other in [slot] + matched[1:]:
+                old = slots[other][0] if isinstance(slots[other], tuple) else slots[other]
+                for key in record_keys(old):
+                    slot_by_key.pop(key, None)
+                if other != slot:
+                    slots[other] = None
+            slots[slot] = item
+        for key in keys:
+            slot_by_key[key] = slot
+    return [item for item in slots if item is not None]
+
+class ConfigStore:
+    """
+    Конфиг маркетплейсов как журнал: каждое изменение - новая строка (upsert по id/guid), актуальна последняя запись по ключу.
+
+    - запись под межпроцессной блокировкой (<файл>.lock), строка дописывается одним write
+    - когда устаревших строк становится больше compact_min_stale и больше compact_ratio от живых - журнал сжимается:
+      пишется временный файл с последней записью на ключ и атомарно подменяет конфиг (write-then-rename)
+    - рядом лежит индекс (<файл>.idx): ключ → смещение и длина актуальной строки, поэтому get() читает одну строку, а не весь файл.
+      Индекс привязан к размеру/inode файла: если файл дописали в обход стора - доиндексируется только хвост, если переписали - строится заново
+    """
+
+    def __init__(self, path : str = "marcetplaces_config.jsonl", compact_min_stale : int = 50, compact_ratio : float = 1.0) -> None:
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.index_path = f"{path}.idx"
+        self.compact_min_stale = compact_min_stale
+        self.compact_ratio = compact_ratio
+
+    # ---------------------------------------------------------------------------→ ИНДЕКС ↓
+    def _stat(self) -> os.stat_result | None:
+        try:
+            return os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+    def _scan(self, start : int = 0, index : dict | None = None) -> dict:
+        """
+        Индексирует строки файла начиная со смещения start (дополняет index если передан)
+        """
+        index = index or {"size": 0, "ino": 0, "records": 0, "keys": {}}
+        stat = self._stat()
+        if stat is None:
+            return index | {"size": 0, "ino": 0}
+        keys = index["keys"]
+        with open(self.path, "rb") as file:
+            file.seek(start)
+            offset = start
+            for raw in file:
+                if not raw.endswith(b"\n"):
+                    break # строку еще дописывают - проиндексируем в следующий раз
+                line = raw.strip()
+                if line:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        record = None
+                    if isinstance(record, dict):
+                        index["records"] += 1
+                        self._index_record(keys, record, offset, len(raw))
+                offset += len(raw)
+        index["size"] = offset
+        index["ino"] = stat.st_ino
+        return index
+
+    @staticmethod
+    def _index_record(keys : dict[str, list[int]], record : dict, offset : int, length : int) -> None:
+        # ключи старой записи (если она совпала только по одному из ключей) тоже перенаправляются на новую
+        for key in record_keys(record):
+            old = keys.get(key)
+            if old is not None:
+                for other, position in list(keys.items()):
+                    if position == old:
+                        keys[other] = [offset, length]
+            keys[key] = [offset, length]
+
+    def _load_index(self) -> dict:
+        """
+        Индекс с диска, актуализированный под текущий файл. Сам ничего не пишет - индекс сохраняют только upsert/compact под блокировкой
+        """
+        stat = self._stat()
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                index = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            index = None
+
+        if stat is None:
+            return {"size": 0, "ino": 0, "records": 0, "keys": {}}
+        if index is None or index.get("ino") != stat.st_ino or index.get("size", 0) > stat.st_size:
+            return self._scan()
+        if index["size"] < stat.st_size:
+            return self._scan(index["size"], index)
+        return index
+
+    def _save_index(self, index : dict) -> None:
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(index, file, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def _live(self, index : dict) -> int:
+        return len({tuple(position) for position in index["keys"].values()})
+
+    # ---------------------------------------------------------------------------→ ЧТЕНИЕ ↓
+    def get(self, id : int | None = None, guid : str | None = None) -> Marketplace | None:
+        """
+        Читает одну актуальную запись по id или guid через индекс (без разбора всего файла). Только чтение - индекс на диск не пишется.
+        Битая запись - None и ошибка в логе
+        """
+        if id is None and guid is None:
+            raise ValueError("Нужно указать id или guid")
+        index = self._load_index()
+        position = index["keys"].get(f"id:{id}" if id is not None else f"guid:{guid}")
+        if position is None:
+            return None
+        offset, length = position
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            line = file.read(length)
+        try:
+            return Marketplace.model_validate_json(line)
+        except ValidationError as e:
+            log_msg(f"Ошибка валидации записи {id if id is not None else guid} в {self.path}: {e}", LogLevel.ERORR)
+            return None
+
+    def stats(self) -> dict[str, int]:
+        """
+        Сколько строк в журнале и сколько из них актуальных
+        """
+        index = self._load_index()
+        return {"records": index["records"], "live": self._live(index), "size": index["size"]}
+
+    # ---------------------------------------------------------------------------→ ЗАПИСЬ ↓
+    @staticmethod
+    def _dump(marketplace : Marketplace) -> str:
+        data = marketplace.model_dump()
+        # Region и Env в конфиге хранятся именами/значениями
+        data["regions"] = [region.name for region in data["regions"]]
+        data["env"] = data["env"].value
+        return json.dumps(data, ensure_ascii=False)
+
+    def upsert(self, marketplace : Marketplace) -> bool:
+        """
+        Добавляет или обновляет маркетплейс (по id/guid) новой строкой журнала.
+        Если запись не изменилась - ничего не пишет. При необходимости сжимает журнал
+
+        Returns:
+            bool: True если что-то записано
+        """
+        line = (self._dump(marketplace) + "\n").encode("utf-8")
+        with file_lock(self.lock_path):
+            index = self._load_index()
+            position = index["keys"].get(f"id:{marketplace.id}")
+            if position is not None and position == index["keys"].get(f"guid:{marketplace.guid}"):
+                with open(self.path, "rb") as file:
+                    file.seek(position[0])
+                    if file.read(position[1]) == line:
+                        return False
+
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                end = os.fstat(fd).st_size
+                if end and not self._ends_with_newline(end):
+                    os.write(fd, b"\n") # последнюю строку дописали руками без перевода строки
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            index = self._scan(index["size"], index) # доиндексируем хвост: нашу строку (и ручную если была)
+
+            stale = index["records"] - self._live(index)
+            if stale >= self.compact_min_stale and stale >= self._live(index) * self.compact_ratio:
+                index = self._compact_locked()
+            self._save_index(index)
+        return True
+
+    def _ends_with_newline(self, size : int) -> bool:
+        with open(self.path, "rb") as file:
+            file.seek(size - 1)
+            return file.read(1) == b"\n"
+
+    def compact(self) -> dict[str, int]:
+        """
+        Сжимает журнал до последней записи на ключ (под блокировкой, атомарной подменой файла)
+
+        Returns:
+            dict[str, int]: сколько строк было и сколько осталось
+        """
+        with file_lock(self.lock_path):
+            before = self._load_index()["records"]
+            index = self._compact_locked()
+            self._save_index(index)
+        return {"before": before, "after": index["records"]}
+
+    def _compact_locked(self) -> dict:
+        records = []
+        if self._stat() is not None:
+            with open(self.path, "rb") as file:
+                for raw in file:
+                    line = raw.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        log_msg(f"Сжатие {self.path}: пропущена битая строка {line[:100]!r}", LogLevel.WARN)
+                        continue
+                    if isinstance(record, dict):
+                        records.append((record, line))
+
+        latest = latest_records(records)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as file:
+            for _, line in latest:
+                file.write(line + b"\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        log_msg(f"Конфиг {self.path} сжат: {len(records)} → {len(latest)} строк", LogLevel.INFO)
+        return self._scan()
@@ -0,0 +1,178 @@
+import asyncio
+import datetime
+import json
+import os
+import queue
+import threading
+from typing import Any, Awaitable, Callable
+
+from src.loger import log_msg, LogLevel
+from src.models import Marketplace
+from src.config_mg import Config_mg
+from src.pipeline import AnaliticPipeline
+from src.scheduler import Scheduler, ScheduledJob
+from src.grafana.grafana import GrafanaClient
+from src.redash.redash import RedashClient
+from src.http_pool import SESSIONS
+from src.metrics import METRICS
+
+def _jsonable(value : Any) -> Any:
+    """
+    Приводит результат метрики к виду который можно записать в json (ключи словарей → строки, модели → dict)
+    """
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if hasattr(value, "model_dump"):
+        return _jsonable(value.model_dump(mode="json"))
+    return value
+
+class _JsonlWriter:
+    """
+    Дозапись результатов в jsonl в отдельном daemon потоке (как _LogWriter в src/loger.py):
+    write() только кладет запись в очередь, сериализация и запись на диск не блокируют event loop
+    """
+
+    def __init__(self, path : str) -> None:
+        self.path = path
+        self.queue : queue.Queue[dict] = queue.Queue()
+        self._thread : threading.Thread | None = None
+
+    def write(self, record : dict) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="daemon-output", daemon=True)
+            self._thread.start()
+        self.queue.put(record)
+
+    def _run(self) -> None:
+        with open(self.path, "a", encoding="utf-8") as file:
+            while True:
+                record = self.queue.get()
+                try:
+                    file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                    file.flush()
+                except Exception as e:
+                    log_msg(f"Не удалось записать результат в {self.path}: {e}", LogLevel.WARN)
+                finally:
+                    self.queue.task_done()
+
+    def flush(self) -> None:
+        """
+        Ждет пока все что уже в очереди будет записано
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.join()
+
+class CollectorDaemon:
+    """
+    Фоновый (headless) сбор метрик по всем активным маркетплейсам без меню.
+    Каждое семейство метрик по каждому МП - отдельная периодическая задача планировщика со своим интервалом.
+
+    Интервалы (секунды) можно переопределить переменными окружения DAEMON_INTERVAL_<СЕМЕЙСТВО>,
+    например DAEMON_INTERVAL_EXCHANGES=120. Результаты пишутся в лог и, если задан DAEMON_OUTPUT, в jsonl файл.
+    Метрики вызовов (METRICS) раз в report_every секунд выгружаются в METRICS_PROM_FILE (формат Prometheus) и METRICS_JSON_FILE, если заданы.
+    """
+
+    # семейство → интервал по умолчанию (секунды)
+    INTERVALS = {
+        "stors" : 3600,
+        "cache" : 900,
+        "exchanges" : 300,
+        "history" : 3600,
+        "problem_regions" : 900,
+        "discrepancy" : 1800,
+    }
+
+    def __init__(self, output : str | None = None, report_every : float | None = None) -> None:
+        self.cfg = Config_mg()
+        self.output = output or os.getenv("DAEMON_OUTPUT")
+        self.report_every = report_every or float(os.getenv("DAEMON_REPORT_INTERVAL", "300"))
+        self.writer = _JsonlWriter(self.output) if self.output else None
+        self.scheduler = Scheduler(on_result=self._on_result)
+        self.latest : dict[str, Any] = {} # имя задачи → последний результат
+        self.metrics_files = {"prom" : os.getenv("METRICS_PROM_FILE"), "json" : os.getenv("METRICS_JSON_FILE")}
+
+    def _interval(self, family : str) -> float:
+        return float(os.getenv(f"DAEMON_INTERVAL_{family.upper()}", self.INTERVALS[family]))
+
+    def _families(self, g : GrafanaClient, r : RedashClient, marketplace : Marketplace) -> dict[str, Callable[[], Awaitable[Any]]]:
+        """
+        Фабрики корутин для каждого семейства метрик маркетплейса
+        """
+        exchanges = [(marketplace, req) for req in AnaliticPipeline.EXCHANGES_REQ_MAP.values()]
+        return {
+            "stors" : lambda: g.get_count_stors(marketplace),
+            "cache" : lambda: g.get_status_cache(marketplace),
+            "exchanges" : lambda: g.get_value_exchanges_batch(exchanges),
+            "history" : lambda: r.get_info_about_history(marketplace),
+            "problem_regions" : lambda: r.get_info_about_problem_regions(marketplace),
+            "discrepancy" : lambda: r.get_info_discrepancy_stors_by_regions(marketplace),
+        }
+
+    def _on_result(self, job : ScheduledJob, result : Any, error : str | None) -> None:
+        self.latest[job.name] = result if error is None else error
+        s = job.stats
+        log_msg(f"[{job.name}] {'ошибка: ' + error if error else 'готово'} ({s.last_duration:.1f}с, отставание {s.last_lag:.2f}с)",
+                LogLevel.ERORR if error else LogLevel.INFO)
+
+        if self.writer is not None:
+            record = {
+                "ts" : datetime.datetime.now().isoformat(),
+                "job" : job.name,
+                "family" : job.group,
+                "duration" : round(s.last_duration, 3),
+                "lag" : round(s.last_lag, 3),
+                "error" : error,
+                "result" : _jsonable(result),
+            }
+            self.writer.write(record)
+
+    def _export_metrics(self) -> None:
+        """
+        Выгружает метрики вызовов в файлы (запись через временный файл, что бы сборщик не прочитал недописанный)
+        """
+        exporters = {"prom" : METRICS.to_prometheus, "json" : METRICS.to_json}
+        for kind, path in self.metrics_files.items():
+            if not path:
+                continue
+            try:
+                with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+                    file.write(exporters[kind]())
+                os.replace(f"{path}.tmp", path)
+            except OSError as e:
+                log_msg(f"Не удалось выгрузить метрики в {path}: {e}", LogLevel.WARN)
+
+    async def _metrics_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_every)
+            self._export_metrics()
+
+    async def run(self, marketplaces : list[Marketplace] | None = None) -> None:
+        """
+        Запускает сбор и работает до отмены (Ctrl+C)
+
+        Args:
+            marketplaces(list[Marketplace]|None): маркетплейсы для сбора. Если не указаны - все active из конфига
+        """
+        if marketplaces is None:
+            marketplaces = [mp for mp in self.cfg.read_config() if mp.active]
+        if not marketplaces:
+            log_msg("Нет активных маркетплейсов для сбора", LogLevel.WARN)
+            return
+
+        try:
+            async with GrafanaClient() as g, RedashClient() as r:
+                for mp in marketplaces:
+                    for family, factory in self._families(g, r, mp).items():
+                        self.scheduler.add(f"{mp.name}:{family}", self._interval(family), factory, group=family)
+
+                log_msg(f"Демон запущен: {len(marketplaces)} МП, {len(self.scheduler.jobs)} задач", LogLevel.SUCCESS)
+                await asyncio.gather(self.scheduler.run(report_every=self.report_every), self._metrics_loop())
+        finally:
+            log_msg(f"Планировщик:\n{self.scheduler.format_stats()}", LogLevel.INFO)
+            log_msg(f"Метрики вызовов:\n{METRICS.format_stats()}", LogLevel.INFO)
+            self._export_metrics()
+            if self.writer is not None:
+                await asyncio.to_thread(self.writer.flush)
+            await SESSIONS.close()
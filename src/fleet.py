@@ -0,0 +1,101 @@
+import asyncio
+import math
+import os
+import time
+from typing import AsyncIterator
+
+from src.loger import log_msg, LogLevel
+from src.models import Marketplace, FleetResult, FleetStats
+from src.config_mg import Config_mg
+from src.pipeline import AnaliticPipeline
+from src.grafana.grafana import GrafanaClient
+from src.redash.redash import RedashClient
+
+def percentile(values : list[float], p : float) -> float:
+    """
+    Перцентиль методом ближайшего ранга (p от 0 до 100). Для пустого списка - 0
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+class FleetRunner:
+    """
+    Прогон аналитики по всем активным маркетплейсам из конфига.
+    Маркетплейсы собираются одновременно (не больше concurrency за раз) на общих сессиях Grafana и Redash,
+    отчеты отдаются по мере готовности, а в конце считается статистика пропускной способности.
+    """
+
+    def __init__(self, concurrency : int | None = None, pipeline : AnaliticPipeline | None = None) -> None:
+        self.concurrency = concurrency or int(os.getenv("FLEET_CONCURRENCY", "4"))
+        self.pipeline = pipeline or AnaliticPipeline()
+        self.cfg = Config_mg()
+        self.stats = FleetStats()
+
+    async def _collect_one(self, g : GrafanaClient, r : RedashClient, marketplace : Marketplace, semaphore : asyncio.Semaphore) -> FleetResult:
+        """
+        Собирает отчет по одному маркетплейсу когда освободится слот семафора.
+        Ошибка сбора не пробрасывается - она попадает в FleetResult.error
+        """
+        async with semaphore:
+            start = time.perf_counter()
+            timings : dict[str, float] = {}
+            try:
+                results = await self.pipeline.collect_with(g, r, marketplace, timings)
+                return FleetResult(marketplace=marketplace, results=results, timings=timings, duration=time.perf_counter() - start)
+            except Exception as e:
+                log_msg(f"{marketplace.name}: отчет не собран: {e}", LogLevel.ERORR)
+                return FleetResult(marketplace=marketplace, timings=timings, error=f"{type(e).__name__}: {e}", duration=time.perf_counter() - start)
+
+    async def run(self, marketplaces : list[Marketplace] | None = None) -> AsyncIterator[FleetResult]:
+        """
+        Запускает сбор по парку и отдает отчеты по мере готовности (async генератор).
+        После того как генератор исчерпан - в self.stats лежит статистика прогона.
+
+        Args:
+            marketplaces(list[Marketplace]|None): маркетплейсы для прогона. Если не указаны - все active из конфига
+        Yields:
+            FleetResult: отчет по маркетплейсу (в порядке готовности, а не в порядке конфига)
+        """
+        if marketplaces is None:
+            marketplaces = [mp for mp in self.cfg.read_config() if mp.active]
+
+        self.stats = FleetStats(total=len(marketplaces))
+        if not marketplaces:
+            log_msg("Нет активных маркетплейсов для прогона", LogLevel.WARN)
+            return
+
+        log_msg(f"Прогон по {len(marketplaces)} МП, одновременно: {self.concurrency}", LogLevel.INFO)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        durations : list[float] = []
+        start = time.perf_counter()
+
+        async with GrafanaClient() as g, RedashClient() as r:
+            tasks = [asyncio.create_task(self._collect_one(g, r, mp, semaphore)) for mp in marketplaces]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    item = await next_done
+                    durations.append(item.duration)
+                    if item.error is not None:
+                        self.stats.failed += 1
+                    yield item
+            finally:
+                # если генератор бросили на середине - не оставляем висящих задач
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        elapsed = time.perf_counter() - start
+        self.stats.elapsed = elapsed
+        self.stats.per_minute = len(durations) / elapsed * 60 if elapsed > 0 else 0.0
+        self.stats.p50 = percentile(durations, 50)
+        self.stats.p95 = percentile(durations, 95)
+
+    def format_stats(self) -> str:
+        """
+        Статистика последнего прогона в читаемом виде
+        """
+        s = self.stats
+        return f"МП: {s.total} (ошибок: {s.failed}), время: {s.elapsed:.1f}с, {s.per_minute:.2f} МП/мин, p50: {s.p50:.1f}с, p95: {s.p95:.1f}с"
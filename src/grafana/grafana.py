@@ -1,104 +1,188 @@
 from aiohttp import ClientSession
-from dotenv import load_dotenv
-import os
+from contextlib import asynccontextmanager
+from typing import Any
+import asyncio
 import datetime
 import time
 import json
 
 from src.loger import LogLevel, log_call, log_msg
-from src.models import Marketplace, Env
-from src.grafana.grafana_exception import GrafanaAuthException
+from src.models import Marketplace, Env, CelaryData, GrafanaQuery, GrafanaFrame
+from src.regions import Region
+from src.grafana.grafana_auth import GRAFANA_AUTH
 from src.grafana.grafana_api import GrafanaAPI
+from src.http_pool import SESSIONS
+from src.metrics import METRICS
+from src import tracing
 
 class GrafanaClient:
+    _REGIONS_BY_ID = {region.id: region for region in Region} # id организации → РК (для разбора сгруппированных ответов)
+
     def __init__(self):
         self.cl_session : ClientSession | None = None 
     
     @log_call
     async def async_init(self):
-        if self._session_alive():
-            with open("src/grafana/grafana_config.json", "r") as cfg:
-                config = json.load(cfg)
-                log_msg(f"{config}", LogLevel.DEBUG)
-                self.SESSION = config["session"]
-        else:
-            self.SESSION = await self._auth()
-        
+        # сессия общая на процесс: конфиг читается один раз, /login только если сессия протухла (и только один на всех)
+        self.SESSION = await GRAFANA_AUTH.get_session(self.cl_session)
         self.COOKIES = {"cookie" : f"grafana_session={self.SESSION}"}
-        log_msg(f"{self.COOKIES}", LogLevel.DEBUG)
 
     async def __aenter__(self):
-        self.cl_session = ClientSession()
+        self.cl_session = SESSIONS.get_session() # общий пул соединений процесса, сессию не закрываем
         await self.async_init()
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
-        if self.cl_session:
-            await self.cl_session.close()
+        self.cl_session = None
 
 # ---------------------------------------------------------------------------------→ AUTH ↓
-    @log_call
-    def _session_alive(self, path_to_config : str = "src/grafana/grafana_config.json") -> bool:
+    @asynccontextmanager
+    async def _post(self, url : str, headers : dict, attrs : dict | None = None, **kwargs):
         """
-        Проверяет жив ли сеанс в Grafana.
-        Возвращает True если жив, False если нет."""
-        now = int(datetime.datetime.now().timestamp())
+        POST в Grafana с текущей сессией авторизации.
+        Если Grafana ответила 401 - сессия обновляется (один /login на процесс) и запрос повторяется один раз.
+        Использование как у ClientSession.post: `async with self._post(url, header, json=payload) as resp:`
+        attrs - дополнительные атрибуты отрезка трассы (refId, отрезок в минутах и т.п.)
+        """
+        # для метрик: _msearch и ds/query - отдельные ряды, время считается до конца чтения ответа вызывающим кодом
+        endpoint = "POST _msearch" if url.endswith("_msearch") else f"POST {url.removeprefix(GrafanaAPI.Endpoints.BASE_URL)}"
+        if "json" in kwargs:
+            # сериализуем сами (как и aiohttp) - размер тела нужен для трассы
+            kwargs["data"] = json.dumps(kwargs.pop("json"))
+        body = kwargs.get("data")
+        with tracing.span(endpoint, "http", upstream="grafana", payload_bytes=len(body.encode()) if isinstance(body, str) else len(body or b""), **(attrs or {})) as span:
+            for attempt in range(2):
+                session = await GRAFANA_AUTH.get_session(self.cl_session)
+                self.SESSION = session
+                self.COOKIES = {"cookie" : f"grafana_session={session}"}
+                start = time.perf_counter()
+                status = 0
+                try:
+                    async with self.cl_session.post(url=url, headers={**headers, **self.COOKIES}, **kwargs) as resp:
+                        status = resp.status
+                        span.set(status=status, attempts=attempt + 1, response_bytes=resp.content_length)
+                        if resp.status == 401 and attempt == 0:
+                            GRAFANA_AUTH.invalidate(session)
+                            continue
+                        yield resp
+                        return
+                finally:
+                    METRICS.observe(endpoint, "grafana", time.perf_counter() - start, ok=0 < status < 400)
 
-        with open(path_to_config, "r") as cfg: # 1. Открывает жестко указаный файл конфигурации, а должен принимать его. 2. Вообще не должен ничего открывать, а должен работать с готовыми данными
-            config = json.load(cfg)
-            log_msg(f"{config}", LogLevel.DEBUG)
-            last_date_live = config["last_date_live"]
-        
-        return now < last_date_live
+# ↑ AUTH ---------------------------------------------------------------------------------→ QUERIES ↓
+    MIXED_DATASOURCES = True # Grafana 8.3+ принимает query к разным источникам в одном /api/ds/query. Для старой Grafana - False
+    MAX_QUERIES_PER_REQUEST = 50
 
-    async def _auth(self):
+    def _decode_frames(self, ref_resp : dict) -> list[GrafanaFrame]:
         """
-        Авторизация в Grafana и получение сессионной куки.
-        Возвращает значение сессионной куки и записыват ее в конфиг с последней датой жизни сессии в секундах.
-        В случае ошибки выбрасывает исключение GrafanaAuthException.
+        Разбирает frames из results[refId] в GrafanaFrame
         """
-        if not self.cl_session:
-            raise RuntimeError("Сессия не инициализирована. Используй `async with GrafanaClient()`")
-        
-        auth_url = GrafanaAPI.Endpoints.BASE_URL + GrafanaAPI.Endpoints.AUTH_ENDPONT
-        
-        load_dotenv("creds.env")
+        frames = []
+        for frame in ref_resp.get("frames") or []:
+            schema = frame.get("schema") or {}
+            fields = schema.get("fields") or []
+            frames.append(GrafanaFrame(
+                name=schema.get("name"),
+                columns=[field.get("name") or "" for field in fields],
+                labels=[field.get("labels") or {} for field in fields],
+                values=(frame.get("data") or {}).get("values") or []
+            ))
+        return frames
+
+    async def _post_queries(self, queries : list[GrafanaQuery]) -> dict[str, list[GrafanaFrame] | str]:
+        """
+        Отправляет одну пачку query (одно временное окно) и раскладывает ответ по refId
+        """
+        url = f"{GrafanaAPI.Endpoints.BASE_URL}{GrafanaAPI.Endpoints.QUERY_ENDPOINT}"
+        header = {"Content-Type": "application/json"}
         payload = {
-            "password": os.getenv("GRAFANA_PASSWORD"),
-            "user": os.getenv("GRAFANA_LOGIN")
+            "queries" : [query.to_payload() for query in queries],
+            "from" : f"now-{queries[0].minutes}m",
+            "to" : "now"
         }
-        async with self.cl_session.post(auth_url, json=payload) as response:
-            if response.status != 200:
-                data = await response.json()
-                msg = "Неверный логин или пароль" if data.get("message") == "Invalid username or password" else data.get("message")
-                raise GrafanaAuthException(response.status, response.cookies, f"Ошибка авторизации: {msg}")
-            
-            grafana_session_cookie = response.cookies.get("grafana_session")
-            if not grafana_session_cookie:
-                raise GrafanaAuthException(response.status, response.cookies, "Не удалось получить grafana_session")
-            
-            grafana_session = grafana_session_cookie.value
-            grafana_session_max_age = grafana_session_cookie["max-age"] if "max-age" in grafana_session_cookie else None
+        log_msg("Payload /api/ds/query: %s", LogLevel.DEBUG, payload)
 
-            last_date = int(datetime.datetime.now().timestamp()) + int(grafana_session_max_age) if grafana_session_max_age else 0
+        attrs = {"ref_ids": ",".join(query.ref_id for query in queries), "minutes": queries[0].minutes}
+        async with self._post(url, header, attrs, json=payload) as resp:
+            response_text = await resp.text()
+            log_msg("Response status: %s, Response: %s", LogLevel.DEBUG, resp.status, response_text)
+            try:
+                res = json.loads(response_text)
+            except ValueError:
+                res = {}
+            status = resp.status
 
-            config = {
-                "session": grafana_session,
-                "last_date_live": last_date
-            }
-            with open("src/grafana/grafana_config.json", "w") as cfg:
-                cfg.write(json.dumps(config, indent=4))
-            
-            return grafana_session
+        # при ошибке одного query Grafana может ответить не 200, но results по остальным refId все равно приходят
+        results = res.get("results") if isinstance(res, dict) else None
+        if not results:
+            error = f"Не удалось получить ответ → Статус запроса: {status}, Responce: {response_text}"
+            return {query.ref_id: error for query in queries}
+
+        decoded = {}
+        for query in queries:
+            ref_resp = results.get(query.ref_id) or {}
+            if ref_resp.get("error"):
+                decoded[query.ref_id] = f"Grafana вернула ошибку: {ref_resp.get('error')}"
+            else:
+                decoded[query.ref_id] = self._decode_frames(ref_resp)
+        return decoded
 
-# ↑ AUTH ---------------------------------------------------------------------------------→ STORS ↓
     @log_call
-    def _gen_stors_payload(self, marketplace: Marketplace):
+    async def get_queries(self, queries : list[GrafanaQuery], max_queries : int | None = None) -> dict[str, list[GrafanaFrame] | str]:
         """
-        Создает запросы для графаны на получение количества ТВЗ в РК МП
-        !Возвращает генератор!
+        Общий быстрый путь для /api/ds/query: выполняет много query (Postgres, ClickHouse, Prometheus) минимумом HTTP запросов.
+        Query группируются по временному окну (и по источнику, если MIXED_DATASOURCES = False),
+        группы режутся на пачки по max_queries и все пачки отправляются параллельно.
+
+        Args:
+            queries(list[GrafanaQuery]): query с уникальными ref_id
+            max_queries(int|None): максимум query в одном запросе. Если не указан - MAX_QUERIES_PER_REQUEST
+        Returns:
+            dict[str, list[GrafanaFrame]|str]: ref_id - ключ, разобранные frames - значение
+                - Вместо frames будет строка если запрос или конкретный query завершился ошибкой
+        """
+        if not self.cl_session:
+            raise RuntimeError("Сессия не инициализирована. Используй `async with GrafanaClient()`")
+
+        ref_ids = [query.ref_id for query in queries]
+        if len(set(ref_ids)) != len(ref_ids):
+            raise ValueError(f"ref_id должны быть уникальны: {ref_ids}")
+
+        max_queries = max_queries or self.MAX_QUERIES_PER_REQUEST
+        groups : dict[tuple, list[GrafanaQuery]] = {}
+        for query in queries:
+            key = (query.minutes,) if self.MIXED_DATASOURCES else (query.minutes, query.datasource.get("uid"))
+            groups.setdefault(key, []).append(query)
+
+        batches = [group[i:i + max_queries] for group in groups.values() for i in range(0, len(group), max_queries)]
+        chunks = await asyncio.gather(*(self._post_queries(batch) for batch in batches))
+
+        results = {}
+        for chunk in chunks:
+            results.update(chunk)
+        return {ref_id: results[ref_id] for ref_id in ref_ids} # в порядке запросов
+
+    def _first_value(self, result : list[GrafanaFrame] | str) -> Any:
+        """
+        Первое значение первого frame из результата get_queries.
+        Если данных нет - возвращает "Нет данных", если query упал - текст ошибки
+        """
+        if isinstance(result, str):
+            return result
+        value = result[0].first() if result else None
+        return "Нет данных" if value is None else value
+
+# ↑ QUERIES ---------------------------------------------------------------------------------→ STORS ↓
+    @log_call
+    def _gen_stors_queries(self, marketplace: Marketplace) -> list[GrafanaQuery]:
+        """
+        Создает query для графаны на получение количества ТВЗ в РК МП - по одному query на РК (refId = имя РК)
+
+        Args:
+            marketplace(Marketplace): маркетплейс для которого составляются запросы
+        Returns:
+            list[GrafanaQuery]: query по РК
         """
-        SECONDS_IN_DAY = datetime.timedelta(hours=24).total_seconds()
         sql_map = {
             Env.LTS: GrafanaAPI.SQLRequsts.LTS_STORS_SQL,
             Env.LATEST: GrafanaAPI.SQLRequsts.LATEST_STORS_SQL,
@@ -107,148 +191,157 @@ class GrafanaClient:
         
         # Получаем базовый SQL запрос для окружения
         base_sql = sql_map[marketplace.env]
-        
-        for region in marketplace.regions:
-            # Форматируем SQL с обоими параметрами сразу
-            formatted_sql = base_sql.format(
-                org_id=str(region.id), 
-                mp_id=str(marketplace.id)
+
+        return [
+            GrafanaQuery(
+                ref_id=region.name,
+                datasource=GrafanaAPI.Sources.DHW_CLICKHOUSE_DATASOURCE,
+                raw_sql=base_sql.format(org_id=str(region.id), mp_id=str(marketplace.id)), # Форматируем SQL с обоими параметрами сразу
+                format=1
             )
-            
-            payload = {
-                "queries": [
-                    {
-                        "refId": f"{region.name}",
-                        "datasource": GrafanaAPI.Sources.DHW_CLICKHOUSE_DATASOURCE,
-                        "rawSQL": formatted_sql,  # Используем уже отформатированный SQL
-                        "format": 1,
-                        "maxDataPoints": 1384
-                    }
-                ],
-                "range": {
-                    "from": (datetime.datetime.now() - datetime.timedelta(days=1)).isoformat(),
-                    "to": datetime.datetime.now().isoformat(),
-                    "raw": {
-                        "from": "now-24h",
-                        "to": "now"
-                    }
-                },
-                "from": f"{time.time() - SECONDS_IN_DAY}",
-                "to": f"{time.time()}"
-            }
+            for region in marketplace.regions
+        ]
+
+    @log_call
+    def _gen_grouped_stors_query(self, marketplaces: list[Marketplace]) -> GrafanaQuery:
+        """
+        Создает один query на количество ТВЗ сразу по всем РК переданных маркетплейсов (GROUP BY организация, маркетплейс).
+        Все маркетплейсы должны быть из одного окружения - запрос идет в таблицы конкретного окружения.
+
+        Args:
+            marketplaces(list[Marketplace]): маркетплейсы одного окружения
+        Returns:
+            GrafanaQuery: query с refId = STORS_<окружение>
+        """
+        sql_map = {
+            Env.LTS: GrafanaAPI.SQLRequsts.LTS_STORS_GROUPED_SQL,
+            Env.LATEST: GrafanaAPI.SQLRequsts.LATEST_STORS_GROUPED_SQL,
+            Env.POLZA: GrafanaAPI.SQLRequsts.POLZA_STORS_GROUPED_SQL
+        }
+        envs = {mp.env for mp in marketplaces}
+        if len(envs) != 1:
+            raise ValueError(f"Сгруппированный запрос ТВЗ строится для одного окружения, а передано: {[env.value for env in envs]}")
+        env = envs.pop()
+
+        org_ids = sorted({region.id for mp in marketplaces for region in mp.regions})
+        mp_ids = sorted({mp.id for mp in marketplaces})
+
+        return GrafanaQuery(
+            ref_id=f"STORS_{env.value}",
+            datasource=GrafanaAPI.Sources.DHW_CLICKHOUSE_DATASOURCE,
+            raw_sql=sql_map[env].format(
+                org_ids=", ".join(str(org_id) for org_id in org_ids),
+                mp_ids=", ".join(str(mp_id) for mp_id in mp_ids)
+            ),
+            format=1
+        )
 
-            yield payload, region.name
-    
     @log_call
-    async def get_count_stors(self, marketplace: Marketplace) -> dict[str, str]:
+    async def get_count_stors_grouped(self, marketplaces: list[Marketplace]) -> dict[int, dict[str, Any]]:
         """
-        Прокидывает SQL query в Grafana и получает количество ТВЗ для каждого РК маркетплейса
+        Получает количество ТВЗ по всем РК нескольких маркетплейсов одним SQL запросом на окружение
+        и раскладывает результат обратно по маркетплейсам и РК. Query всех окружений уходят одним HTTP запросом.
+
+        Args:
+            marketplaces(list[Marketplace]): маркетплейсы (могут быть из разных окружений - на каждое окружение свой query)
+        Returns:
+            dict[int, dict[str, Any]]: id маркетплейса - ключ, значение - словарь где имя РК - ключ, количество ТВЗ - значение
+                - РК по которым ClickHouse не вернул строк получают 0 (активных ТВЗ нет)
+                - Если запрос не прошел - у всех РК окружения будет строка с ошибкой
+        """
+        stors = {}
+        by_env: dict[Env, list[Marketplace]] = {}
+        for mp in marketplaces:
+            by_env.setdefault(mp.env, []).append(mp)
+
+        # окружения где ни у одного МП нет РК - без запроса (IN () ClickHouse не принимает)
+        for env in [env for env, env_marketplaces in by_env.items() if not any(mp.regions for mp in env_marketplaces)]:
+            stors.update({mp.id: {} for mp in by_env.pop(env)})
+        if not by_env:
+            return stors
+
+        queries = {env: self._gen_grouped_stors_query(env_marketplaces) for env, env_marketplaces in by_env.items()}
+        results = await self.get_queries(list(queries.values()))
+
+        for env, env_marketplaces in by_env.items():
+            result = results[queries[env].ref_id]
+            if isinstance(result, str):
+                stors.update({mp.id: {region.name: result for region in mp.regions} for mp in env_marketplaces})
+                continue
+
+            # по умолчанию у всех РК 0 - group by не возвращает строки для РК без ТВЗ
+            env_stors = {mp.id: {region.name: 0 for region in mp.regions} for mp in env_marketplaces}
+            for frame in result:
+                if len(frame.values) < 3:
+                    continue
+                # колонки: org_id | mp_id | stors
+                for org_id, mp_id, count in zip(frame.values[0], frame.values[1], frame.values[2]):
+                    mp_stors = env_stors.get(int(mp_id))
+                    if mp_stors is None:
+                        continue
+                    region = self._REGIONS_BY_ID.get(int(org_id))
+                    if region is not None and region.name in mp_stors:
+                        mp_stors[region.name] = count
+            stors.update(env_stors)
+        return stors
+
+    @log_call
+    async def get_count_stors(self, marketplace: Marketplace, chunk_size: int | None = None, grouped: bool = True) -> dict[str, str]:
+        """
+        Прокидывает SQL query в Grafana и получает количество ТВЗ для каждого РК маркетплейса.
+        По умолчанию используется один сгруппированный по организации запрос на все РК.
+        Если grouped=False - query на каждый РК, РК отправляются пакетами (по умолчанию все в одном запросе), пакеты отправляются параллельно.
         
         Args:
             marketplace (Marketplace): маркетплейс для которого будет получение ТВЗ
+            chunk_size (int|None): сколько РК отправлять в одном запросе (только для grouped=False). Если не указан - все РК одним запросом
+            grouped (bool): использовать один запрос с GROUP BY по организациям
         Returns:
             dict: словарь где имя РК - ключ, а значение - количество ТВЗ 
         """
-        if not self.cl_session:
-            raise RuntimeError("Сессия не инициализирована. Используй `async with GrafanaClient()`")
-        url = f"{GrafanaAPI.Endpoints.BASE_URL}{GrafanaAPI.Endpoints.QUERY_ENDPOINT}"
-        header = {"Content-Type": "application/json"}
-        header["cookie"] = self.COOKIES.get("cookie", "")
-        
-        payloads = self._gen_stors_payload(marketplace=marketplace)
-        stors = {}
-        for payload, name in payloads:
-            async with self.cl_session.post(url=url, headers=header, json=payload) as resp:
-                res = await resp.json()
-                log_msg(f"{res}", LogLevel.DEBUG)
-                if resp.status == 200:
-                    results = res.get("results") or {}
-                    region_resp = results.get(name) or {}
-                    
-                    # Получаем frames из ответа
-                    frames = region_resp.get("frames") or []
-                    if frames:
-                        # Берем первый frame
-                        frame = frames[0]
-                        data = frame.get("data") or {}
-                        values = data.get("values") or []
-                        
-                        # Данные находятся в values[0][0]
-                        if values and len(values) > 0 and len(values[0]) > 0:
-                            stors[name] = values[0][0]
-                        else:
-                            stors[name] = "Нет данных"
-                    else:
-                        stors[name] = "Нет данных"
-                else:
-                    stors[name] = f"Не удалось получить ответ → Статус запроса: {resp.status}"
-        
-        return stors
+        if grouped:
+            stors_by_mp = await self.get_count_stors_grouped([marketplace])
+            return stors_by_mp[marketplace.id]
+
+        queries = self._gen_stors_queries(marketplace)
+        results = await self.get_queries(queries, max_queries=chunk_size or len(queries) or 1)
+
+        # сохраняем порядок РК как в конфиге маркетплейса
+        return {ref_id: self._first_value(result) for ref_id, result in results.items()}
 
 # ↑ STORS ---------------------------------------------------------------------------------→ CACHE ↓
     @log_call
-    def _gen_cache_payload(self, marketplace : Marketplace, details : bool = False) -> dict:
+    def _gen_cache_query(self, marketplace : Marketplace, details : bool = False) -> GrafanaQuery:
         """
-        Создает запрос для получения кэша по МП
+        Создает query для получения кэша по МП
 
         Params:
             marketplac(Marketplace) : МП для которого будет составлятся запрос
-            details(bool) : Если указан True - вернет запрос который вернет детальную статистику кэша
+            details(bool) : Если указан True - вернет query который вернет детальную статистику кэша
         Returns:
-            dict: Запрос
-
+            GrafanaQuery: query (окно 6 часов - как на дашборде)
         """
-        SECONDS_IN_6HORS = datetime.timedelta(hours=6).total_seconds() # 6 часов стоит в запросе дашборда, подозреваю что связано с тем что обмен остатков в кэш происходит раз в 6 часов
         sources_map = {
             Env.LTS : GrafanaAPI.Sources.LTS_POSTGRES_DATASOURCE,
             Env.LATEST : GrafanaAPI.Sources.LATEST_POSTGRES_DATASOURCE,
             Env.POLZA : GrafanaAPI.Sources.POLZA_POSTGRES_DATASOURCE
         }
+        # 6 часов стоит в запросе дашборда, подозреваю что связано с тем что обмен остатков в кэш происходит раз в 6 часов
         if not details:
-            payload = {"queries" : [
-                    {
-                        "refId" : "A", # стандартный refId графаны
-                        "datasource" : sources_map[marketplace.env],
-                        "rawSQL" : GrafanaAPI.SQLRequsts.CACHE_SQL.format(mp_guid = f"'{marketplace.guid}'"),
-                        "format" : "table",
-                        "maxDataPoints" : 1384
-                    }
-                ],
-                "range" : {
-                    "from" : (datetime.datetime.now() - datetime.timedelta(hours=6)).isoformat(),
-                    "to" : datetime.datetime.now().isoformat(),
-                    "raw" : {
-                        "from" : "now-6h",
-                        "to" : "now"
-                    }
-                },
-                "from" : f"{time.time() - SECONDS_IN_6HORS}",
-                "to" : f"{time.time()}"
-            }
-
-            return payload
-        else:
-            payload = {"queries" : [
-                    {
-                        "refId" : "A", # стандартный refId графаны
-                        "datasource" : sources_map[marketplace.env],
-                        "rawSQL" : GrafanaAPI.SQLRequsts.DITAILS_CACHE_SQL.format(mp_name = marketplace.name),
-                        "format" : 1,
-                        "maxDataPoints" : 1384
-                    }
-                ],
-                "range" : {
-                    "from" : (datetime.datetime.now() - datetime.timedelta(hours=6)).isoformat(),
-                    "to" : datetime.datetime.now().isoformat(),
-                    "raw" : {
-                        "from" : "now-6h",
-                        "to" : "now"
-                    }
-                },
-                "from" : f"{time.time() - SECONDS_IN_6HORS}",
-                "to" : f"{time.time()}"
-            }
-            return payload
+            return GrafanaQuery(
+                ref_id="CACHE_STATUS",
+                datasource=sources_map[marketplace.env],
+                raw_sql=GrafanaAPI.SQLRequsts.CACHE_SQL.format(mp_guid = f"'{marketplace.guid}'"),
+                format="table",
+                minutes=360
+            )
+        return GrafanaQuery(
+            ref_id="CACHE_DETAILS",
+            datasource=sources_map[marketplace.env],
+            raw_sql=GrafanaAPI.SQLRequsts.DITAILS_CACHE_SQL.format(mp_name = marketplace.name),
+            format=1,
+            minutes=360
+        )
 
     @log_call
     async def get_status_cache(self, marketplace: Marketplace) -> str | tuple[str, dict]:
@@ -256,92 +349,37 @@ class GrafanaClient:
         Запрашивает статус кэша остатков.  
         Если статус не `SUCCESS`, дополнительно получает детальную статистику по кэшу в каждом РК маркетплейса.
         """
-        if not self.cl_session:
-            raise RuntimeError("Сессия не инициализирована. Используй `async with GrafanaClient()`")
-        
-        url = f"{GrafanaAPI.Endpoints.BASE_URL}{GrafanaAPI.Endpoints.QUERY_ENDPOINT}"
-        header = {"Content-Type": "application/json"}
-        header["cookie"] = self.COOKIES.get("cookie", "")
-        
-        payload = self._gen_cache_payload(marketplace)
-        
-        # Логируем payload для отладки
-        log_msg(f"Payload для кэша: {json.dumps(payload, indent=2)}", LogLevel.DEBUG)
-        
-        async with self.cl_session.post(url=url, headers=header, json=payload) as resp:
-            # Получаем текст ответа для отладки
-            response_text = await resp.text()
-            log_msg(f"Response status: {resp.status}, Response: {response_text}", LogLevel.DEBUG)
-            
-            if resp.status == 200:
-                try:
-                    res = await resp.json()
-                    results = res.get("results") or {}
-                    region_resp = results.get("A") or {}
-                    
-                    # Получаем frames из ответа
-                    frames = region_resp.get("frames") or []
-                    if frames:
-                        frame = frames[0]
-                        data = frame.get("data") or {}
-                        values = data.get("values") or []
-                        
-                        if values and len(values) > 0 and len(values[0]) > 0:
-                            cache_status = values[0][0]
-                        else:
-                            cache_status = "Нет данных"
-                    else:
-                        cache_status = "Нет данных"
-
-                    if cache_status != "SUCCESS":
-                        # Получаем детальную статистику
-                        payload_details = self._gen_cache_payload(marketplace, details=True)
-                        details_cache = {}
-                        
-                        async with self.cl_session.post(url=url, headers=header, json=payload_details) as details_resp:
-                            details_response_text = await details_resp.text()
-                            log_msg(f"Details response status: {details_resp.status}, Response: {details_response_text}", LogLevel.DEBUG)
-                            
-                            if details_resp.status == 200:
-                                details_res = await details_resp.json()
-                                details_results = details_res.get("results") or {}
-                                details_region_resp = details_results.get("A") or {}
-                                details_frames = details_region_resp.get("frames") or []
-                                
-                                if details_frames:
-                                    details_frame = details_frames[0]
-                                    details_data = details_frame.get("data") or {}
-                                    details_values = details_data.get("values") or []
-                                    
-                                    if details_values and len(details_values) >= 4:
-                                        regions = details_values[0]  # org_name
-                                        db_counts = details_values[1]  # db_count
-                                        cache_counts = details_values[2]  # cache_count
-                                        percents = details_values[3]  # percent
-
-                                        for region, db_count, cache_count, percent in zip(regions, db_counts, cache_counts, percents):
-                                            details_cache[region] = {
-                                                "db": db_count,
-                                                "cache": cache_count,
-                                                "%": percent
-                                            }
-                                        
-                                        return cache_status, details_cache
-                            
-                            log_msg("Не удалось получить детальную статистику → вернул только статус", LogLevel.WARN)
-                            return cache_status
-                    else:
-                        return cache_status
-                        
-                except Exception as e:
-                    log_msg(f"Ошибка парсинга ответа: {e}", LogLevel.ERORR)
-                    return f"Ошибка парсинга ответа: {e}"
-            else:
-                return f"Не удалось получить ответ → Статус запроса: {resp.status}\nResponse: {response_text}"
+        status_query = self._gen_cache_query(marketplace)
+        result = (await self.get_queries([status_query]))[status_query.ref_id]
+        if isinstance(result, str):
+            return result
+
+        cache_status = self._first_value(result)
+        if cache_status == "SUCCESS":
+            return cache_status
+
+        # Получаем детальную статистику
+        details_query = self._gen_cache_query(marketplace, details=True)
+        details_result = (await self.get_queries([details_query]))[details_query.ref_id]
+
+        if not isinstance(details_result, str) and details_result and len(details_result[0].values) >= 4:
+            details_cache = {}
+            # колонки: org_name | db_count | cache_count | percent
+            for region, db_count, cache_count, percent in details_result[0].rows():
+                details_cache[region] = {
+                    "db": db_count,
+                    "cache": cache_count,
+                    "%": percent
+                }
+            return cache_status, details_cache
+
+        log_msg("Не удалось получить детальную статистику → вернул только статус", LogLevel.WARN)
+        return cache_status
 
 # ↑ CACHE ---------------------------------------------------------------------------------→ EXCHANGES ↓
     @log_call
-    async def _gen_msearch_payload(self, marketplace : Marketplace, min : int, elk_req_map : dict) -> str:
+    async def _gen_msearch_payload(self, marketplace : Marketplace, min : int, elk_req_map : dict, interval_ms : int = 300000,
+                                   now_ms : int | None = None) -> str:
         """
         Создает тело для /_msearch запроса.
 
@@ -349,6 +387,8 @@ class GrafanaClient:
             marketplace(Marketplace) : маркетплейс
             min(int) : минуты для открезка времени от текущего до текущее минус указаные минуты
             elk_req_map : словарь где Env ключ, а LuceneRequestes значение
+            interval_ms(int) : шаг date_histogram в миллисекундах (по умолчанию 5 минут как на дашборде)
+            now_ms(int|None) : верхняя граница поиска в миллисекундах (по умолчанию - сейчас)
         Returns:
             str : запрос для /_msearch
         """
@@ -356,6 +396,11 @@ class GrafanaClient:
             Env.LTS : GrafanaAPI.Sources.ELK_LTS_SOURCE,
             Env.LATEST : GrafanaAPI.Sources.ELK_LATEST_SOURCE
         }
+
+        if now_ms is None:
+            now_ms = int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000) # сейчас в миллисекундах
+        lte = now_ms
+        gte = now_ms - min * 60 * 1000 # сейчас - временной отрезок = стартовое время
         
         header = {"index" : elk_sources_map[marketplace.env]}
         body = {
@@ -366,8 +411,8 @@ class GrafanaClient:
                         {
                             "range": {
                                 "@timestamp": {
-                                "gte": int((datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=min)).timestamp() * 1000), # сейчас - временной отрезок = стартовое время и умножаем на 1000 что бы было в миллисекундах
-                                "lte": int((datetime.datetime.now(datetime.timezone.utc)).timestamp() * 1000) # сейчас в миллисекундах 
+                                "gte": gte,
+                                "lte": lte
                                 }
                             }
                         },
@@ -385,11 +430,11 @@ class GrafanaClient:
                     "field": "@timestamp",
                     "min_doc_count": 0,
                     "extended_bounds": {
-                    "min": int((datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=min)).timestamp() * 1000), # сейчас - временной отрезок = стартовое время и умножаем на 1000 что бы было в миллисекундах,
-                    "max": int((datetime.datetime.now(datetime.timezone.utc)).timestamp() * 1000) # сейчас в миллисекундах 
+                    "min": gte,
+                    "max": lte
                     },
                     "format": "epoch_millis",
-                    "fixed_interval": "300000ms"
+                    "fixed_interval": f"{interval_ms}ms"
                 },
                 "aggs": {}
                 }
@@ -398,9 +443,36 @@ class GrafanaClient:
 
         payload = f"{json.dumps(header)}\n{json.dumps(body)}" + '\n'
         return payload
+
+    def _smallest_span_with_hits(self, response : dict, time_map : list[int], interval_ms : int, now_ms : int) -> tuple[int, int]:
+        """
+        По бакетам date_histogram из ответа на поиск за самый большой отрезок считает локально
+        наименьший отрезок из time_map в котором есть hits и количество hits за него.
+
+        Отрезок - [now_ms - span, now_ms], now_ms - верхняя граница (lte) того же поиска. Бакет учитывается если начинается внутри отрезка.
+        Если now_ms и отрезки кратны шагу гистограммы - границы отрезков совпадают с границами бакетов
+        и hits те же что hits.total поиска за этот отрезок. Иначе бакет на нижней границе не учитывается (hits не больше чем за отрезок)
+
+        Args:
+            response(dict): один элемент responses из ответа /_msearch
+            time_map(list[int]): отрезки в минутах по возрастанию
+            interval_ms(int): шаг гистограммы в миллисекундах
+            now_ms(int): верхняя граница поиска (lte) в миллисекундах
+        Returns:
+            tuple[int, int]: hits и отрезок (в минутах). Если hits нет - 0 и последний отрезок
+        """
+        aggregations = response.get("aggregations") or {}
+        buckets = (aggregations.get("2") or {}).get("buckets") or []
+
+        for span in time_map:
+            cutoff = now_ms - span * 60 * 1000
+            hits = sum(bucket.get("doc_count") or 0 for bucket in buckets if cutoff <= bucket.get("key", 0) <= now_ms)
+            if hits > 0:
+                return hits, span
+        return 0, time_map[-1]
     
     @log_call
-    async def get_value_exchanges_by_req(self, marketplace : Marketplace, elk_req_map : dict, time_map : list[int] | None = None) -> tuple[int|str, int]:
+    async def get_value_exchanges_by_req(self, marketplace : Marketplace, elk_req_map : dict, time_map : list[int] | None = None, single_query : bool = True) -> tuple[int|str, int]:
         """
         Прокидывает Lucene запрос в ELK и возвращает значение количества hits и временной промежуток за который hits стало > 0
 
@@ -420,6 +492,9 @@ class GrafanaClient:
                     * 360 минут (6 часов)
                     * 720 минут (12 часов)
                     * 1440 минут (24 часа)
+            single_query(bool): 
+                - True (по умолчанию) - один поиск за самый большой отрезок, нужный отрезок считается по бакетам гистограммы (шаг 1 минута)
+                - False - поиск по каждому отрезку по очереди пока hits не станет > 0 (до len(time_map) запросов)
         Returns:
             tuple[int|str, int]: 
                 - hits и временной промежуток (в минутах) за который hits стало > 0
@@ -436,35 +511,207 @@ class GrafanaClient:
         }
 
         url = f"{GrafanaAPI.Endpoints.BASE_URL}{GrafanaAPI.Endpoints.ELK_MULTI_SEARCH_ENDPOINT.format(source_id = elk_sources_id_map[marketplace.env])}"
-        print(url)
         header = {"Content-Type" : "application/x-ndjson"}
-        header["cookie"] = self.COOKIES.get("cookie", "")
 
         if not time_map: # если не указано
             time_map = [5, 10, 15, 30, 60, 120, 240, 360, 720, 1440]
+
+        if single_query:
+            results = await self.get_value_exchanges_batch([(marketplace, elk_req_map)], time_map)
+            return results[0]
         
         for span in time_map:
             payload = await self._gen_msearch_payload(marketplace, span, elk_req_map)
             
-            async with self.cl_session.post(url=url, headers=header, data=payload) as resp:
+            async with self._post(url, header, {"span_minutes": span, "searches": 1}, data=payload) as resp:
                 res = await resp.json()
                 if resp.status == 200:
                     responses = res.get("responses") or []
                     response = responses[0] or {}
                     hits = response.get("hits") or {}
                     total = hits.get("total") or {}
-                    value = total.get("value") or -1
+                    value = total.get("value", -1)
                     if value == 0:
                         continue
                     elif value == -1:
-                        log_msg(f"Не удалось получить ответ → Статус запроса: {resp.status}, Responce: {responses}", LogLevel.WARN)
+                        log_msg("Не удалось получить ответ → Статус запроса: %s, Responce: %s", LogLevel.WARN, resp.status, responses)
                     else:
                         return value, span
                 else:
                     value = f"Не удалось получить ответ → Статус запроса: {resp.status}, Responce: {await resp.text()}"
         return value, span
 
-# ↑ EXCHANGES ---------------------------------------------------------------------------------→ QUERIES ↓
+    @log_call
+    async def get_value_exchanges_batch(self, requests : list[tuple[Marketplace, dict]], time_map : list[int] | None = None, chunk_size : int = 50) -> list[tuple[int|str, int]]:
+        """
+        То же что get_value_exchanges_by_req в режиме single_query, но для многих запросов сразу:
+        пары (маркетплейс, Lucene запрос) пакуются в один NDJSON body для /_msearch (на каждый ELK источник свой запрос).
+        Например заказы/остатки/цены одного МП или одних и тех же обменов по нескольким МП - один HTTP запрос вместо N.
+
+        Args:
+            requests(list[tuple[Marketplace, dict]]): пары маркетплейс и словарь запросов где Env ключ, а LuceneRequestes значение
+            time_map(list[int]): отрезки в минутах по возрастанию (см. get_value_exchanges_by_req)
+            chunk_size(int): максимум поисков в одном /_msearch. Большие пачки режутся на части, части отправляются параллельно
+        Returns:
+            list[tuple[int|str, int]]: (hits, отрезок) для каждого запроса в том же порядке что и requests
+                - Вместо hits может быть строка если запрос или конкретный поиск завершился ошибкой
+        """
+        if not self.cl_session:
+            raise RuntimeError("Сессия не инициализирована. Используй `async with GrafanaClient()`")
 
-    async def get_queries(self):
-        ...
+        elk_sources_id_map = {
+            Env.LTS : GrafanaAPI.Sources.ELK_LTS_SOURCE_ID,
+            Env.LATEST : GrafanaAPI.Sources.ELK_LATEST_SOURCE_ID
+        }
+        header = {"Content-Type" : "application/x-ndjson"}
+
+        if not time_map: # если не указано
+            time_map = [5, 10, 15, 30, 60, 120, 240, 360, 720, 1440]
+        span = time_map[-1]
+        interval_ms = 60000 # минутные бакеты - точность подбора отрезка 1 минута
+
+        # индексы запросов сгруппированные по ELK источнику (у каждого источника свой URL)
+        results: list[tuple[int|str, int]] = [("Нет данных", span)] * len(requests)
+
+        by_source: dict[int, list[int]] = {}
+        for i, (marketplace, _) in enumerate(requests):
+            if marketplace.env not in elk_sources_id_map:
+                results[i] = (f"Нет ELK источника для окружения {marketplace.env.value}", span)
+                continue
+            by_source.setdefault(elk_sources_id_map[marketplace.env], []).append(i)
+
+        async def fetch(source_id : int, indexes : list[int]) -> None:
+            url = f"{GrafanaAPI.Endpoints.BASE_URL}{GrafanaAPI.Endpoints.ELK_MULTI_SEARCH_ENDPOINT.format(source_id = source_id)}"
+            # верхняя граница одна на поиск и на разбор, кратна шагу - границы отрезков совпадают с границами бакетов
+            now_ms = int(time.time() * 1000) // interval_ms * interval_ms
+            payload = "".join([await self._gen_msearch_payload(requests[i][0], span, requests[i][1], interval_ms, now_ms) for i in indexes])
+
+            async with self._post(url, header, {"span_minutes": span, "searches": len(indexes), "source_id": source_id}, data=payload) as resp:
+                if resp.status != 200:
+                    error = f"Не удалось получить ответ → Статус запроса: {resp.status}, Responce: {await resp.text()}"
+                    for i in indexes:
+                        results[i] = (error, span)
+                    return
+                res = await resp.json()
+
+            # responses приходят в том же порядке что и поиски в body
+            responses = res.get("responses") or []
+            for i, response in zip(indexes, responses):
+                response = response or {}
+                if "error" in response:
+                    results[i] = (f"ELK вернул ошибку: {response.get('error')}", span)
+                else:
+                    results[i] = self._smallest_span_with_hits(response, time_map, interval_ms, now_ms)
+
+        chunks = []
+        for source_id, indexes in by_source.items():
+            for start in range(0, len(indexes), chunk_size):
+                chunks.append(fetch(source_id, indexes[start:start + chunk_size]))
+        await asyncio.gather(*chunks)
+
+        return results
+
+# ↑ EXCHANGES ---------------------------------------------------------------------------------→ CELARY ↓
+    @log_call
+    def _gen_celary_queries(self, namespaces : list[str], minutes : int, step : int, instant : bool) -> list[GrafanaQuery]:
+        """
+        Создает query на длину очередей Celery по namespace'ам (каждый namespace - отдельный query со своим refId и источником)
+
+        Args:
+            namespaces(list[str]): namespace'ы (LTS, LATEST, POLZA, BFF)
+            minutes(int): за сколько минут брать ряд (для instant - только конец отрезка)
+            step(int): шаг ряда в секундах
+            instant(bool): True - только текущее значение, False - ряд за отрезок
+        Returns:
+            list[GrafanaQuery]: query (refId = namespace)
+        """
+        pql_map = {
+            "LTS" : (GrafanaAPI.PQLRequstes.LTS_CELARY_PQL, GrafanaAPI.Sources.LTS_VICTORIA_METRICS_DATASOURCE),
+            "LATEST" : (GrafanaAPI.PQLRequstes.LATEST_CELARY_PQL, GrafanaAPI.Sources.LATEST_PROMETHEUS_DATASOURCE),
+            "POLZA" : (GrafanaAPI.PQLRequstes.POLZA_CELARY_PQL, GrafanaAPI.Sources.POLZA_PROMETHEUS_DATASOURCE),
+            "BFF" : (GrafanaAPI.PQLRequstes.BFF_CELARY_PQL, GrafanaAPI.Sources.BFF_PROMETHEUS_DATASOURCE),
+        }
+
+        queries = []
+        for namespace in namespaces:
+            pql, source = pql_map[namespace]
+            queries.append(GrafanaQuery(
+                ref_id=namespace,
+                datasource=source,
+                expr=pql,
+                format="time_series",
+                minutes=minutes,
+                options={
+                    "legendFormat" : "{{queue_name}}",
+                    "instant" : instant,
+                    "range" : not instant,
+                    "interval" : f"{step}s",
+                    "intervalMs" : step * 1000,
+                    "maxDataPoints" : minutes * 60 // step + 1,
+                }
+            ))
+        return queries
+
+    def _growth_rate(self, time_map : list[int], values : list[int]) -> float | None:
+        """
+        Наклон прямой (метод наименьших квадратов) через точки backlog - сообщений в минуту.
+        Наклон по всем точкам меньше реагирует на единичные всплески чем (последняя - первая) / время
+        """
+        if len(time_map) < 2:
+            return None
+        minutes = [(t - time_map[0]) / 60000 for t in time_map]
+        mean_x = sum(minutes) / len(minutes)
+        mean_y = sum(values) / len(values)
+        var_x = sum((x - mean_x) ** 2 for x in minutes)
+        if var_x == 0:
+            return None
+        return sum((x - mean_x) * (y - mean_y) for x, y in zip(minutes, values)) / var_x
+
+    def _parse_celary_frames(self, frames : list[GrafanaFrame], instant : bool) -> CelaryData:
+        """
+        Собирает ряды очередей одного namespace (каждый frame - одна очередь: колонки время | длина) в CelaryData
+        """
+        series : dict[str, dict[int, int]] = {}
+        for frame in frames:
+            if len(frame.values) < 2:
+                continue
+            labels = frame.labels[1] if len(frame.labels) > 1 else {}
+            column = frame.columns[1] if len(frame.columns) > 1 else None
+            name = labels.get("queue_name") or labels.get("queue") or column or f"queue_{len(series)}"
+            points = series.setdefault(name, {})
+            for ts, value in zip(frame.values[0], frame.values[1]):
+                if value is not None:
+                    points[int(ts)] = points.get(int(ts), 0) + int(value)
+
+        time_map = sorted({ts for points in series.values() for ts in points})
+        queues = {name: [points.get(ts, 0) for ts in time_map] for name, points in series.items()}
+        totals = [sum(column) for column in zip(*queues.values())] if queues else []
+
+        return CelaryData(
+            names=list(queues),
+            time=time_map,
+            vlaues=totals,
+            queues=queues,
+            growth_rate=None if instant else self._growth_rate(time_map, totals)
+        )
+
+    @log_call
+    async def get_celary_queues(self, namespaces : list[str] | None = None, minutes : int = 30, step : int = 60, instant : bool = False) -> dict[str, CelaryData | str]:
+        """
+        Получает длину очередей Celery по всем namespace одним запросом /api/ds/query (а не запросом на каждую очередь/namespace)
+
+        Args:
+            namespaces(list[str]|None): какие namespace'ы запрашивать (LTS, LATEST, POLZA, BFF). Если не указаны - все
+            minutes(int): за сколько последних минут брать ряд
+            step(int): шаг ряда в секундах
+            instant(bool): True - только текущая длина очередей (без ряда и без growth_rate)
+        Returns:
+            dict[str, CelaryData|str]: namespace - ключ, CelaryData - значение
+                - Вместо CelaryData будет строка если запрос или конкретный query завершился ошибкой
+        """
+        namespaces = namespaces or ["LTS", "LATEST", "POLZA", "BFF"]
+        results = await self.get_queries(self._gen_celary_queries(namespaces, minutes, step, instant))
+        return {
+            namespace: result if isinstance(result, str) else self._parse_celary_frames(result, instant)
+            for namespace, result in results.items()
+        }
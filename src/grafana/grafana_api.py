@@ -1,10 +1,11 @@
+import os
 from enum import Enum
 
 class GrafanaAPI():
     
     class Endpoints():
 
-        BASE_URL = "https://grafana02.puls.ru"
+        BASE_URL = os.getenv("GRAFANA_URL", "https://grafana02.puls.ru") # переопределяется для локальных стендов (tests/bench)
 
         AUTH_ENDPONT = "/login"
         ELK_MULTI_SEARCH_ENDPOINT = "/api/datasources/proxy/{source_id}/_msearch"
@@ -35,13 +36,19 @@ class GrafanaAPI():
         LATEST_STORS_SQL = "select uniqExact(`after.marketplace_store_id`) from (select * from `default`.`ecomlatest.debezium.cdc.public.delivery_organizationaddress` FINAL) oa inner join (select * from `default`.`ecomlatest.debezium.cdc.public.delivery_marketplacestore` FINAL) ms on oa.`after.marketplace_store_id` = ms.`after.id` WHERE ms.`after.is_active` and `after.organization_id` = {org_id} and `after.marketplace_id` = {mp_id}"
         POLZA_STORS_SQL = "select uniqExact(`after.marketplace_store_id`) from (select * from `default`.`ecompolza.debezium.cdc.public.delivery_organizationaddress` FINAL) oa inner join (select * from `default`.`ecompolza.debezium.cdc.public.delivery_marketplacestore` FINAL) ms on oa.`after.marketplace_store_id` = ms.`after.id` WHERE ms.`after.is_active` and `after.organization_id` = {org_id} and `after.marketplace_id` = {mp_id}"
 
+        # Те же запросы, но сгруппированные по организации и маркетплейсу: один запрос на все РК (и на несколько МП одного окружения).
+        # Таблицы с FINAL сканируются один раз вместо одного раза на каждый РК. Возвращает таблицу org_id | mp_id | stors
+        LTS_STORS_GROUPED_SQL = "select `after.organization_id` as org_id, `after.marketplace_id` as mp_id, uniqExact(`after.marketplace_store_id`) as stors from (select * from `default`.`ecom-lts.debezium.cdc.public.delivery_organizationaddress` FINAL) oa inner join (select * from `default`.`ecom-lts.debezium.cdc.public.delivery_marketplacestore` FINAL) ms on oa.`after.marketplace_store_id` = ms.`after.id` WHERE ms.`after.is_active` and `after.organization_id` IN ({org_ids}) and `after.marketplace_id` IN ({mp_ids}) GROUP BY org_id, mp_id"
+        LATEST_STORS_GROUPED_SQL = "select `after.organization_id` as org_id, `after.marketplace_id` as mp_id, uniqExact(`after.marketplace_store_id`) as stors from (select * from `default`.`ecomlatest.debezium.cdc.public.delivery_organizationaddress` FINAL) oa inner join (select * from `default`.`ecomlatest.debezium.cdc.public.delivery_marketplacestore` FINAL) ms on oa.`after.marketplace_store_id` = ms.`after.id` WHERE ms.`after.is_active` and `after.organization_id` IN ({org_ids}) and `after.marketplace_id` IN ({mp_ids}) GROUP BY org_id, mp_id"
+        POLZA_STORS_GROUPED_SQL = "select `after.organization_id` as org_id, `after.marketplace_id` as mp_id, uniqExact(`after.marketplace_store_id`) as stors from (select * from `default`.`ecompolza.debezium.cdc.public.delivery_organizationaddress` FINAL) oa inner join (select * from `default`.`ecompolza.debezium.cdc.public.delivery_marketplacestore` FINAL) ms on oa.`after.marketplace_store_id` = ms.`after.id` WHERE ms.`after.is_active` and `after.organization_id` IN ({org_ids}) and `after.marketplace_id` IN ({mp_ids}) GROUP BY org_id, mp_id"
+
         # Этот запрос я составил сам. Он выбирает по имени маркетплейса и в запросе не используется конкретное окружение, то есть его использовать нужно совместно с LTS_POSTGRES, LATEST_POSTGRES или POLZA_POSTGRES. Этот статус возвращает таблицу с количеством остатков в БД, в КЭШе и их процентное РАСХОЖДЕНИЕ
         DITAILS_CACHE_SQL = "SELECT DISTINCT ON (s.org_name, mm.name, s.marketplace_guid) s.org_name, s.db_count, s.cache_count, s.percent FROM statistic_nonzerostockmetric s INNER JOIN marketplace_marketplace mm ON mm.guid = s.marketplace_guid::uuid and mm.name = {mp_name} WHERE s.actual = true ORDER BY s.org_name, s.marketplace_guid;"
         # Этот запрос с дашборда (я его совсем каплю подредактировал что бы выводился только статус), он возвращает ТОЛЬКО статус кэша для МП
         CACHE_SQL = "select status from statistic_nonzerostockmetricstatus where actual=True and marketplace_guid={mp_guid};"
                      
     class PQLRequstes():
-        LTS_CELARY_PQL = "celery_queue_length{namespace=s~\"master-ecommerce\"}"
+        LTS_CELARY_PQL = "celery_queue_length{namespace=~\"master-ecommerce\"}"
         LATEST_CELARY_PQL = "celery_queue_length{namespace=~\"ecom-latest-prod\"}"
         POLZA_CELARY_PQL = "celery_queue_length{namespace=~\"ecommerce-prod\"}"
         BFF_CELARY_PQL = "celery_queue_length{namespace=~\"bff-prod\"}"
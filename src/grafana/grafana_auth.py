@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+import json
+import os
+
+from aiohttp import ClientSession
+from dotenv import load_dotenv
+
+from src.loger import LogLevel, log_call, log_msg
+from src.grafana.grafana_exception import GrafanaAuthException
+from src.grafana.grafana_api import GrafanaAPI
+
+class GrafanaAuth:
+    """
+    Общая на процесс сессия авторизации в Grafana (кука grafana_session).
+
+    - конфиг с сессией читается с диска один раз, дальше срок жизни хранится в памяти
+    - сессия обновляется заранее, за refresh_before секунд до истечения
+    - одновременно идет не больше одного /login: остальные клиенты ждут его результат, а не логинятся параллельно
+    - invalidate() помечает сессию протухшей (после 401), повторный логин будет один даже если 401 получили сразу несколько запросов
+    """
+
+    def __init__(self, path_to_config : str = "src/grafana/grafana_config.json", refresh_before : int = 300) -> None:
+        """
+        Args:
+            path_to_config(str): файл в котором сессия переживает перезапуск процесса
+            refresh_before(int): за сколько секунд до истечения сессии логиниться заново
+        """
+        self.path_to_config = path_to_config
+        self.refresh_before = refresh_before
+        self.session : str | None = None
+        self.expires_at : int | None = None # unix время истечения, None - срок неизвестен (живет до 401)
+        self._loaded = False
+        self._login_task : asyncio.Task | None = None
+        self.logins = 0 # сколько раз реально ходили в /login (для отладки)
+
+    def _load(self) -> None:
+        """
+        Читает сессию из конфига (один раз за процесс)
+        """
+        self._loaded = True
+        try:
+            with open(self.path_to_config, "r") as cfg:
+                config = json.load(cfg)
+        except (OSError, json.JSONDecodeError) as e:
+            log_msg(f"Не удалось прочитать {self.path_to_config}: {e}", LogLevel.WARN)
+            return
+        self.session = config.get("session")
+        # 0 в конфиге - срок жизни не пришел при логине, после перезапуска такой сессии не доверяем
+        self.expires_at = config.get("last_date_live") or 0
+
+    def _save(self) -> None:
+        config = {
+            "session": self.session,
+            "last_date_live": self.expires_at or 0
+        }
+        tmp_path = f"{self.path_to_config}.tmp"
+        with open(tmp_path, "w") as cfg:
+            cfg.write(json.dumps(config, indent=4))
+        os.replace(tmp_path, self.path_to_config) # параллельный читатель не увидит недописанный файл
+
+    def is_fresh(self) -> bool:
+        """
+        True если сессия есть и до ее истечения больше refresh_before секунд
+        """
+        if not self._loaded:
+            self._load()
+        if not self.session:
+            return False
+        if self.expires_at is None:
+            return True
+        now = int(datetime.datetime.now().timestamp())
+        return now < self.expires_at - self.refresh_before
+
+    async def get_session(self, cl_session : ClientSession) -> str:
+        """
+        Возвращает живую сессию, при необходимости логинится (не больше одного /login одновременно)
+
+        Args:
+            cl_session(ClientSession): http сессия через которую пойдет /login
+        Returns:
+            str: значение куки grafana_session
+        """
+        if self.is_fresh():
+            return self.session
+
+        task = self._login_task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.create_task(self._login(cl_session), name="grafana-login")
+            self._login_task = task
+        # shield - отмена одного ожидающего не отменяет логин для остальных
+        return await asyncio.shield(task)
+
+    def invalidate(self, stale_session : str | None) -> None:
+        """
+        Помечает сессию протухшей (сервер ответил 401).
+        Если сессию уже обновил кто-то другой (stale_session != текущей) - ничего не делает.
+        """
+        if stale_session is not None and stale_session == self.session and self.expires_at != 0:
+            log_msg("Grafana вернула 401 → сессия будет обновлена", LogLevel.WARN)
+            self.expires_at = 0
+
+    @log_call
+    async def _login(self, cl_session : ClientSession) -> str:
+        """
+        Авторизация в Grafana и получение сессионной куки.
+        Сохраняет значение куки и время ее жизни в память и в конфиг.
+        В случае ошибки выбрасывает исключение GrafanaAuthException.
+        """
+        auth_url = GrafanaAPI.Endpoints.BASE_URL + GrafanaAPI.Endpoints.AUTH_ENDPONT
+
+        load_dotenv("creds.env")
+        payload = {
+            "password": os.getenv("GRAFANA_PASSWORD"),
+            "user": os.getenv("GRAFANA_LOGIN")
+        }
+        self.logins += 1
+        async with cl_session.post(auth_url, json=payload) as response:
+            if response.status != 200:
+                data = await response.json()
+                msg = "Неверный логин или пароль" if data.get("message") == "Invalid username or password" else data.get("message")
+                raise GrafanaAuthException(response.status, response.cookies, f"Ошибка авторизации: {msg}")
+
+            grafana_session_cookie = response.cookies.get("grafana_session")
+            if not grafana_session_cookie:
+                raise GrafanaAuthException(response.status, response.cookies, "Не удалось получить grafana_session")
+
+            grafana_session_max_age = grafana_session_cookie["max-age"] if grafana_session_cookie["max-age"] else None
+
+        self.session = grafana_session_cookie.value
+        self.expires_at = int(datetime.datetime.now().timestamp()) + int(grafana_session_max_age) if grafana_session_max_age else None
+        self._save()
+        return self.session
+
+GRAFANA_AUTH = GrafanaAuth() # одна сессия авторизации на процесс
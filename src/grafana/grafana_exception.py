@@ -1,5 +1,5 @@
 from typing import Any
-from loger import log_msg
+from src.loger import log_msg
 
 class GrafanaException(Exception):
     pass
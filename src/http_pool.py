@@ -0,0 +1,161 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig, DummyCookieJar
+from pydantic import BaseModel
+
+from src.loger import log_msg, LogLevel
+from src.http_replay import Cassette, RecordingSession, ReplaySession
+
+class PoolSettings(BaseModel):
+    """
+    Настройки общего пула соединений. Значения по умолчанию можно переопределить переменными окружения (см. from_env)
+    """
+    limit : int = 100 # всего соединений
+    limit_per_host : int = 20 # соединений на один хост (grafana02 / redash)
+    keepalive_timeout : float = 60.0 # сколько секунд держать простаивающее соединение открытым
+    dns_ttl : int = 300 # сколько секунд кэшировать DNS
+    connect_timeout : float = 10.0
+    read_timeout : float = 120.0 # Redash может долго отдавать большой результат
+    mode : str = "live" # live - обычная сеть, record - сеть + запись в кассету, replay - ответы из кассеты без сети
+    cassette : str | None = None # путь к кассете (см. src/http_replay.py)
+    replay_scale : float = 1.0 # replay: записанная задержка умножается на это число (0 - без задержек)
+    replay_latency : float | None = None # replay: фиксированная задержка каждого ответа вместо записанной
+
+    @classmethod
+    def from_env(cls) -> "PoolSettings":
+        env_map = {
+            "limit" : "HTTP_LIMIT",
+            "limit_per_host" : "HTTP_LIMIT_PER_HOST",
+            "keepalive_timeout" : "HTTP_KEEPALIVE",
+            "dns_ttl" : "HTTP_DNS_TTL",
+            "connect_timeout" : "HTTP_CONNECT_TIMEOUT",
+            "read_timeout" : "HTTP_READ_TIMEOUT",
+            "mode" : "HTTP_MODE",
+            "cassette" : "HTTP_CASSETTE",
+            "replay_scale" : "HTTP_REPLAY_SCALE",
+            "replay_latency" : "HTTP_REPLAY_LATENCY",
+        }
+        values = {field: os.getenv(var) for field, var in env_map.items() if os.getenv(var)}
+        return cls(**values)
+
+class PoolStats(BaseModel):
+    """
+    Счетчики пула: сколько запросов, сколько из них ушло по новому соединению (TCP/TLS handshake), а сколько по переиспользованному
+    """
+    requests : int = 0
+    new_connections : int = 0
+    reused_connections : int = 0
+    queued : int = 0 # сколько раз запрос ждал свободного соединения из-за лимита
+    dns_cache_hits : int = 0
+    dns_cache_misses : int = 0
+    sessions_created : int = 0
+
+class SessionManager:
+    """
+    Общая ClientSession (один TCPConnector) для GrafanaClient и RedashClient.
+    Соединения к grafana02 и redash переиспользуются между клиентами и отчетами, DNS кэшируется, есть лимиты и таймауты.
+
+    Сессия привязана к event loop: если loop сменился (например после asyncio.run), создается новая.
+    Клиенты сессию не закрывают - ее закрывает владелец процесса через close().
+
+    В режиме record сессия оборачивается в RecordingSession (кассета пишется при close()),
+    в режиме replay вместо сети отдается ReplaySession - клиентам разницы не видно.
+    """
+
+    def __init__(self, settings : PoolSettings | None = None) -> None:
+        self.settings = settings or PoolSettings.from_env()
+        self.stats = PoolStats()
+        self._session : ClientSession | RecordingSession | ReplaySession | None = None
+        self._loop : asyncio.AbstractEventLoop | None = None
+        self._cassette : Cassette | None = None
+
+    def _trace_config(self) -> TraceConfig:
+        trace = TraceConfig()
+
+        async def on_request_start(session, ctx : SimpleNamespace, params) -> None:
+            self.stats.requests += 1
+
+        async def on_connection_create_end(session, ctx : SimpleNamespace, params) -> None:
+            self.stats.new_connections += 1
+
+        async def on_connection_reuseconn(session, ctx : SimpleNamespace, params) -> None:
+            self.stats.reused_connections += 1
+
+        async def on_connection_queued_start(session, ctx : SimpleNamespace, params) -> None:
+            self.stats.queued += 1
+
+        async def on_dns_cache_hit(session, ctx : SimpleNamespace, params) -> None:
+            self.stats.dns_cache_hits += 1
+
+        async def on_dns_cache_miss(session, ctx : SimpleNamespace, params) -> None:
+            self.stats.dns_cache_misses += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_connection_queued_start.append(on_connection_queued_start)
+        trace.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace
+
+    def _create_session(self) -> ClientSession:
+        s = self.settings
+        connector = TCPConnector(
+            limit=s.limit,
+            limit_per_host=s.limit_per_host,
+            keepalive_timeout=s.keepalive_timeout,
+            ttl_dns_cache=s.dns_ttl,
+            use_dns_cache=True,
+        )
+        timeout = ClientTimeout(total=None, connect=s.connect_timeout, sock_connect=s.connect_timeout, sock_read=s.read_timeout)
+        self.stats.sessions_created += 1
+        # куки не храним в сессии: она общая для Grafana и Redash, авторизация передается заголовками
+        return ClientSession(connector=connector, timeout=timeout, trace_configs=[self._trace_config()], cookie_jar=DummyCookieJar())
+
+    def _create_transport(self) -> ClientSession | RecordingSession | ReplaySession:
+        s = self.settings
+        if s.mode == "live":
+            return self._create_session()
+        if s.mode not in ("record", "replay") or not s.cassette:
+            raise ValueError(f"HTTP_MODE={s.mode}: ожидается live, record или replay (для record/replay нужен HTTP_CASSETTE)")
+        # кассета одна на процесс - переживает смену event loop
+        if self._cassette is None:
+            self._cassette = Cassette(s.cassette) if s.mode == "record" else Cassette(s.cassette).load()
+            log_msg(f"HTTP: {'запись обменов в кассету' if s.mode == 'record' else f'воспроизведение {len(self._cassette)} обменов из'} {s.cassette}", LogLevel.INFO)
+        if s.mode == "record":
+            return RecordingSession(self._create_session(), self._cassette)
+        return ReplaySession(self._cassette, scale=s.replay_scale, latency=s.replay_latency)
+
+    def get_session(self) -> ClientSession:
+        """
+        Возвращает общую сессию для текущего event loop (создает при первом обращении).
+        В режимах record/replay - объект с тем же интерфейсом (get/post/delete как у ClientSession)
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            if self._session is not None and not self._session.closed and self._loop is not None and not self._loop.is_closed():
+                log_msg("Event loop сменился - старая HTTP сессия будет закрыта вместе со своим loop", LogLevel.DEBUG)
+            if isinstance(self._session, RecordingSession) and not self._session.closed:
+                self._session.cassette.save() # старую сессию закрыть уже нельзя, а записанное терять не хотим
+            self._session = self._create_transport()
+            self._loop = loop
+        return self._session
+
+    async def close(self) -> None:
+        """
+        Закрывает общую сессию (вызывать при завершении работы в том же loop где она создавалась)
+        """
+        if self._session is not None and not self._session.closed and self._loop is asyncio.get_running_loop():
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    def format_stats(self) -> str:
+        s = self.stats
+        return (f"запросов: {s.requests}, новых соединений: {s.new_connections}, переиспользовано: {s.reused_connections}, "
+                f"ожидали слот: {s.queued}, DNS кэш: {s.dns_cache_hits}/{s.dns_cache_hits + s.dns_cache_misses}")
+
+# общий пул процесса
+SESSIONS = SessionManager()
@@ -0,0 +1,289 @@
+import asyncio
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from http.cookies import SimpleCookie
+from typing import AsyncIterator
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from aiohttp import ClientSession
+from pydantic import BaseModel
+
+from src.loger import log_msg, LogLevel
+
+class Exchange(BaseModel):
+    """
+    Один записанный обмен: запрос (метод, путь, отпечаток тела) и ответ. Заголовки запроса не пишутся вообще (там Key Redash и кука Grafana)
+    """
+    method : str
+    path : str
+    key : str
+    status : int
+    headers : dict[str, str] = {}
+    body : str = ""
+    latency : float = 0.0 # секунд от отправки запроса до конца чтения ответа
+
+class Cassette:
+    """
+    Кассета обменов с Grafana и Redash: jsonl (gzip если имя заканчивается на .gz), первая строка - заголовок.
+
+    При воспроизведении ответы на одинаковые запросы отдаются в порядке записи (опросы статуса Job'а: PENDING → STARTED → SUCCESS),
+    когда записанные закончились - повторяется последний.
+    """
+    VERSION = 1
+    _SECRET_PARAMS = {"api_key", "key", "token", "password"}
+    _EPOCH_MS = re.compile(r"\b1\d{12}\b") # метки времени в теле _msearch меняются от запуска к запуску
+    _ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b") # даты в параметрах query Redash (Период истории) считаются от сегодня
+
+    def __init__(self, path : str) -> None:
+        self.path = path
+        self.recorded_on = datetime.date.today() # день записи - при воспроизведении даты в ответах сдвигаются на столько же дней
+        self.exchanges : dict[str, list[Exchange]] = {}
+        self._cursors : dict[str, int] = {}
+
+    @classmethod
+    def _relative_dates(cls, text : str, today : datetime.date) -> str:
+        """
+        Даты YYYY-MM-DD → <d-7> (дней от today): тело запроса за окно "последние 4 недели" одинаковое в любой день
+        """
+        def replace(match : re.Match) -> str:
+            try:
+                return f"<d{(datetime.date(*map(int, match.groups())) - today).days}>"
+            except ValueError:
+                return match.group()
+        return cls._ISO_DATE.sub(replace, text)
+
+    @classmethod
+    def shift_dates(cls, text : str, days : int) -> str:
+        """
+        Сдвигает все даты YYYY-MM-DD в тексте на days дней (ответы старой кассеты выглядят как сегодняшние)
+        """
+        if not days or "-" not in text:
+            return text
+
+        def replace(match : re.Match) -> str:
+            try:
+                return (datetime.date(*map(int, match.groups())) + datetime.timedelta(days=days)).isoformat()
+            except (ValueError, OverflowError):
+                return match.group()
+        return cls._ISO_DATE.sub(replace, text)
+
+    @classmethod
+    def request_key(cls, method : str, url : str, body : str | bytes | None, today : datetime.date | None = None) -> tuple[str, str]:
+        """
+        Путь без хоста и секретных параметров и ключ запроса (метод, путь и отпечаток нормализованного тела).
+        Хост не входит в ключ - кассету можно воспроизводить на любом BASE_URL.
+        Метки времени в мс в теле не учитываются, даты - относительно today (по умолчанию - сегодня)
+        """
+        parts = urlsplit(url)
+        query = urlencode(sorted((name, value) for name, value in parse_qsl(parts.query) if name.lower() not in cls._SECRET_PARAMS))
+        path = parts.path + (f"?{query}" if query else "")
+
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", errors="replace")
+        if path.endswith("/login"):
+            body = "" # логин и пароль не пишем и по ним не сопоставляем
+        body = cls._EPOCH_MS.sub("<ts>", body or "")
+        body = cls._relative_dates(body, today or datetime.date.today())
+        digest = hashlib.sha1(body.encode()).hexdigest()[:16]
+        return path, f"{method} {path} {digest}"
+
+    def add(self, exchange : Exchange) -> None:
+        self.exchanges.setdefault(exchange.key, []).append(exchange)
+
+    def next(self, key : str) -> Exchange | None:
+        recorded = self.exchanges.get(key)
+        if not recorded:
+            return None
+        cursor = self._cursors.get(key, 0)
+        self._cursors[key] = cursor + 1
+        return recorded[min(cursor, len(recorded) - 1)]
+
+    def rewind(self) -> None:
+        self._cursors.clear()
+
+    def __len__(self) -> int:
+        return sum(len(recorded) for recorded in self.exchanges.values())
+
+    @staticmethod
+    def _open(path : str, mode : str):
+        return gzip.open(path, mode + "t", encoding="utf-8") if path.endswith(".gz") else open(path, mode, encoding="utf-8")
+
+    def load(self) -> "Cassette":
+        with self._open(self.path, "r") as file:
+            header = json.loads(file.readline() or "{}")
+            if header.get("version") != self.VERSION:
+                raise ValueError(f"Кассета {self.path}: неизвестная версия {header.get('version')}")
+            if header.get("created"):
+                self.recorded_on = datetime.date.fromisoformat(header["created"][:10])
+            for line in file:
+                if line.strip():
+                    self.add(Exchange.model_validate_json(line))
+        self.rewind()
+        return self
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp.gz" if self.path.endswith(".gz") else f"{self.path}.tmp" # _open выбирает gzip по расширению
+        with self._open(tmp_path, "w") as file:
+            created = datetime.datetime.combine(self.recorded_on, datetime.datetime.now().time()).isoformat(timespec="seconds")
+            file.write(json.dumps({"version": self.VERSION, "created": created, "exchanges": len(self)}) + "\n")
+            for recorded in self.exchanges.values():
+                for exchange in recorded:
+                    file.write(exchange.model_dump_json() + "\n")
+        os.replace(tmp_path, self.path)
+
+# ---------------------------------------------------------------------------------→ ОТВЕТ ↓
+class _Content:
+    """
+    Замена resp.content: тело уже в памяти, iter_chunked режет его на куски как при чтении из сети
+    """
+
+    def __init__(self, body : bytes) -> None:
+        self._body = body
+
+    async def iter_chunked(self, n : int) -> AsyncIterator[bytes]:
+        for start in range(0, len(self._body), n):
+            yield self._body[start:start + n]
+
+    async def read(self) -> bytes:
+        return self._body
+
+class ReplayResponse:
+    """
+    Ответ из кассеты с тем же интерфейсом что используют клиенты у aiohttp.ClientResponse
+    """
+
+    def __init__(self, exchange : Exchange) -> None:
+        self.status = exchange.status
+        self.headers = exchange.headers
+        self._body = exchange.body.encode()
+        self.content = _Content(self._body)
+        self.content_length = len(self._body)
+        self.cookies = SimpleCookie(exchange.headers.get("Set-Cookie", ""))
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self) -> str:
+        return self._body.decode("utf-8")
+
+    async def json(self, content_type : str | None = None):
+        return json.loads(self._body) if self._body else None
+
+    def release(self) -> None:
+        pass
+
+def _strip_cookie(raw : str) -> str:
+    """
+    Set-Cookie без значения сессии: срок жизни нужен клиенту, сама кука - нет
+    """
+    cookie = SimpleCookie(raw)
+    for morsel in cookie.values():
+        morsel.set(morsel.key, "recorded", "recorded")
+    return cookie.output(header="").strip()
+
+# ---------------------------------------------------------------------------------→ СЕССИИ ↓
+class RecordingSession:
+    """
+    Обертка над ClientSession: запросы идут в сеть как обычно, каждый обмен пишется в кассету.
+    Ответ читается целиком (в том числе потоковый результат Redash) и отдается клиенту уже из памяти
+    """
+
+    def __init__(self, session : ClientSession, cassette : Cassette) -> None:
+        self.session = session
+        self.cassette = cassette
+
+    @property
+    def closed(self) -> bool:
+        return self.session.closed
+
+    async def close(self) -> None:
+        self.cassette.save()
+        log_msg(f"Кассета записана: {self.cassette.path} ({len(self.cassette)} обменов)", LogLevel.INFO)
+        await self.session.close()
+
+    @asynccontextmanager
+    async def _request(self, method : str, url : str, **kwargs):
+        body = kwargs.get("data")
+        if "json" in kwargs:
+            body = json.dumps(kwargs["json"])
+        path, key = self.cassette.request_key(method, url, body)
+        start = time.perf_counter()
+        async with self.session.request(method, url, **kwargs) as resp:
+            raw = await resp.read()
+            headers = {"Content-Type": resp.headers.get("Content-Type", "")}
+            if "Set-Cookie" in resp.headers:
+                headers["Set-Cookie"] = _strip_cookie(resp.headers["Set-Cookie"])
+            exchange = Exchange(method=method, path=path, key=key, status=resp.status, headers=headers,
+                                body=raw.decode("utf-8", errors="replace"), latency=round(time.perf_counter() - start, 4))
+        self.cassette.add(exchange)
+        response = ReplayResponse(exchange)
+        if "Set-Cookie" in resp.headers:
+            response.cookies = resp.cookies # клиенту - настоящая кука, в кассету - без значения
+        yield response
+
+    def get(self, url : str, **kwargs):
+        return self._request("GET", url, **kwargs)
+
+    def post(self, url : str, **kwargs):
+        return self._request("POST", url, **kwargs)
+
+    def delete(self, url : str, **kwargs):
+        return self._request("DELETE", url, **kwargs)
+
+class ReplaySession:
+    """
+    Отдает ответы из кассеты без сети.
+    Задержка ответа - записанная, умноженная на scale (0 - без задержек, 2 - вдвое медленнее), или фиксированная latency секунд.
+    Запрос которого нет в кассете получает 404 (и WARN в лог) - клиенты обрабатывают его как обычную ошибку сервера.
+    Если кассета записана не сегодня - даты YYYY-MM-DD в ответах сдвигаются на разницу в днях (история Redash фильтруется по сегодняшней дате)
+    """
+
+    def __init__(self, cassette : Cassette, scale : float = 1.0, latency : float | None = None) -> None:
+        self.cassette = cassette
+        self.scale = scale
+        self.latency = latency
+        self.closed = False
+        self.misses = 0
+
+    async def close(self) -> None:
+        self.closed = True
+        if self.misses:
+            log_msg(f"Кассета {self.cassette.path}: {self.misses} запросов не нашлось", LogLevel.WARN)
+
+    @asynccontextmanager
+    async def _request(self, method : str, url : str, **kwargs):
+        body = kwargs.get("data")
+        if "json" in kwargs:
+            body = json.dumps(kwargs["json"])
+        path, key = self.cassette.request_key(method, url, body)
+        exchange = self.cassette.next(key)
+        if exchange is None:
+            self.misses += 1
+            log_msg(f"Нет в кассете: {method} {path}", LogLevel.WARN)
+            exchange = Exchange(method=method, path=path, key=key, status=404, headers={"Content-Type": "application/json"},
+                                body=json.dumps({"message": f"Нет в кассете: {method} {path}"}, ensure_ascii=False))
+        shift = (datetime.date.today() - self.cassette.recorded_on).days
+        if shift and exchange.body:
+            exchange = exchange.model_copy(update={"body": self.cassette.shift_dates(exchange.body, shift)})
+        delay = self.latency if self.latency is not None else exchange.latency * self.scale
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield ReplayResponse(exchange)
+
+    def get(self, url : str, **kwargs):
+        return self._request("GET", url, **kwargs)
+
+    def post(self, url : str, **kwargs):
+        return self._request("POST", url, **kwargs)
+
+    def delete(self, url : str, **kwargs):
+        return self._request("DELETE", url, **kwargs)
@@ -1,17 +1,25 @@
 import time
 import functools
 import asyncio
+import atexit
 import os
+import queue
+import re
+import reprlib
+import sys
+import threading
 from colorama import Fore, Style, init
 from enum import Enum
 
+from src.metrics import METRICS, upstream_of
+
 # инициализация цветного вывода на Windows/Unix
 init(autoreset=True)
 
 class LogLevel(Enum):
     DEBUG = "DEBUG"
     INFO = "INFO"
-    SUCCESS = "SUCCESS" 
+    SUCCESS = "SUCCESS"
     WARN = "WARN"
     ERORR = "ERORR"
 
@@ -20,10 +28,13 @@ class LoggerConfig:
         # Уровень по умолчанию из переменной окружения или INFO
         self.level = LogLevel[os.getenv("LOG_LEVEL", "INFO")]
         self.enable_call_logging = os.getenv("ENABLE_CALL_LOGGING", "true").lower() == "true"
-        
+        self.enable_metrics = os.getenv("ENABLE_METRICS", "true").lower() == "true" # гистограммы длительности вызовов (см. src/metrics.py)
+        self.max_len = int(os.getenv("LOG_MAX_LEN", "500")) # длиннее - обрезается (ответы Grafana/Redash бывают по несколько МБ)
+        self.log_file = os.getenv("LOG_FILE") # если задан - лог дублируется в файл (без цветов)
+
     def set_level(self, level):
         self.level = level
-        
+
     def enable_call_logs(self, enable=True):
         self.enable_call_logging = enable
 
@@ -34,7 +45,7 @@ config = LoggerConfig()
 LOG_LEVEL_PRIORITY = {
     LogLevel.DEBUG: 10,
     LogLevel.INFO: 20,
-    LogLevel.SUCCESS: 25, 
+    LogLevel.SUCCESS: 25,
     LogLevel.WARN: 30,
     LogLevel.ERORR: 40
 }
@@ -42,10 +53,108 @@ LOG_LEVEL_PRIORITY = {
 def should_log(level):
     return LOG_LEVEL_PRIORITY[level] >= LOG_LEVEL_PRIORITY[config.level]
 
-def log_msg(message, level=LogLevel.INFO):
+# ---------------------------------------------------------------------------------→ ВЫВОД ↓
+class _LogWriter:
+    """
+    Вывод лога в отдельном daemon потоке: log_msg/log_call только кладут готовую строку в очередь,
+    поэтому event loop никогда не ждет консоль или файл
+    """
+    _ANSI = re.compile(r"\x1b\[[0-9;]*m")
+
+    def __init__(self) -> None:
+        self.queue : queue.Queue[str] = queue.Queue()
+        self._thread : threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def write(self, line : str) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+        self.queue.put(line)
+
+    def _run(self) -> None:
+        file = open(config.log_file, "a", encoding="utf-8") if config.log_file else None
+        while True:
+            line = self.queue.get()
+            try:
+                sys.stdout.write(line + "\n")
+                sys.stdout.flush()
+                if file is not None:
+                    file.write(self._ANSI.sub("", line) + "\n")
+                    file.flush()
+            except Exception:
+                pass # лог не должен ронять приложение
+            finally:
+                self.queue.task_done()
+
+    def flush(self) -> None:
+        """
+        Ждет пока все что уже в очереди будет выведено
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.join()
+
+_WRITER = _LogWriter()
+atexit.register(_WRITER.flush) # при выходе дописываем то что осталось в очереди
+
+def flush_logs():
+    """
+    Дожидается вывода всех поставленных в очередь сообщений (например перед тем как показать меню и ждать ввода)
+    """
+    _WRITER.flush()
+
+# ---------------------------------------------------------------------------------→ ФОРМАТИРОВАНИЕ ↓
+_REPR = reprlib.Repr()
+_REPR.maxlevel = 3
+_REPR.maxdict = 8
+_REPR.maxlist = 8
+_REPR.maxtuple = 8
+_REPR.maxset = 8
+_REPR.maxstring = 200
+_REPR.maxother = 200
+
+def short(value, limit=None):
+    """
+    Короткое представление значения для лога: большие dict/list - размер, ключи и начало содержимого, длинные строки - обрезаются.
+    Стоимость не зависит от размера value
+    """
+    limit = limit or config.max_len
+    if isinstance(value, str):
+        return value if len(value) <= limit else f"{value[:limit]}... (+{len(value) - limit} символов)"
+    if isinstance(value, dict) and len(value) > _REPR.maxdict:
+        keys = ", ".join(str(key) for key in list(value)[:_REPR.maxdict])
+        return f"<dict {len(value)} ключей: {keys}, ...>"
+    if isinstance(value, (list, tuple, set)) and len(value) > _REPR.maxlist:
+        return f"<{type(value).__name__} {len(value)} элементов: {_REPR.repr(value)}>"
+    text = _REPR.repr(value)
+    return text if len(text) <= limit else f"{text[:limit]}..."
+
+def _format(message, args):
+    """
+    Собирает текст сообщения. Вызывается только если уровень включен
+    """
+    if callable(message):
+        message = message()
+    if args:
+        try:
+            message = message % tuple(short(arg) for arg in args)
+        except (TypeError, ValueError):
+            message = f"{message} {' '.join(short(arg) for arg in args)}"
+    # само сообщение режем только от совсем огромных размеров - многострочная статистика должна выводиться целиком
+    return short(message if isinstance(message, str) else str(message), config.max_len * 20)
+
+def log_msg(message, level=LogLevel.INFO, *args):
+    """
+    Пишет сообщение в лог.
+    Для дорогих сообщений форматирование откладывается до проверки уровня:
+        log_msg("Response: %s", LogLevel.DEBUG, response) - response будет сокращен и отформатирован только если DEBUG включен
+        log_msg(lambda: build_text(), LogLevel.DEBUG) - функция вызовется только если DEBUG включен
+    """
     if not should_log(level):
         return
-        
+
     colors = {
         LogLevel.INFO: Fore.CYAN,
         LogLevel.DEBUG: Fore.BLUE,
@@ -54,73 +163,87 @@ def log_msg(message, level=LogLevel.INFO):
         LogLevel.SUCCESS: Fore.GREEN
     }
     prefix = f"{colors.get(level, Fore.WHITE)}[{level.value}]{Style.RESET_ALL}"
-    print(f"\n[MESSAGE]   -   {prefix} {message}\n")
+    _WRITER.write(f"\n[MESSAGE]   -   {prefix} {_format(message, args)}\n")
+
+def _format_args(func, args, kwargs):
+    # self не печатаем целиком - только имя класса
+    if args and hasattr(type(args[0]), func.__name__):
+        shown = [f"<{type(args[0]).__name__}>"] + [short(arg) for arg in args[1:]]
+    else:
+        shown = [short(arg) for arg in args]
+    return f"args=({', '.join(shown)}), kwargs={{{', '.join(f'{key}={short(value)}' for key, value in kwargs.items())}}}"
 
 def log_call(func):
+    """
+    Логирует вызов (на DEBUG - аргументы и результат, на ERORR - исключение) и пишет длительность и исход вызова
+    в METRICS (гистограмма по функции и upstream). Метрики пишутся даже если DEBUG выключен
+    """
+    name = func.__name__
+    upstream = upstream_of(func.__module__)
+
     @functools.wraps(func)
     async def async_wrapper(*args, **kwargs):
-        if not config.enable_call_logging:
+        log_calls = config.enable_call_logging
+        if not log_calls and not config.enable_metrics:
             return await func(*args, **kwargs)
-            
-        start = time.time()
-        if should_log(LogLevel.DEBUG):
-            print(
-                f"{Fore.CYAN}[CALL]{Style.RESET_ALL} {func.__name__}("
-                f"{Fore.YELLOW}args={args}{Style.RESET_ALL}, "
-                f"{Fore.YELLOW}kwargs={kwargs}{Style.RESET_ALL})"
+
+        start = time.perf_counter()
+        if log_calls and should_log(LogLevel.DEBUG):
+            _WRITER.write(
+                f"{Fore.CYAN}[CALL]{Style.RESET_ALL} {name}("
+                f"{Fore.YELLOW}{_format_args(func, args, kwargs)}{Style.RESET_ALL})"
             )
         try:
             result = await func(*args, **kwargs)
-            duration = (time.time() - start) * 1000
-            if should_log(LogLevel.DEBUG):
-                print(
-                    f"{Fore.GREEN}[RETURN]{Style.RESET_ALL} {func.__name__} -> "
-                    f"{Fore.MAGENTA}{result}{Style.RESET_ALL} "
-                    f"({duration:.2f} ms)"
-                )
-            return result
         except Exception as e:
-            duration = (time.time() - start) * 1000
-            if should_log(LogLevel.ERORR):
-                print(
-                    f"{Fore.RED}[ERROR]{Style.RESET_ALL} {func.__name__} "
-                    f"({duration:.2f} ms): {e}"
-                )
+            _on_error(name, upstream, start, e)
             raise
+        _on_return(name, upstream, start, result)
+        return result
 
     @functools.wraps(func)
     def sync_wrapper(*args, **kwargs):
-        if not config.enable_call_logging:
+        log_calls = config.enable_call_logging
+        if not log_calls and not config.enable_metrics:
             return func(*args, **kwargs)
-            
-        start = time.time()
-        if should_log(LogLevel.DEBUG):
-            print(
-                f"{Fore.CYAN}[CALL]{Style.RESET_ALL} {func.__name__}("
-                f"{Fore.YELLOW}args={args}{Style.RESET_ALL}, "
-                f"{Fore.YELLOW}kwargs={kwargs}{Style.RESET_ALL})"
+
+        start = time.perf_counter()
+        if log_calls and should_log(LogLevel.DEBUG):
+            _WRITER.write(
+                f"{Fore.CYAN}[CALL]{Style.RESET_ALL} {name}("
+                f"{Fore.YELLOW}{_format_args(func, args, kwargs)}{Style.RESET_ALL})"
             )
         try:
             result = func(*args, **kwargs)
-            duration = (time.time() - start) * 1000
-            if should_log(LogLevel.DEBUG):
-                print(
-                    f"{Fore.GREEN}[RETURN]{Style.RESET_ALL} {func.__name__} -> "
-                    f"{Fore.MAGENTA}{result}{Style.RESET_ALL} "
-                    f"({duration:.2f} ms)"
-                )
-            return result
         except Exception as e:
-            duration = (time.time() - start) * 1000
-            if should_log(LogLevel.ERORR):
-                print(
-                    f"{Fore.RED}[ERROR]{Style.RESET_ALL} {func.__name__} "
-                    f"({duration:.2f} ms): {e}"
-                )
+            _on_error(name, upstream, start, e)
             raise
+        _on_return(name, upstream, start, result)
+        return result
 
     return async_wrapper if asyncio.iscoroutinefunction(func) else sync_wrapper
 
+def _on_return(name, upstream, start, result):
+    duration = time.perf_counter() - start
+    if config.enable_metrics:
+        METRICS.observe(name, upstream, duration, ok=True)
+    if config.enable_call_logging and should_log(LogLevel.DEBUG):
+        _WRITER.write(
+            f"{Fore.GREEN}[RETURN]{Style.RESET_ALL} {name} -> "
+            f"{Fore.MAGENTA}{short(result)}{Style.RESET_ALL} "
+            f"({duration * 1000:.2f} ms)"
+        )
+
+def _on_error(name, upstream, start, e):
+    duration = time.perf_counter() - start
+    if config.enable_metrics:
+        METRICS.observe(name, upstream, duration, ok=False)
+    if config.enable_call_logging and should_log(LogLevel.ERORR):
+        _WRITER.write(
+            f"{Fore.RED}[ERROR]{Style.RESET_ALL} {name} "
+            f"({duration * 1000:.2f} ms): {short(str(e))}"
+        )
+
 # Утилиты для управления конфигурацией
 def setup_logging(level=LogLevel.INFO, enable_calls=True):
     """Настройка логирования для приложения"""
@@ -1,47 +1,80 @@
-from src.loger import log_call, log_msg, LogLevel
+import asyncio
+import inspect
+import threading
+from typing import Any, Callable
+
+from src.loger import log_call, log_msg, LogLevel, flush_logs
 from src.models import Marketplace
 
+async def in_thread(func: Callable, *args) -> Any:
+    """
+    Выполняет блокирующую функцию (input и т.п.) в отдельном daemon потоке и ждет результат не блокируя event loop.
+    Поток daemon - поэтому висящий input() не мешает завершить процесс.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def target() -> None:
+        try:
+            result = func(*args)
+        except BaseException as e:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_exception(e))
+        else:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(result))
+
+    threading.Thread(target=target, daemon=True).start()
+    return await future
+
+async def ainput(prompt: str = "") -> str:
+    """
+    Асинхронный input: event loop продолжает работать (фоновые задачи, пул соединений) пока оператор думает
+    """
+    return await in_thread(input, prompt)
+
 class Menu:
 
     def __init__(self) -> None:
         ...
-    def _show_menu(self, menu : list) -> int:
+    async def _show_menu(self, menu : list) -> int:
         """
-        Отображает меню и ожидает ввода индекса пункта меню
+        Отображает меню и ожидает ввода индекса пункта меню (пока не будет введен существующий пункт)
         """
-        print("Меню:")
-        i = 0
-        for item in menu:
-            print(f"{i} - {item}")
-            i += 1
-
-        try:
-            selected = int(input(": "))
-            if selected > i:
-                log_msg("Не корректный выбор, выбраного пункта не существует")
-                self._show_menu(menu)
+        while True:
+            flush_logs() # лог пишется фоновым потоком - дописываем его до меню, что бы не перемешивался с вводом
+            print("Меню:")
+            for i, item in enumerate(menu):
+                print(f"{i} - {item}")
 
-        except Exception as e:
-            log_msg(f"Не корректный выбор. Ошибка: {e}")
+            try:
+                selected = int(await ainput(": "))
+            except ValueError as e:
+                log_msg(f"Не корректный выбор. Ошибка: {e}")
+                continue
 
-        return selected
+            if 0 <= selected < len(menu):
+                return selected
+            log_msg("Не корректный выбор, выбраного пункта не существует")
 
-    def _get_action_in_menu(self, selected_index:int, actions: dict):
+    async def _get_action_in_menu(self, selected_index:int, actions: dict):
         """
-        Вызывает действие в зависимости от выбора пользователя (возвращает (по сути вызывает) лямбду функцию из словаря actions)
+        Вызывает действие в зависимости от выбора пользователя (вызывает лямбду функцию из словаря actions).
+        Если действие вернуло корутину - дожидается ее
         """
         action = actions.get(selected_index) or (lambda: None)
-        return action()
-        
-    def menu(self, menu: list, actions: dict):
+        result = action()
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def menu(self, menu: list, actions: dict):
         """
         Отображает меню и вызывает действие в зависимости от выбора пользователя
 
         Args:
             menu (list): Список пунктов меню для отображения
-            actions (dict): Словарь, где ключ - индекс пункта меню, значение - ЛЯМБДА функция для вызова
+            actions (dict): Словарь, где ключ - индекс пункта меню, значение - ЛЯМБДА функция для вызова (может возвращать корутину)
         Returns:
-            None (вызов функции действия)
+            Результат действия
         """
-        select = self._show_menu(menu)
-        return self._get_action_in_menu(select, actions)
+        select = await self._show_menu(menu)
+        return await self._get_action_in_menu(select, actions)
@@ -0,0 +1,143 @@
+import bisect
+import json
+import threading
+
+from pydantic import BaseModel
+
+class CallMetrics(BaseModel):
+    """
+    Снимок метрик одной функции: количество вызовов, ошибок и перцентили длительности (секунды, оценка по бакетам гистограммы)
+    """
+    function : str
+    upstream : str
+    count : int
+    errors : int
+    sum : float
+    max : float
+    p50 : float
+    p95 : float
+    p99 : float
+
+class Histogram:
+    """
+    Гистограмма длительностей с фиксированными бакетами (как histogram в Prometheus).
+    Память не растет с количеством вызовов, перцентили считаются линейной интерполяцией внутри бакета (как histogram_quantile)
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+    __slots__ = ("counts", "sum", "count", "errors", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.BUCKETS) + 1) # последний - +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+        self.max = 0.0
+
+    def observe(self, seconds : float, ok : bool = True) -> None:
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.errors += not ok
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q : float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.BUCKETS[i - 1] if i > 0 else 0.0
+                upper = self.BUCKETS[i] if i < len(self.BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - cumulative) / bucket_count, self.max)
+            cumulative += bucket_count
+        return self.max
+
+class MetricsRegistry:
+    """
+    Метрики вызовов в памяти процесса: гистограмма длительности и счетчики успехов/ошибок на каждую пару (функция, upstream).
+    Заполняется из log_call и из HTTP обвязок клиентов, выгружается в формате Prometheus (to_prometheus) и json (snapshot/to_json)
+    """
+
+    def __init__(self, prefix : str = "analitic") -> None:
+        self.prefix = prefix
+        self._histograms : dict[tuple[str, str], Histogram] = {}
+        self._lock = threading.Lock() # log_call бывает и в синхронных функциях из потоков (in_thread)
+
+    def observe(self, function : str, upstream : str, seconds : float, ok : bool = True) -> None:
+        key = (function, upstream)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds, ok)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self) -> list[CallMetrics]:
+        with self._lock:
+            items = sorted(self._histograms.items())
+            return [
+                CallMetrics(function=function, upstream=upstream, count=h.count, errors=h.errors, sum=h.sum, max=h.max,
+                            p50=h.quantile(0.5), p95=h.quantile(0.95), p99=h.quantile(0.99))
+                for (function, upstream), h in items
+            ]
+
+    def to_json(self) -> str:
+        return json.dumps([item.model_dump() for item in self.snapshot()], ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        """
+        Текстовый формат Prometheus (можно отдавать через node_exporter textfile collector)
+        """
+        duration = f"{self.prefix}_call_duration_seconds"
+        calls = f"{self.prefix}_calls_total"
+        lines = [
+            f"# HELP {duration} Длительность вызовов функций и HTTP запросов",
+            f"# TYPE {duration} histogram",
+        ]
+        counters = [
+            f"# HELP {calls} Количество вызовов по результату",
+            f"# TYPE {calls} counter",
+        ]
+        with self._lock:
+            for (function, upstream), h in sorted(self._histograms.items()):
+                labels = f'function="{_escape(function)}",upstream="{_escape(upstream)}"'
+                cumulative = 0
+                for bucket, bucket_count in zip(h.BUCKETS, h.counts):
+                    cumulative += bucket_count
+                    lines.append(f'{duration}_bucket{{{labels},le="{bucket}"}} {cumulative}')
+                lines.append(f'{duration}_bucket{{{labels},le="+Inf"}} {h.count}')
+                lines.append(f"{duration}_sum{{{labels}}} {h.sum:.6f}")
+                lines.append(f"{duration}_count{{{labels}}} {h.count}")
+                counters.append(f'{calls}{{{labels},status="ok"}} {h.count - h.errors}')
+                counters.append(f'{calls}{{{labels},status="error"}} {h.errors}')
+        return "\n".join(lines + counters) + "\n"
+
+    def format_stats(self) -> str:
+        """
+        Кратко для лога: вызовы, ошибки и p50/p95/p99 в мс по каждой функции
+        """
+        return "\n".join(
+            f"  [{m.upstream}] {m.function}: вызовов {m.count}, ошибок {m.errors}, "
+            f"p50 {m.p50 * 1000:.0f}мс / p95 {m.p95 * 1000:.0f}мс / p99 {m.p99 * 1000:.0f}мс / макс. {m.max * 1000:.0f}мс"
+            for m in self.snapshot()
+        )
+
+def _escape(value : str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def upstream_of(module : str) -> str:
+    """
+    Определяет upstream по модулю функции: src.grafana.* → grafana, src.redash.* → redash, остальное → internal
+    """
+    for upstream in ("grafana", "redash"):
+        if f".{upstream}" in module or module.startswith(upstream):
+            return upstream
+    return "internal"
+
+METRICS = MetricsRegistry() # общие метрики процесса
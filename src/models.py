@@ -1,4 +1,5 @@
 from pydantic import BaseModel, field_validator
+from typing import Any
 from src.regions import Region
 from enum import Enum
 
@@ -52,6 +53,14 @@ class StoresData(BaseModel):
     region : Region
     stors_count : int
 
+class ProblemRegion(BaseModel):
+    """
+    Строка дашборда заказов по РК (query 9021) после разбора HTML
+    """
+    region : str
+    value : float | None = None # количество заказов
+    change : float | None = None # динамика в процентах: -12.5 - заказов на 12.5% меньше
+
 class StocksCacheData(BaseModel):
     company_name : str
     region_id : str
@@ -61,6 +70,110 @@ class StocksCacheData(BaseModel):
     percent : float
 
 class CelaryData(BaseModel):
-    names: list[str]
-    time: list[int]
+    """
+    Длина очередей Celery одного namespace.
+    time и vlaues - общий backlog (сумма по всем очередям) в каждой точке, queues - ряды по каждой очереди отдельно.
+    """
+    names: list[str] # имена очередей
+    time: list[int] # unix время точек в миллисекундах
     vlaues: list[int]
+    queues: dict[str, list[int]] = {} # имя очереди → длина в каждой точке time (0 если точки нет)
+    growth_rate: float | None = None # прирост общего backlog в сообщениях за минуту (None для instant)
+
+class GrafanaQuery(BaseModel):
+    """
+    Один query для /api/ds/query (SQL для Postgres/ClickHouse или PQL для Prometheus).
+    GrafanaClient.get_queries пакует много таких query в минимум HTTP запросов.
+    """
+    ref_id : str # уникален в рамках одного вызова get_queries, по нему возвращается результат
+    datasource : dict # {"type": ..., "uid": ...} из GrafanaAPI.Sources
+    raw_sql : str | None = None
+    expr : str | None = None
+    format : str | int = "table"
+    minutes : int = 1440 # временное окно now-<minutes>m → now. Query с разными окнами уходят разными запросами
+    options : dict[str, Any] = {} # дополнительные поля query как есть (instant, range, intervalMs, legendFormat ...)
+
+    def to_payload(self) -> dict:
+        query = {
+            "refId" : self.ref_id,
+            "datasource" : self.datasource,
+            "format" : self.format,
+            "maxDataPoints" : 1384,
+        }
+        if self.raw_sql is not None:
+            query["rawSQL"] = self.raw_sql
+        if self.expr is not None:
+            query["expr"] = self.expr
+        return query | self.options
+
+class GrafanaFrame(BaseModel):
+    """
+    Разобранный frame ответа /api/ds/query: имена и labels колонок и значения по колонкам
+    """
+    name : str | None = None
+    columns : list[str] = []
+    labels : list[dict[str, str]] = [] # labels каждой колонки (у Prometheus рядов тут queue_name и т.п.)
+    values : list[list[Any]] = [] # values[i] - значения колонки i
+
+    def first(self) -> Any:
+        """
+        Первое значение первой колонки или None если данных нет
+        """
+        return self.values[0][0] if self.values and self.values[0] else None
+
+    def rows(self) -> list[tuple]:
+        """
+        Значения построчно
+        """
+        return list(zip(*self.values))
+
+class MetricResult(BaseModel):
+    """
+    Результат сбора одной метрики в конвейере.
+    Если метрика упала - value остается None, а в error лежит текст ошибки.
+    """
+    name : str
+    value : Any = None
+    error : str | None = None
+    duration : float = 0.0 # секунды
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+class FleetResult(BaseModel):
+    """
+    Отчет по одному маркетплейсу из прогона по всему парку (fleet)
+    """
+    marketplace : Marketplace
+    results : dict[str, MetricResult] = {}
+    timings : dict[str, float] = {}
+    error : str | None = None # ошибка всего прогона МП (не отдельной метрики)
+    duration : float = 0.0 # секунды, от старта сбора до готового отчета
+
+class FleetStats(BaseModel):
+    """
+    Итоговая статистика прогона по всему парку маркетплейсов
+    """
+    total : int = 0
+    failed : int = 0
+    elapsed : float = 0.0 # секунды на весь прогон
+    per_minute : float = 0.0 # маркетплейсов в минуту
+    p50 : float = 0.0 # секунды на маркетплейс
+    p95 : float = 0.0
+
+class JobStats(BaseModel):
+    """
+    Статистика периодической задачи планировщика (время в секундах)
+    """
+    name : str
+    group : str
+    interval : float
+    runs : int = 0
+    skipped : int = 0 # циклы пропущенные потому что предыдущий запуск еще шел
+    failures : int = 0
+    last_duration : float = 0.0
+    max_duration : float = 0.0
+    total_duration : float = 0.0
+    last_lag : float = 0.0 # на сколько запуск опоздал относительно расписания
+    max_lag : float = 0.0
@@ -0,0 +1,151 @@
+import asyncio
+import time
+from typing import Any, Awaitable
+
+from src import tracing
+from src.loger import log_call, log_msg, LogLevel
+from src.models import Env, Marketplace, MetricResult
+from src.grafana.grafana import GrafanaClient
+from src.grafana.grafana_api import GrafanaAPI
+from src.redash.redash import RedashClient
+
+class AnaliticPipeline:
+    """
+    Конвейер сбора метрик по маркетплейсу.
+    Клиенты Grafana и Redash открываются одновременно, а каждая независимая метрика запускается отдельной задачей,
+    поэтому отчет собирается примерно за время самого медленного источника, а не за сумму всех запросов.
+    """
+
+    # нужен для получения информации о обменах по заказам, остаткам и ценам
+    EXCHANGES_REQ_MAP = {
+        "orders" : {
+            Env.LTS.value : GrafanaAPI.LuceneRequestes.ELK_LTS_ORDERS_LUCENE,
+            Env.LATEST.value : GrafanaAPI.LuceneRequestes.ELK_LATEST_ORDERS_LUCENE
+        },
+        "stocks" : {
+            Env.LTS.value : GrafanaAPI.LuceneRequestes.ELK_LTS_STOCKS_LUCENE,
+            Env.LATEST.value : GrafanaAPI.LuceneRequestes.ELK_LATEST_STOCKS_LUCENE
+        },
+        "prices" : {
+            Env.LTS.value : GrafanaAPI.LuceneRequestes.ELK_LTS_PRICES_LUCENE,
+            Env.LATEST.value : GrafanaAPI.LuceneRequestes.ELK_LATEST_PRICES_LUCENE
+        }
+    }
+
+    def __init__(self) -> None:
+        self.timings : dict[str, float] = {} # фаза → длительность в секундах (последний прогон)
+
+    async def _run_metric(self, name : str, coro : Awaitable[Any]) -> MetricResult:
+        """
+        Выполняет корутину одной метрики и заворачивает результат в MetricResult.
+        Исключение не пробрасывается дальше - падение одной метрики не должно ронять весь отчет.
+        """
+        start = time.perf_counter()
+        with tracing.span(name, "metric") as span:
+            try:
+                value = await coro
+                return MetricResult(name=name, value=value, duration=time.perf_counter() - start)
+            except Exception as e:
+                log_msg(f"Метрика '{name}' не собрана: {e}", LogLevel.ERORR)
+                span.set(error=type(e).__name__)
+                return MetricResult(name=name, error=f"{type(e).__name__}: {e}", duration=time.perf_counter() - start)
+
+    async def _run_phase(self, phase : str, metrics : dict[str, Awaitable[Any]], timings : dict[str, float]) -> dict[str, MetricResult]:
+        """
+        Запускает все метрики фазы параллельно и замеряет длительность фазы целиком.
+        """
+        start = time.perf_counter()
+        with tracing.span(phase, "phase"):
+            async with asyncio.TaskGroup() as tg:
+                tasks = {name: tg.create_task(self._run_metric(name, coro)) for name, coro in metrics.items()}
+        timings[phase] = time.perf_counter() - start
+
+        results = {name: task.result() for name, task in tasks.items()}
+        for name, result in results.items():
+            timings[f"{phase}.{name}"] = result.duration
+        return results
+
+    def _split_exchanges(self, results : dict[str, MetricResult]) -> dict[str, MetricResult]:
+        """
+        Раскладывает общий результат пачки обменов на отдельные метрики orders/stocks/prices
+        """
+        exchanges = results.pop("exchanges")
+        for i, name in enumerate(self.EXCHANGES_REQ_MAP):
+            value = exchanges.value[i] if exchanges.ok else None
+            results[name] = MetricResult(name=name, value=value, error=exchanges.error, duration=exchanges.duration)
+        return results
+
+    @log_call
+    async def collect(self, marketplace : Marketplace) -> dict[str, MetricResult]:
+        """
+        Собирает все метрики маркетплейса параллельно.
+        Сам открывает клиенты Grafana и Redash, тайминги прогона сохраняются в self.timings.
+
+        Args:
+            marketplace(Marketplace): маркетплейс для которого собирается отчет
+        Returns:
+            dict[str, MetricResult]: имя метрики - ключ, результат (значение или ошибка) - значение
+        """
+        timings : dict[str, float] = {}
+        total_start = time.perf_counter()
+
+        async with GrafanaClient() as g, RedashClient() as r:
+            timings["connect"] = time.perf_counter() - total_start
+            tracing.record(tracing.current_span(), "connect", total_start, total_start + timings["connect"], "phase")
+            results = await self.collect_with(g, r, marketplace, timings)
+
+        timings["total"] = time.perf_counter() - total_start
+        self.timings = timings
+        log_msg(f"{marketplace.name}: тайминги фаз {self.format_timings(timings)}", LogLevel.INFO)
+
+        return results
+
+    async def collect_with(self, g : GrafanaClient, r : RedashClient, marketplace : Marketplace, timings : dict[str, float] | None = None) -> dict[str, MetricResult]:
+        """
+        Собирает все метрики маркетплейса на уже открытых клиентах.
+        Нужен что бы несколько маркетплейсов могли собираться одновременно на общих сессиях.
+
+        Args:
+            g(GrafanaClient): открытый клиент Grafana
+            r(RedashClient): открытый клиент Redash
+            marketplace(Marketplace): маркетплейс для которого собирается отчет
+            timings(dict|None): словарь куда будут записаны тайминги фаз (фаза → секунды)
+        Returns:
+            dict[str, MetricResult]: имя метрики - ключ, результат (значение или ошибка) - значение
+        """
+        if timings is None:
+            timings = {}
+
+        grafana_metrics = {
+            "stors" : g.get_count_stors(marketplace),
+            "cache" : g.get_status_cache(marketplace),
+            # заказы/остатки/цены уходят одним /_msearch
+            "exchanges" : g.get_value_exchanges_batch([(marketplace, req) for req in self.EXCHANGES_REQ_MAP.values()]),
+            # backlog очередей окружения МП - первое что смотрим когда обмены встали
+            "celary" : g.get_celary_queues([marketplace.env.value]),
+        }
+
+        redash_metrics = {
+            "history" : r.get_info_about_history(marketplace),
+            "problem_regions" : r.get_info_about_problem_regions(marketplace),
+            "schedules_by_region" : r.get_schedules_by_mp(marketplace),
+            "discrepancy_stors" : r.get_info_discrepancy_stors_by_regions(marketplace),
+        }
+
+        async with asyncio.TaskGroup() as tg:
+            grafana_task = tg.create_task(self._run_phase("grafana", grafana_metrics, timings))
+            redash_task = tg.create_task(self._run_phase("redash", redash_metrics, timings))
+
+        results = self._split_exchanges(grafana_task.result()) | redash_task.result()
+        failed = [name for name, result in results.items() if not result.ok]
+        if failed:
+            log_msg(f"{marketplace.name}: не собраны метрики {failed}", LogLevel.WARN)
+
+        return results
+
+    def format_timings(self, timings : dict[str, float] | None = None) -> str:
+        """
+        Возвращает тайминги в читаемом виде (фаза=мс). Если не переданы - тайминги последнего прогона collect
+        """
+        timings = self.timings if timings is None else timings
+        return ", ".join(f"{phase}={duration * 1000:.0f}ms" for phase, duration in timings.items())
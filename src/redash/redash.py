@@ -1,39 +1,132 @@
 from dotenv import load_dotenv
 import os
 
-from loger import log_call, log_msg, LogLevel
-from models import Marketplace
+from src.loger import log_call, log_msg, LogLevel
+from src.models import Marketplace, ProblemRegion
+from src.regions import Region
 from aiohttp import ClientSession
-from redash.redash_api import RedashAPI
-from typing import overload
+from src.redash.redash_api import RedashAPI
+from src.redash.redash_jobs import RedashJobTracker
+from src.redash.redash_cache import RedashResultCache, RESULT_CACHE
+from src.redash.redash_stream import iter_json_rows
+from src.redash.redash_parse import parse_problem_region
+from src.http_pool import SESSIONS
+from src import tracing
+from typing import AsyncIterator, overload
 import asyncio
-import re
+import time
 import json
+import copy
 import datetime
 
 class RedashClient:
+    HISTORY_MODES = ("range", "weekdays")
+
+    def __init__(self, poll_min_interval : float = 0.5, poll_max_interval : float = 5.0, job_deadline : float = 600.0,
+                 use_cache : bool | None = None, cache : RedashResultCache | None = None,
+                 history_weeks : int | None = None, history_mode : str | None = None):
+        self.cl_session : ClientSession | None = None
+        # история заказов (get_info_about_history): сколько недель назад и как спрашивать Redash
+        self.history_weeks = history_weeks if history_weeks is not None else int(os.getenv("REDASH_HISTORY_WEEKS", "4"))
+        self.history_mode = history_mode or os.getenv("REDASH_HISTORY_MODE", "range")
+        if self.history_mode not in self.HISTORY_MODES:
+            raise ValueError(f"Неизвестный режим истории {self.history_mode}. Варианты: {', '.join(self.HISTORY_MODES)}")
+        # кэш результатов общий для процесса. use_cache=False - всегда свежие данные (и max_age=0 для Redash).
+        # По умолчанию - из REDASH_NO_CACHE (python start.py --fresh), что бы оператор мог получить свежие данные без правки кода
+        self.use_cache = use_cache if use_cache is not None else os.getenv("REDASH_NO_CACHE", "false").lower() != "true"
+        self.cache = cache or RESULT_CACHE
+        # один цикл опроса на все Job'ы клиента (get_schedules_by_mp, история, проблемные РК, расхождения ТВЗ ждут параллельно)
+        self.jobs = RedashJobTracker(self, min_interval=poll_min_interval, max_interval=poll_max_interval, deadline=job_deadline)
+
     async def async_init(self):
         load_dotenv("creds.env")
         self.API_KEY = os.getenv("REDASH_API_KEY")
         self.AUTH_HEADER = {"Authorization" : f"Key {self.API_KEY}"}
 
     async def __aenter__(self):
-        self.cl_session = ClientSession()
+        self.cl_session = SESSIONS.get_session() # общий пул соединений процесса, сессию не закрываем
         await self.async_init()
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
-        if self.cl_session:
-            await self.cl_session.close()
+        await self.jobs.close()
+        self.cl_session = None
 
     # ---------------------------------------------------------------------------
+    @log_call
+    async def get_status_job(self, job_id: str) -> tuple[int, int]:
+        """
+        Один запрос статуса Job'а (без ожидания)
+
+        Args:
+            job_id(str): Job id который будет проверятся
+        Returns:
+            tuple[int, int]: статус Job'а и query_result_id (0 пока Job не отработал успешно)
+                - Если сервер ответил не 200 - вернется CANCELLED и 0
+        """
+        if not self.cl_session:
+            raise RuntimeError("Сессия не инициализирована. Используй `async with RedashClient()`")
+
+        # Правильно формируем URL - job_id должен быть частью пути, а не query параметром
+        url = f"{RedashAPI.Endpoints.BASE_URL}{RedashAPI.Endpoints.GET_STATUS_JOB_ENDPOINT}{job_id}"
+
+        async with self.cl_session.get(url=url, headers=self.AUTH_HEADER) as resp:
+            # Сначала проверяем content-type
+            content_type = resp.headers.get('Content-Type', '')
+            if 'application/json' not in content_type:
+                # Если это не JSON, читаем как текст для отладки
+                text_response = await resp.text()
+                log_msg(f"Неожиданный content-type: {content_type}. Response: {text_response[:200]}", LogLevel.WARN)
+                
+                if resp.status == 200:
+                    # Пробуем парсить как JSON даже если content-type неправильный
+                    try:
+                        res = json.loads(text_response)
+                    except:
+                        # Если не получается, создаем пустой результат
+                        res = {}
+                else:
+                    res = {}
+            else:
+                res = await resp.json()
+            
+            if resp.status != 200:
+                log_msg("Статус запроса не 200 → Статус: %s. Response: %s", LogLevel.ERORR, resp.status, res)
+                return RedashAPI.JobStatus.CANCELLED.value, 0
+
+        job = res.get('job') or {"status": RedashAPI.JobStatus.PENDING.value}
+        status = job['status']
+        
+        if status == RedashAPI.JobStatus.SUCCESS.value:
+            return status, job.get('query_result_id') or 0
+        
+        elif status in [RedashAPI.JobStatus.STARTED.value, RedashAPI.JobStatus.PENDING.value]:
+            log_msg(f"Job {job_id} работает, статус: {RedashAPI.JobStatus(status).name}", LogLevel.DEBUG)
+
+        return status, 0
+
+    async def cancel_job(self, job_id: str) -> None:
+        """
+        Отменяет Job в Redash (DELETE /api/jobs/<id>)
+        """
+        if not self.cl_session:
+            raise RuntimeError("Сессия не инициализирована. Используй `async with RedashClient()`")
+
+        url = f"{RedashAPI.Endpoints.BASE_URL}{RedashAPI.Endpoints.GET_STATUS_JOB_ENDPOINT}{job_id}"
+        async with self.cl_session.delete(url=url, headers=self.AUTH_HEADER) as resp:
+            if resp.status not in (200, 204):
+                log_msg(f"Redash не отменил job {job_id} → Статус: {resp.status}", LogLevel.WARN)
+
     @log_call 
-    async def check_status_job(self, job_id: str) -> tuple[int, int]:
+    async def check_status_job(self, job_id: str, deadline: float | None = None) -> tuple[int, int]:
         """
-        Проверяет статус работы Job'а пока тот не отработает/отменится/упадет.
+        Ждет пока Job не отработает/отменится/упадет.
+        Опрос идет через общий RedashJobTracker клиента: интервал опроса начинается с малого и растет до максимума,
+        поэтому быстрые запросы не ждут лишние секунды, а параллельные ожидания не плодят отдельных циклов опроса.
         
         Args:
             job_id(str): Job id который будет проверятся
+            deadline(float|None): сколько секунд ждать Job, после этого он отменяется. Если не указан - дедлайн клиента
         Returns:
             tuple[int, int]:
                 - Если запрос прошел успешно: возвращает 3 и query_result_id
@@ -42,67 +135,17 @@ class RedashClient:
         if not self.cl_session:
             raise RuntimeError("Сессия не инициализирована. Используй `async with RedashClient()`")
 
-        # Правильно формируем URL - job_id должен быть частью пути, а не query параметром
-        url = f"{RedashAPI.Endpoints.BASE_URL}{RedashAPI.Endpoints.GET_STATUS_JOB_ENDPOINT}{job_id}"
-        
-        log_msg(f"Проверка статуса job: {url}", LogLevel.INFO)
+        log_msg(f"Ожидание job: {job_id}", LogLevel.INFO)
+        # внутри отрезка трекер запишет состояния Job'а: queued (PENDING) и running (STARTED)
+        with tracing.span("job", "internal", job_id=job_id) as span:
+            status, query_result_id = await self.jobs.wait(job_id, deadline)
+            span.set(status=RedashAPI.JobStatus(status).name)
 
-        status = RedashAPI.JobStatus.STARTED.value
-        query_result_id = 0
-        
-        while status not in [RedashAPI.JobStatus.SUCCESS.value, RedashAPI.JobStatus.FAILURE.value, RedashAPI.JobStatus.CANCELLED.value]:
-            try:
-                async with self.cl_session.get(url=url, headers=self.AUTH_HEADER) as resp:
-                    # Сначала проверяем content-type
-                    content_type = resp.headers.get('Content-Type', '')
-                    if 'application/json' not in content_type:
-                        # Если это не JSON, читаем как текст для отладки
-                        text_response = await resp.text()
-                        log_msg(f"Неожиданный content-type: {content_type}. Response: {text_response[:200]}", LogLevel.WARN)
-                        
-                        if resp.status == 200:
-                            # Пробуем парсить как JSON даже если content-type неправильный
-                            try:
-                                res = await resp.json()
-                            except:
-                                # Если не получается, создаем пустой результат
-                                res = {}
-                        else:
-                            res = {}
-                    else:
-                        res = await resp.json()
-                    
-                    if resp.status == 200:
-                        job = res.get('job') or {"status": RedashAPI.JobStatus.PENDING.value}
-                        status = job['status']
-                        
-                        if status == RedashAPI.JobStatus.SUCCESS.value:
-                            log_msg("Job отработал!", LogLevel.SUCCESS)
-                            query_result_id = job.get('query_result_id') or 0
-                            break
-                        
-                        elif status in [RedashAPI.JobStatus.FAILURE.value, RedashAPI.JobStatus.CANCELLED.value]:
-                            log_msg(f"Job в статусе {RedashAPI.JobStatus(status).name}", 
-                                    LogLevel.WARN if status == RedashAPI.JobStatus.CANCELLED.value else LogLevel.ERORR)
-                            query_result_id = 0
-                            break
-                        
-                        elif status in [RedashAPI.JobStatus.STARTED.value, RedashAPI.JobStatus.PENDING.value]:
-                            log_msg(f"Job работает, статус: {RedashAPI.JobStatus(status).name}", LogLevel.INFO)
-
-                    else:
-                        log_msg(f"Статус запроса не 200 → Статус: {resp.status}. Response: {res}", LogLevel.ERORR)
-                        status = RedashAPI.JobStatus.CANCELLED.value
-                        query_result_id = 0
-                        break
-
-            except Exception as e:
-                log_msg(f"Ошибка при проверке статуса job: {e}", LogLevel.ERORR)
-                status = RedashAPI.JobStatus.CANCELLED.value
-                query_result_id = 0
-                break
-
-            await asyncio.sleep(5)
+        if status == RedashAPI.JobStatus.SUCCESS.value:
+            log_msg("Job отработал!", LogLevel.SUCCESS)
+        else:
+            log_msg(f"Job в статусе {RedashAPI.JobStatus(status).name}", 
+                    LogLevel.WARN if status == RedashAPI.JobStatus.CANCELLED.value else LogLevel.ERORR)
 
         return status, query_result_id
 
@@ -121,14 +164,16 @@ class RedashClient:
 
         url = f"{RedashAPI.Endpoints.BASE_URL}{RedashAPI.Endpoints.GET_RESULT_JOB_ENDPOINT.format(query_result_id=query_result_id)}"
         
-        async with self.cl_session.get(url=url, headers=self.AUTH_HEADER) as resp:
-            res = await resp.json() # парсим ответ
-            if resp.status == 200:
-                log_msg("Ответ от сервера 200", LogLevel.SUCCESS)
-                return res
-            else:
-                log_msg("Ответ от сервера не 200", LogLevel.WARN)
-                return res
+        with tracing.span("fetch", "job", upstream="redash", query_result_id=query_result_id) as span:
+            async with self.cl_session.get(url=url, headers=self.AUTH_HEADER) as resp:
+                span.set(status=resp.status, response_bytes=resp.content_length)
+                res = await resp.json() # парсим ответ
+        if resp.status == 200:
+            log_msg("Ответ от сервера 200", LogLevel.SUCCESS)
+            return res
+        else:
+            log_msg("Ответ от сервера не 200", LogLevel.WARN)
+            return res
 
     @overload
     async def start_job(self, body : dict, url : str, query : int) -> str: # если указывается URL - query обязателен
@@ -149,6 +194,25 @@ class RedashClient:
             str: job_id по которму можно отслеживать статус работы
                 - Если запрошел не корректно - вернется "null"
         """
+        status, res = await self._post_start(body, url, query)
+        
+        if status == 200:
+            log_msg(f"Job успешно запущен", LogLevel.SUCCESS)
+            job = res.get('job') or {}
+            job_id = job.get('id') or "null"
+            return job_id
+        else:
+            mes = res.get('message')
+            log_msg(f"Сервер ответил не 200 на запрос запуска Job'а. Сообщение: {mes}", LogLevel.WARN)
+            job_id = "null"
+            return job_id
+
+    @log_call
+    async def _post_start(self, body: dict, url: str, query: int | None) -> tuple[int, dict]:
+        """
+        Отправляет запрос на запуск query и возвращает статус ответа и его json.
+        В ответе либо job (query запущен), либо сразу query_result (если Redash отдал сохраненный результат по max_age)
+        """
         if not self.cl_session:
             raise RuntimeError("Сессия не инициализирована. Используй `async with RedashClient()`")
         
@@ -161,189 +225,299 @@ class RedashClient:
         # Собираем полный URL
         full_url = f"{RedashAPI.Endpoints.BASE_URL}{url}"
         
-        async with self.cl_session.post(url=full_url, headers=self.AUTH_HEADER, json=body) as resp:
-            res = await resp.json()
-            
-            if resp.status == 200:
-                log_msg(f"Job успешно запущен", LogLevel.SUCCESS)
-                job = res.get('job') or {}
-                job_id = job.get('id') or "null"
-                return job_id
-            else:
-                mes = res.get('message')
-                log_msg(f"Сервер ответил не 200 на запрос запуска Job'а. Сообщение: {mes}", LogLevel.WARN)
-                job_id = "null"
-                return job_id
+        data = json.dumps(body) # сериализуем сами (как и aiohttp) - размер тела нужен для трассы
+        with tracing.span("POST start job", "http", upstream="redash", query=query if query is not None else "sql", payload_bytes=len(data.encode())) as span:
+            async with self.cl_session.post(url=full_url, headers={**self.AUTH_HEADER, "Content-Type": "application/json"}, data=data) as resp:
+                span.set(status=resp.status)
+                return resp.status, await resp.json()
+
+    def _cache_params(self, body: dict, query: int | None, policy: int | str | None = None) -> tuple[int | str, tuple, float, int]:
+        """
+        Ключ кэша и политика кэширования для query: (ключ политики, ключ кэша, TTL клиентского кэша, max_age для Redash).
+        policy - свой ключ в RedashAPI.CachePolicy вместо id query (например "9018:past")
+        """
+        policy_key = policy if policy is not None else query if query is not None else "sql"
+        ttl, max_age = RedashAPI.CachePolicy.get(policy_key)
+        if query is not None:
+            key = self.cache.make_key(query, body.get("parameters"))
+        else:
+            key = self.cache.make_key(body.get("query") or "", {"data_source_id": body.get("data_source_id")})
+        return policy_key, key, ttl, max_age
+
+    async def _run_query(self, body: dict, query: int | None, max_age: int) -> tuple[dict | None, int]:
+        """
+        Запускает query и ждет Job.
+        Returns:
+            tuple[dict|None, int]: (готовый ответ, 0) если Redash сразу отдал сохраненный результат,
+                (None, query_result_id) если Job отработал, (None, 0) если не отработал
+        """
+        policy_key = query if query is not None else "sql"
+        body = body | {"max_age": max_age}
+        url = RedashAPI.Endpoints.START_JOB_ENDPOINT if query is not None else RedashAPI.Endpoints.START_SQL_JOB
+        status, res = await self._post_start(body, url, query)
+        if status != 200:
+            log_msg(f"Сервер ответил не 200 на запрос запуска Job'а. Сообщение: {res.get('message')}", LogLevel.WARN)
+            return None, 0
+
+        if "query_result" in res:
+            log_msg(f"Redash query {policy_key}: Redash отдал сохраненный результат", LogLevel.DEBUG)
+            return res, 0
+
+        job_id = (res.get("job") or {}).get("id")
+        if not job_id:
+            log_msg(f"Redash не вернул job для query {policy_key}", LogLevel.WARN)
+            return None, 0
+
+        job_status, result_id = await self.check_status_job(job_id)
+        if result_id == 0:
+            log_msg(f"Redash job не отработал. Последний статус: {job_status}", LogLevel.ERORR)
+            return None, 0
+        log_msg(f"Redash job успешно отработал. Последний статус: {job_status}", LogLevel.SUCCESS)
+        return None, result_id
 
-    # ---------------------------------------------------------------------------
     @log_call
-    async def get_schedules_by_mp(self, marketplace : Marketplace) -> dict[str, int]:
+    async def execute_query(self, body: dict, query: int | None = None, fresh: bool = False) -> dict:
         """
-        Запускает query дашборда Redash и возвращает количество расписаной для МП в каждом РК
+        Выполняет query целиком: запуск → ожидание Job'а → получение результата. Результат кэшируется.
+        Для больших результатов лучше iter_query_rows - он не держит ответ в памяти целиком.
+
+        TTL кэша и max_age для Redash берутся из RedashAPI.CachePolicy по id query (для своего SQL - по ключу "sql").
+        Ключ кэша - id query (или текст SQL) и нормализованные параметры.
 
         Args:
-            marketplace(Marketplace): Маркетплейс по РК которого будет выполнен поиск расписаний
+            body(dict): тело запроса (параметры существующего query или SQL с data_source_id)
+            query(int|None): номер существующего query. Если не указан - body это свой SQL запрос
+            fresh(bool): игнорировать кэш (и клиентский, и сохраненные результаты Redash) и выполнить query заново
         Returns:
-            dict: Количество расписаний для каждого региона МП где РК - ключ, а количество расписаний - значение
+            dict: ответ /api/query_results/<id> ({"query_result": {...}}). Пустой dict если query не отработал
+                - Результат может быть общим с кэшем - не изменяйте его
         """
-        payload = RedashAPI.QueryBody.SCHEDULES_QUERY.copy()
-        payload["parameters"]["Маркетплейс"] = marketplace.name
+        policy_key, key, ttl, max_age = self._cache_params(body, query)
+        fresh = fresh or not self.use_cache
+
+        if not fresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                log_msg(f"Redash query {policy_key}: результат из кэша", LogLevel.DEBUG)
+                return cached
+
+        result, result_id = await self._run_query(body, query, 0 if fresh else max_age)
+        if result is None:
+            if result_id == 0:
+                return {}
+            result = await self.get_result_job(result_id)
+
+        self.cache.set(key, result, ttl)
+        return result
 
-        results = []
-        for region in marketplace.regions:
-            payload["РК"] = region
-            job_id = await self.start_job(body=payload, url=RedashAPI.Endpoints.START_JOB_ENDPOINT, query=886)
-            if job_id != "null":
-                status, result_id = await self.check_status_job(job_id)
-                if result_id != 0:
-                    log_msg(f"Redash job успешно отработал. Последний статус: {status}", LogLevel.SUCCESS)
-                    results.append(await self.get_result_job(result_id))
-                else:
-                    log_msg(f"Redash job не отработал. Последний статус: {status}", LogLevel.ERORR)
-        
-        schedules_by_rk = {}
-        for result in results:
-            data = result.get("data") or {}
-            rows = data.get("rows") or []
-            
-            schedules_count = 0
-            for row in rows:
-                if row.get("status_name", "") == "Расписание сформировано":
-                    num = row.get("num") or 0
-                    schedules_count += num if isinstance(num, int) else 0
-                
-                rk = row.get("rk")
-                
-                log_msg(f"РК: {rk}, Количество расписаний: {schedules_count}", LogLevel.INFO)
-                schedules_by_rk[rk] = schedules_count
+    async def iter_result_rows(self, query_result_id : int) -> AsyncIterator[dict]:
+        """
+        Потоково читает /api/query_results/<id> и отдает строки результата по одной, по мере разбора ответа
 
-        return schedules_by_rk
+        Args:
+            query_result_id(int): id результата query
+        Yields:
+            dict: строка результата
+        """
+        if not self.cl_session:
+            raise RuntimeError("Сессия не инициализирована. Используй `async with RedashClient()`")
 
-    # ---------------------------------------------------------------------------
+        url = f"{RedashAPI.Endpoints.BASE_URL}{RedashAPI.Endpoints.GET_RESULT_JOB_ENDPOINT.format(query_result_id=query_result_id)}"
 
-    def _filter(self, raw_info_about_problem_regions: list[dict]) -> list[dict]:
-        """
-        фильтрует оставляя только те dict где динамика отрицательная (то есть -%)
+        # отрезок пишется задним числом: with span() через yield перенес бы текущий отрезок в код который читает строки
+        parent = tracing.current_span()
+        start = time.perf_counter()
+        rows = 0
+        status = 0
+        response_bytes = None
+        try:
+            async with self.cl_session.get(url=url, headers=self.AUTH_HEADER) as resp:
+                status = resp.status
+                response_bytes = resp.content_length
+                if resp.status != 200:
+                    log_msg(f"Ответ от сервера не 200: {resp.status}", LogLevel.WARN)
+                    return
+                async for row in iter_json_rows(resp.content):
+                    rows += 1
+                    yield row
+        finally:
+            tracing.record(parent, "fetch", start, time.perf_counter(), "job", upstream="redash", query_result_id=query_result_id,
+                           status=status, rows=rows, response_bytes=response_bytes, streamed=True)
+
+    async def iter_query_rows(self, body: dict, query: int | None = None, fresh: bool = False,
+                              policy: int | str | None = None) -> AsyncIterator[dict]:
         """
-        info_about_problem_regions = []
-        for item in raw_info_about_problem_regions:
-            text = item.get("change") or ""
-            cleaned = ''.join(c for c in text if c in '+-.0123456789')
-
-            if float(cleaned) < 0:
-                info_about_problem_regions.append(item)
+        То же что execute_query, но отдает строки результата по одной: ответ Redash читается и разбирается потоком,
+        поэтому в памяти не лежит ни тело ответа, ни весь список строк.
 
-        return info_about_problem_regions
+        Кэш общий с execute_query. Результат кладется в кэш только если строк не больше cache.max_rows
+        и генератор дочитали до конца.
 
+        Args:
+            body(dict): тело запроса (параметры существующего query или SQL с data_source_id)
+            query(int|None): номер существующего query. Если не указан - body это свой SQL запрос
+            fresh(bool): игнорировать кэш и выполнить query заново
+            policy(int|str|None): ключ политики кэширования в RedashAPI.CachePolicy, если не по id query
+        Yields:
+            dict: строка результата (query_result.data.rows[i]). Если query не отработал - ничего
+        """
+        policy_key, key, ttl, max_age = self._cache_params(body, query, policy)
+        fresh = fresh or not self.use_cache
+
+        if not fresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                log_msg(f"Redash query {policy_key}: результат из кэша", LogLevel.DEBUG)
+                for row in ((cached.get("query_result") or {}).get("data") or {}).get("rows") or []:
+                    yield row
+                return
+
+        result, result_id = await self._run_query(body, query, 0 if fresh else max_age)
+        if result is not None:
+            self.cache.set(key, result, ttl)
+            for row in ((result.get("query_result") or {}).get("data") or {}).get("rows") or []:
+                yield row
+            return
+        if result_id == 0:
+            return
+
+        # копим строки для кэша пока их не больше max_rows, дальше кэш для этого результата не ведем
+        rows : list[dict] | None = [] if ttl > 0 else None
+        async for row in self.iter_result_rows(result_id):
+            if rows is not None:
+                rows.append(row)
+                if len(rows) > self.cache.max_rows:
+                    rows = None
+            yield row
+
+        if rows is not None:
+            self.cache.set(key, {"query_result": {"id": result_id, "data": {"rows": rows}}}, ttl)
 
+    # ---------------------------------------------------------------------------
     @log_call
-    async def _parse_info_about_problem_regions(self, data: dict) -> dict:
+    async def get_schedules_by_mp(self, marketplace : Marketplace, concurrency : int | None = None) -> dict[str, int]:
         """
-        Из ответа вытягивает Кол-во заказов, их динамику и регион.
-        PS: эту хуйню писал GPT так что я хз как оно работает. Тут используются регулярки а я в них не шарю вообще. 
+        Запускает query дашборда Redash и возвращает количество расписаной для МП в каждом РК.
+        Job'ы по РК запускаются параллельно (если указан concurrency - не больше concurrency одновременно), у каждого РК свой payload,
+        поэтому время вызова ~ время самого медленного Job'а, а не сумма всех.
 
         Args:
-            data(dict): Ответ с дашборда который будет парсится
+            marketplace(Marketplace): Маркетплейс по РК которого будет выполнен поиск расписаний
+            concurrency(int|None): сколько Job'ов по РК держать в Redash одновременно. Если не указан - все РК сразу
         Returns:
-            dict: Json с количеством заказов, РК и динамикой
+            dict: Количество расписаний для каждого региона МП где РК - ключ, а количество расписаний - значение
         """
-        # Достаем название региона
-        region_html = data.get("organization_name", "")
-        region = re.sub(r'<[^>]+>', '', region_html).strip()
-        
-        # Достаем значение и изменение из "Кол-во заказов"
-        orders_html = data.get("Кол-во заказов", "")
-        clean_text = re.sub(r'<[^>]+>', '', orders_html)
-        
-        # Ищем значение
-        value_match = re.search(r':\s*(\d+)', clean_text)
-        value = float(value_match.group(1)) if value_match else None
-        
-        # Ищем изменение
-        change_match = re.search(r'\(([^)]+)\)', clean_text)
-        change = change_match.group(1) if change_match else None
-        
-        return {
-            "region": region,
-            "value": value,
-            "change": change
-        }
+        semaphore = asyncio.Semaphore(concurrency or len(marketplace.regions) or 1)
+
+        async def fetch(region : Region) -> tuple[str, int] | None:
+            payload = copy.deepcopy(RedashAPI.QueryBody.SCHEDULES_QUERY)
+            payload["parameters"]["Маркетплейс"] = marketplace.name
+            payload["parameters"]["РК"] = region.city
+
+            has_rows = False
+            schedules_count = 0
+            rk = region.name
+            async with semaphore:
+                with tracing.span("schedules", "internal", region=region.name):
+                    async for row in self.iter_query_rows(body=payload, query=886):
+                        has_rows = True
+                        if row.get("status_name", "") == "Расписание сформировано":
+                            num = row.get("num") or 0
+                            schedules_count += num if isinstance(num, int) else 0
+
+                        rk = row.get("rk") or rk
+
+            if not has_rows:
+                return None
+            log_msg(f"РК: {rk}, Количество расписаний: {schedules_count}", LogLevel.INFO)
+            return rk, schedules_count
+
+        results = await asyncio.gather(*(fetch(region) for region in marketplace.regions))
+        return dict(result for result in results if result is not None)
+
+    # ---------------------------------------------------------------------------
 
     @log_call
-    async def get_info_about_problem_regions(self, marketplace : Marketplace) -> list[dict]:
+    async def get_info_about_problem_regions(self, marketplace : Marketplace) -> list[ProblemRegion]:
         """        
         Запускает query для получения инфы о количестве заказов в каждом РК и их динамике п омаркетплейсу.
-        Внутри дополнительно вызывается метод для парсинга ответа от Redash так как он возвращает json с html
+        Redash возвращает json с html - строки разбираются parse_problem_region (redash_parse.py)
 
         Args:
             markeplace(Marketplace): Маркетплейс у которого будет собираться статистика по РК
         Returns:
-            list[dict]: Список данных по РК о заказах
+            list[ProblemRegion]: РК с отрицательной динамикой заказов
         """
         results = []
         
-        payload = RedashAPI.QueryBody.PROBLEM_RK_QUERY.copy()
+        payload = copy.deepcopy(RedashAPI.QueryBody.PROBLEM_RK_QUERY)
         payload["parameters"]["marketplace_name"] = marketplace.name
 
-        job_id = await self.start_job(body=payload, url=RedashAPI.Endpoints.START_JOB_ENDPOINT, query=9021)
-        if job_id != "null":
-            status, result_id = await self.check_status_job(job_id)
-            if result_id != 0:
-                log_msg(f"Redash job успешно отработал. Последний статус: {status}", LogLevel.SUCCESS)
-                result = json.loads(json.dumps(await self.get_result_job(result_id)))# докодируем ответ потому что он приходит в формате unicode последовательности (типо так → "\u041a\u043e\u043b-\u0432\u043e \u0437\u0430\u043a\u0430\u0437\u043e\u0432")
-                query_result = result.get("query_result") or {}
-                data = query_result.get("data") or {}
-                rows = data.get("rows") or []
-
-                for row in rows:
-                    results.append(await self._parse_info_about_problem_regions(row))
+        # строки разбираются по одной по мере чтения ответа, в памяти остаются только регионы с отрицательной динамикой
+        async for row in self.iter_query_rows(body=payload, query=9021):
+            item = parse_problem_region(row, negative_only=True)
+            if item is not None:
+                results.append(item)
 
-            else:
-                log_msg(f"Redash job не отработал. Последний статус: {status}", LogLevel.ERORR)
-        
-        return self._filter(results) # что бы оставить только записи где -%
+        return results
 
     # ---------------------------------------------------------------------------
 
     @log_call
-    async def get_info_about_history(self, marketplace : Marketplace) -> dict:
+    async def get_info_about_history(self, marketplace : Marketplace, weeks : int | None = None, mode : str | None = None) -> dict:
         """
-        Получает истроческие данные количества заказов за текущий день недели по МП (то есть если сегодня вторник - выдаст данные за все вторники за 30 дней)
+        Получает истроческие данные количества заказов за текущий день недели по МП (то есть если сегодня вторник - выдаст данные за сегодня и прошлые вторники)
+        Окно считается в момент вызова.
+
+        Режимы:
+            - "range" - один query 9018 за weeks недель, из строк остаются только нужные дни недели
+            - "weekdays" - по query на каждый нужный день (параллельно), Redash отдает только эти дни.
+              Прошедшие дни не меняются и кэшируются на сутки (RedashAPI.CachePolicy "9018:past") - после первого вызова выполняется только query за сегодня
 
         Args:
             marketplace(Marketplace): Маркетплейс для которого будет собираться статистика.
+            weeks(int|None): сколько недель назад кроме текущей. По умолчанию - history_weeks клиента (REDASH_HISTORY_WEEKS, 4)
+            mode(str|None): "range" или "weekdays". По умолчанию - history_mode клиента (REDASH_HISTORY_MODE, "range")
         Returns:
-            dict: Данные по заказам за каждый (текущий) день недели за 30 дней, где дата - ключ, количество заказов - значение
+            dict: Данные по заказам за каждый (текущий) день недели, где дата (datetime) - ключ, количество заказов - значение
         """
+        weeks = self.history_weeks if weeks is None else weeks
+        mode = mode or self.history_mode
+        if mode not in self.HISTORY_MODES:
+            raise ValueError(f"Неизвестный режим истории {mode}. Варианты: {', '.join(self.HISTORY_MODES)}")
+
+        today = datetime.date.today()
+        wanted = {today - datetime.timedelta(weeks=week) for week in range(weeks + 1)}
+        same_weekday : dict[datetime.date, object] = {}
+
+        def collect(row : dict) -> None:
+            # дата сравнивается числом (fromisoformat - без strptime), строки идут потоком и в любом порядке
+            raw = row.get("data")
+            if not raw:
+                return
+            date = datetime.date.fromisoformat(raw[:10])
+            if date in wanted:
+                same_weekday[date] = row.get("Кол-во заказов")
+
+        if mode == "range":
+            payload = RedashAPI.QueryBody.history_query(marketplace.name, today - datetime.timedelta(weeks=weeks), today)
+            async for row in self.iter_query_rows(body=payload, query=9018):
+                collect(row)
+        else:
+            async def fetch(date : datetime.date) -> None:
+                payload = RedashAPI.QueryBody.history_query(marketplace.name, date, date)
+                async for row in self.iter_query_rows(body=payload, query=9018, policy=None if date == today else "9018:past"):
+                    collect(row)
+
+            await asyncio.gather(*(fetch(date) for date in sorted(wanted, reverse=True)))
+
+        # от сегодня назад по неделям, пока есть данные за день (как и раньше - цепочка обрывается на первом пропуске)
         history = {}
-        
-        payload = RedashAPI.QueryBody.HISTORY_QUERY.copy()
-        payload["parameters"]["marketplace_name"] = marketplace.name
+        target_date = today
+        while target_date in same_weekday:
+            history[datetime.datetime.combine(target_date, datetime.time())] = same_weekday[target_date]
+            target_date -= datetime.timedelta(weeks=1)
 
-        job_id = await self.start_job(body=payload, url=RedashAPI.Endpoints.START_JOB_ENDPOINT, query=9018)
-        if job_id != "null":
-            status, result_id = await self.check_status_job(job_id)
-            if result_id != 0:
-                log_msg(f"Redash job успешно отработал. Последний статус: {status}", LogLevel.SUCCESS)
-                result = await self.get_result_job(result_id)
-                query_result = result.get("query_result") or {}
-                data = query_result.get("data") or {}
-                rows = data.get("rows") or []
-                rows.reverse()
-
-                history = {}
-                target_date = datetime.datetime.now().strftime('%Y-%m-%d')
-
-                for row in rows:
-                    if target_date == (datetime.datetime.strptime(row.get("data"), "%Y-%m-%d").strftime('%Y-%m-%d')):
-                        count_orders = row.get("Кол-во заказов")
-                        history[datetime.datetime.strptime(row.get("data"), "%Y-%m-%d")] = count_orders
-
-                        target_date = (datetime.datetime.strptime(row.get("data"), "%Y-%m-%d") - datetime.timedelta(days=7)).strftime('%Y-%m-%d')
-            else:
-                log_msg(f"Redash job не отработал. Последний статус: {status}", LogLevel.ERORR)
-                history = {}
-        
         return history
 
     # ---------------------------------------------------------------------------
@@ -366,34 +540,20 @@ class RedashClient:
         payload = {
             "query": RedashAPI.QueryBody.SQL_DISCREPANCY_STORS_BY_REGIONS.format(mp_id=marketplace.id),
             "data_source_id": 24,
-            "max_age" : 0
+            "max_age" : 0 # выставляется в iter_query_rows по RedashAPI.CachePolicy
         }
-        job_id = await self.start_job(payload)
-        
-        if job_id != "null":
-            status, result_id = await self.check_status_job(job_id)
-            if result_id != 0:
-                log_msg(f"Redash job успешно отработал. Последний статус: {status}", LogLevel.SUCCESS)
-                result = json.loads(json.dumps(await self.get_result_job(result_id))) # декодируем ответ потому что он приходит в формате unicode последовательности (типо так → "\u041a\u043e\u043b-\u0432\u043e \u0437\u0430\u043a\u0430\u0437\u043e\u0432")
-                query_result = result.get("query_result")
-                data = query_result.get("data")
-                rows = data.get("rows")
-
-                result = {}
-                for row in rows:
-                    region = row.get("РК") or "null"
-                    one_s_count = row.get("1С") or 0
-                    ecom_count = row.get("Ecom") or 0
-                    convergence = row.get("Доля схождений") or 100.0
-
-                    result[region] = {
-                        "one_s" : one_s_count,
-                        "ecom" : ecom_count,
-                        "convergence" : convergence
-                    }
-            else:
-                log_msg(f"Redash job не отработал. Последний статус: {status}", LogLevel.ERORR)
-                result = {}
+        result = {}
+        async for row in self.iter_query_rows(body=payload):
+            region = row.get("РК") or "null"
+            one_s_count = row.get("1С") or 0
+            ecom_count = row.get("Ecom") or 0
+            convergence = row.get("Доля схождений") or 100.0
+
+            result[region] = {
+                "one_s" : one_s_count,
+                "ecom" : ecom_count,
+                "convergence" : convergence
+            }
         return result
         
             
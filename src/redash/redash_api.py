@@ -1,9 +1,10 @@
+import os
 from enum import Enum
 import datetime
 class RedashAPI():
     
     class Endpoints:
-        BASE_URL = "https://redash.polza.ru"
+        BASE_URL = os.getenv("REDASH_URL", "https://redash.polza.ru") # переопределяется для локальных стендов (tests/bench)
 
         START_JOB_ENDPOINT = "/api/queries/{query}/results"
         GET_STATUS_JOB_ENDPOINT = "/api/jobs/"
@@ -18,9 +19,37 @@ class RedashAPI():
         FAILURE = 4
         CANCELLED = 5
  
+    class CachePolicy:
+        # query id (или "sql" для своих SQL запросов) → (TTL клиентского кэша, max_age для Redash) в секундах
+        # max_age > 0 позволяет Redash отдать сохраненный результат вместо повторного выполнения query.
+        # Задержки складываются: Redash может отдать результат возрастом до max_age, а клиент держит его еще TTL,
+        # поэтому данные бывают старше на TTL + max_age. max_age - половина TTL: итоговая граница 1.5 TTL
+        POLICY = {
+            886 : (300, 150), # расписания - не старше 7.5 минут
+            9021 : (300, 150), # проблемные РК - не старше 7.5 минут
+            9018 : (3600, 1800), # история за несколько недель - меняется раз в сутки, не старше 1.5 часов
+            "9018:past" : (86400, 86400), # история за один прошедший день (get_info_about_history mode="weekdays") - уже не меняется
+            "sql" : (600, 300), # расхождения ТВЗ (cached_query_8437) - не старше 15 минут
+        }
+        DEFAULT = (0, 0) # не кэшировать
+
+        @classmethod
+        def get(cls, query : int | str) -> tuple[int, int]:
+            return cls.POLICY.get(query, cls.DEFAULT)
+
     class QueryBody:
         SCHEDULES_QUERY = {"id":8862,"parameters":{"Маркетплейс":"{mp_name}","РК":"{reg_name}","Регион":["Bce регионы"]},"apply_auto_limit":False,"max_age":0}
         PROBLEM_RK_QUERY = {"id":9021,"parameters":{"marketplace_name":"{mp_name}"},"apply_auto_limit":False,"max_age":0}
-        HISTORY_QUERY = {"id":9018,"parameters":{"Период":{"start":f"{(datetime.datetime.now() - datetime.timedelta(days=30)).strftime('%Y-%m-%d')}","end":f"{datetime.datetime.now().strftime('%Y-%m-%d')}"},"Тип отрезка":"day","marketplace_name":"{mp_name}"},"apply_auto_limit":False,"max_age":0}
+        # Период подставляется при вызове (history_query) - иначе долго работающий процесс запрашивает окно на дату импорта
+        HISTORY_QUERY = {"id":9018,"parameters":{"Период":{"start":"{start}","end":"{end}"},"Тип отрезка":"day","marketplace_name":"{mp_name}"},"apply_auto_limit":False,"max_age":0}
         SQL_DISCREPANCY_STORS_BY_REGIONS = "with b as ( select marketplace_id, rk_id, rk, addressguid, tvz_1c, tvz_ec from cached_query_8437 where marketplace_id = {mp_id} ) select 0 as \"РК id\", 'Все РК' as \"РК\", count(tvz_1c) as \"1С\", count(tvz_ec) as \"Ecom\", sum(case when tvz_1c > 0 and tvz_ec is null then 1 else 0 end) || ' / ' || sum(case when tvz_1c is null and tvz_ec > 0 then 1 else 0 end) as \"Отсутствуют/Лишние (Ecom-1С)\", coalesce(round((sum(case when tvz_1c = tvz_ec then 1 else 0 end) - sum(case when tvz_1c is null and tvz_ec > 0 then 1 else 0 end)) * 100.0 / count(tvz_1c), 2), 0.00) as \"Доля схождений\", datetime('now','+3 hour') as dt from b union select rk_id, rk, count(tvz_1c) as tvz_1c, count(tvz_ec) as tvz_ec, sum(case when tvz_1c > 0 and tvz_ec is null then 1 else 0 end) || ' / ' || sum(case when tvz_1c is null and tvz_ec > 0 then 1 else 0 end) as lc_ec, coalesce(round((sum(case when tvz_1c = tvz_ec then 1 else 0 end) - sum(case when tvz_1c is null and tvz_ec > 0 then 1 else 0 end)) * 100.0 / count(tvz_1c), 2), 0.00) as lc_ec_p, datetime('now','+3 hour') as dt from b where rk is not null and rk <> 'Нет инфо' group by rk_id, rk"
-        
+
+        @classmethod
+        def history_query(cls, mp_name : str, start : datetime.date, end : datetime.date) -> dict:
+            """
+            Тело query 9018 (заказы по дням) за период [start, end] включительно
+            """
+            return cls.HISTORY_QUERY | {"parameters": cls.HISTORY_QUERY["parameters"] | {
+                "Период": {"start": start.isoformat(), "end": end.isoformat()},
+                "marketplace_name": mp_name
+            }}
@@ -0,0 +1,83 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Any
+
+from src.loger import log_msg, LogLevel
+
+class RedashResultCache:
+    """
+    Клиентский кэш результатов Redash query с TTL на каждую запись и вытеснением давно не использованных (LRU).
+    Ключ - (id query или текст SQL, нормализованные параметры).
+
+    Живет на уровне процесса (см. RESULT_CACHE), поэтому переживает пересоздание RedashClient между отчетами.
+    Результат отдается как есть, без копирования - вызывающий код не должен его изменять.
+    """
+
+    def __init__(self, max_entries : int = 256, max_rows : int = 10000) -> None:
+        """
+        Args:
+            max_entries(int): сколько результатов держать в кэше
+            max_rows(int): результаты которые читаются потоком (RedashClient.iter_query_rows) и содержат больше строк - не кэшируются,
+                что бы кэш не держал в памяти огромные ответы целиком
+        """
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries : OrderedDict[tuple, tuple[float, Any]] = OrderedDict() # ключ → (момент протухания по monotonic, результат)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(query : int | str, params : dict | None = None) -> tuple:
+        """
+        Строит ключ кэша. Параметры нормализуются (сортировка ключей), поэтому порядок параметров не влияет на ключ
+        """
+        normalized = json.dumps(params or {}, sort_keys=True, ensure_ascii=False, default=str)
+        return (query, normalized)
+
+    def get(self, key : tuple) -> Any | None:
+        """
+        Возвращает результат по ключу или None если его нет/он протух
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key : tuple, value : Any, ttl : float) -> None:
+        """
+        Кладет результат в кэш на ttl секунд. Если записей больше max_entries - вытесняет самую давно использованную
+        """
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            log_msg(f"Redash кэш: вытеснен {evicted[0]}", LogLevel.DEBUG)
+
+    def invalidate(self, query : int | str | None = None) -> None:
+        """
+        Сбрасывает кэш целиком или только записи конкретного query
+        """
+        if query is None:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if key[0] == query]:
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# общий кэш процесса
+RESULT_CACHE = RedashResultCache()
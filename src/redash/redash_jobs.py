@@ -0,0 +1,180 @@
+import asyncio
+import contextvars
+import time
+from typing import TYPE_CHECKING
+
+from src import tracing
+from src.loger import log_msg, LogLevel
+from src.redash.redash_api import RedashAPI
+
+if TYPE_CHECKING:
+    from src.redash.redash import RedashClient
+
+FINAL_STATUSES = (RedashAPI.JobStatus.SUCCESS.value, RedashAPI.JobStatus.FAILURE.value, RedashAPI.JobStatus.CANCELLED.value)
+
+class _TrackedJob:
+    """
+    Состояние одного отслеживаемого Job'а: future для ожидающих, текущий интервал опроса и дедлайн.
+    Для трассы - когда Job поставили, когда впервые увидели STARTED и под каким отрезком записать его состояния
+    """
+    __slots__ = ("job_id", "future", "interval", "next_poll", "deadline", "span", "queued_at", "started_at", "polls")
+
+    def __init__(self, job_id : str, future : asyncio.Future, interval : float, next_poll : float, deadline : float) -> None:
+        self.job_id = job_id
+        self.future = future
+        self.interval = interval
+        self.next_poll = next_poll
+        self.deadline = deadline
+        self.span = tracing.current_span()
+        self.queued_at = time.perf_counter()
+        self.started_at : float | None = None
+        self.polls = 0
+
+class RedashJobTracker:
+    """
+    Отслеживает сразу много Job'ов Redash одним фоновым циклом опроса.
+
+    Каждый Job опрашивается с адаптивным интервалом: сначала часто (min_interval), затем интервал растет
+    в backoff раз до max_interval. Future Job'а резолвится сразу как только он перешел в SUCCESS/FAILURE/CANCELLED.
+    Job'ы которые не успели до дедлайна отменяются в Redash и резолвятся как CANCELLED.
+    """
+
+    def __init__(self, client : "RedashClient", min_interval : float = 0.5, max_interval : float = 5.0, backoff : float = 2.0, deadline : float = 600.0) -> None:
+        """
+        Args:
+            client(RedashClient): клиент через который делаются запросы статуса/отмены
+            min_interval(float): первый интервал опроса в секундах
+            max_interval(float): максимальный интервал опроса в секундах
+            backoff(float): во сколько раз растет интервал после каждого опроса
+            deadline(float): сколько секунд ждать Job по умолчанию, после этого Job отменяется
+        """
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.deadline = deadline
+
+        self._jobs : dict[str, _TrackedJob] = {}
+        self._wakeup = asyncio.Event()
+        self._poller : asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._jobs)
+
+    def track(self, job_id : str, deadline : float | None = None) -> asyncio.Future:
+        """
+        Ставит Job на отслеживание и возвращает future с результатом (status, query_result_id).
+        Повторный вызов для того же job_id вернет тот же future.
+
+        Args:
+            job_id(str): id Job'а
+            deadline(float|None): сколько секунд ждать Job. Если не указан - self.deadline
+        Returns:
+            asyncio.Future: резолвится в tuple[int, int] - статус и query_result_id (0 если Job не отработал)
+        """
+        if job_id in self._jobs:
+            return self._jobs[job_id].future
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        job = _TrackedJob(
+            job_id=job_id,
+            future=loop.create_future(),
+            interval=self.min_interval,
+            next_poll=now + self.min_interval,
+            deadline=now + (deadline if deadline is not None else self.deadline)
+        )
+        self._jobs[job_id] = job
+
+        if self._poller is None or self._poller.done():
+            # пустой контекст - цикл опроса общий на все Job'ы и не должен попадать в трассу того кто поставил первый Job
+            self._poller = asyncio.create_task(self._run(), context=contextvars.Context())
+        self._wakeup.set() # что бы цикл пересчитал время ближайшего опроса
+        return job.future
+
+    async def wait(self, job_id : str, deadline : float | None = None) -> tuple[int, int]:
+        """
+        Ставит Job на отслеживание и ждет его завершения.
+        Отмена ожидающего не отменяет отслеживание - другие ожидающие того же Job'а получат результат.
+        """
+        return await asyncio.shield(self.track(job_id, deadline))
+
+    def _resolve(self, job : _TrackedJob, status : int, query_result_id : int) -> None:
+        self._jobs.pop(job.job_id, None)
+        if job.span is not None:
+            # границы состояний известны с точностью до интервала опроса. Если STARTED не застали - весь Job считается queued
+            end = time.perf_counter()
+            started_at = job.started_at if job.started_at is not None else end
+            tracing.record(job.span, "queued", job.queued_at, started_at, "job", job_id=job.job_id, polls=job.polls)
+            if job.started_at is not None:
+                tracing.record(job.span, "running", job.started_at, end, "job", job_id=job.job_id, status=RedashAPI.JobStatus(status).name)
+        if not job.future.done():
+            job.future.set_result((status, query_result_id))
+
+    async def _poll(self, job : _TrackedJob) -> None:
+        """
+        Один опрос статуса Job'а: резолвит его если он завершился или просрочен, иначе назначает следующий опрос
+        """
+        loop = asyncio.get_running_loop()
+        if loop.time() >= job.deadline:
+            log_msg(f"Job {job.job_id} не завершился до дедлайна → отменяем", LogLevel.WARN)
+            try:
+                await self.client.cancel_job(job.job_id)
+            except Exception as e:
+                log_msg(f"Не удалось отменить job {job.job_id}: {e}", LogLevel.WARN)
+            self._resolve(job, RedashAPI.JobStatus.CANCELLED.value, 0)
+            return
+
+        try:
+            status, query_result_id = await self.client.get_status_job(job.job_id)
+            job.polls += 1
+        except Exception as e:
+            log_msg(f"Ошибка при проверке статуса job: {e}", LogLevel.ERORR)
+            self._resolve(job, RedashAPI.JobStatus.CANCELLED.value, 0)
+            return
+
+        if status == RedashAPI.JobStatus.STARTED.value and job.started_at is None:
+            job.started_at = time.perf_counter()
+        if status in FINAL_STATUSES:
+            self._resolve(job, status, query_result_id)
+            return
+
+        job.interval = min(job.interval * self.backoff, self.max_interval)
+        job.next_poll = loop.time() + job.interval
+
+    async def _run(self) -> None:
+        """
+        Фоновый цикл: опрашивает все Job'ы у которых подошло время, затем спит до ближайшего следующего опроса
+        (или пока не добавят новый Job)
+        """
+        loop = asyncio.get_running_loop()
+        while self._jobs:
+            now = loop.time()
+            due = [job for job in self._jobs.values() if job.next_poll <= now]
+            if due:
+                await asyncio.gather(*(self._poll(job) for job in due))
+            if not self._jobs:
+                break
+
+            self._wakeup.clear()
+            delay = min(job.next_poll for job in self._jobs.values()) - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def close(self) -> None:
+        """
+        Останавливает цикл опроса. Все не завершенные Job'ы резолвятся как CANCELLED
+        """
+        if self._poller is not None and not self._poller.done():
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+        self._poller = None
+        for job in list(self._jobs.values()):
+            self._resolve(job, RedashAPI.JobStatus.CANCELLED.value, 0)
@@ -0,0 +1,62 @@
+import re
+
+from src.models import ProblemRegion
+
+# HTML-в-JSON дашборда 9021:
+#   organization_name: "<b>MSK</b>"
+#   Кол-во заказов:    "<span>Заказы: 150</span> <i>(-9.81% ↓)</i>"
+_TAG = re.compile(r"<[^>]*>")
+_ROW = re.compile(r":\s*(\d+)[^(]*\(([^)]+)\)") # обычный порядок: "Заказы: 120 (-12.5%)" - одним search
+_ORDERS = re.compile(r":\s*(\d+)|\(([^)]+)\)") # любой порядок: количество после ":" или динамика в скобках
+_CHANGE = re.compile(r"([+\-−])?\s*(\d+(?:[.,]\d+)?)")
+
+def _strip_tags(html : str) -> str:
+    return _TAG.sub("", html) if "<" in html else html
+
+def parse_change(text : str | None) -> float | None:
+    """
+    Динамика из текста вида "-9.81% ↓", "+3,2 %" или "−7%" в число. None если числа нет
+    """
+    if not text:
+        return None
+    try:
+        return float(text.rstrip("%↓↑ ").replace(",", ".").replace("−", "-"))
+    except ValueError:
+        pass
+    match = _CHANGE.search(text)
+    if match is None:
+        return None
+    number = float(match.group(2).replace(",", "."))
+    return -number if match.group(1) in ("-", "−") else number
+
+def parse_problem_region(row : dict, negative_only : bool = False) -> ProblemRegion | None:
+    """
+    Разбирает строку дашборда заказов по РК за один проход по HTML.
+    С negative_only отбрасывает строки без падения заказов еще до разбора региона (возвращает None)
+
+    Args:
+        row(dict): строка результата query 9021
+        negative_only(bool): оставлять только строки с отрицательной динамикой
+    Returns:
+        ProblemRegion|None: регион, количество заказов и динамика в процентах
+    """
+    orders = _strip_tags(row.get("Кол-во заказов") or "")
+    match = _ROW.search(orders)
+    if match is not None:
+        value, change_text = float(match.group(1)), match.group(2)
+    else:
+        value = None
+        change_text = None
+        for match in _ORDERS.finditer(orders):
+            if match.group(1) is not None:
+                if value is None:
+                    value = float(match.group(1))
+            elif change_text is None:
+                change_text = match.group(2)
+
+    change = parse_change(change_text)
+    if negative_only and (change is None or change >= 0):
+        return None
+
+    region = _strip_tags(row.get("organization_name") or "").strip()
+    return ProblemRegion(region=region, value=value, change=change)
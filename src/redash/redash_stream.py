@@ -0,0 +1,106 @@
+import codecs
+import json
+from typing import AsyncIterator
+
+from aiohttp import StreamReader
+
+ROWS_PATH = ("query_result", "data", "rows") # где лежат строки в ответе /api/query_results/<id>
+
+class _RowsLocator:
+    """
+    Потоковый поиск начала массива по пути ключей (например query_result.data.rows) в JSON тексте который приходит кусками.
+    Разбирает только структуру (скобки, строки, ключи), значения не собирает - поэтому "rows" внутри текста query не сработает.
+    """
+
+    def __init__(self, path : tuple[str, ...]) -> None:
+        self.path = list(path)
+        self.stack : list[list] = [] # [тип контейнера "{" или "[", текущий ключ, ждем ли ключ]
+        self.in_string = False
+        self.escape = False
+        self.string : list[str] = []
+
+    def feed(self, text : str) -> int | None:
+        """
+        Скармливает очередной кусок текста.
+        Возвращает индекс в text сразу после "[" искомого массива или None если массив еще не найден
+        """
+        for i, char in enumerate(text):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    top = self.stack[-1] if self.stack else None
+                    if top is not None and top[0] == "{" and top[2]:
+                        top[1] = json.loads('"' + "".join(self.string) + '"')
+                        top[2] = False
+                    continue
+                self.string.append(char)
+            elif char == '"':
+                self.in_string = True
+                self.string = []
+            elif char == "{":
+                self.stack.append(["{", None, True])
+            elif char == "[":
+                keys = [frame[1] for frame in self.stack if frame[0] == "{"]
+                if len(keys) == len(self.stack) and keys == self.path:
+                    return i + 1
+                self.stack.append(["[", None, False])
+            elif char in "}]":
+                self.stack.pop()
+            elif char == "," and self.stack and self.stack[-1][0] == "{":
+                self.stack[-1][2] = True
+        return None
+
+async def iter_json_rows(content : StreamReader, path : tuple[str, ...] = ROWS_PATH, chunk_size : int = 65536) -> AsyncIterator[dict]:
+    """
+    Читает JSON ответ кусками и отдает элементы массива по пути path по одному, по мере их разбора.
+    В памяти держится только текущий кусок и текущая строка, а не весь ответ.
+
+    Args:
+        content(StreamReader): тело ответа (resp.content)
+        path(tuple[str, ...]): путь ключей до массива строк
+        chunk_size(int): сколько байт читать за раз
+    Yields:
+        dict: очередная строка результата
+            - Если массива по пути нет (например ответ с ошибкой) - ничего не отдается
+    Raises:
+        ValueError: если ответ оборвался (посреди массива или раньше - JSON не закрыт)
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    json_decoder = json.JSONDecoder()
+    locator = _RowsLocator(path)
+    buffer = ""
+    in_rows = False
+
+    async for chunk in content.iter_chunked(chunk_size):
+        text = decoder.decode(chunk)
+        if not in_rows:
+            start = locator.feed(text)
+            if start is None:
+                continue
+            in_rows = True
+            text = text[start:]
+        buffer += text
+
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == "]":
+                return
+            try:
+                row, pos = json_decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break # строка пришла не целиком - дочитываем следующий кусок
+            yield row
+        buffer = buffer[pos:]
+
+    if in_rows:
+        raise ValueError("Ответ Redash оборвался посреди списка строк")
+    if locator.stack or locator.in_string:
+        raise ValueError("Ответ Redash оборвался до списка строк")
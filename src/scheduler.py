@@ -0,0 +1,165 @@
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable
+
+from src.loger import log_msg, LogLevel
+from src.models import JobStats
+
+class ScheduledJob:
+    """
+    Периодическая задача планировщика: фабрика корутины, интервал, смещение первого запуска и статистика
+    """
+    __slots__ = ("name", "group", "interval", "offset", "factory", "running", "stats")
+
+    def __init__(self, name : str, group : str, interval : float, offset : float, factory : Callable[[], Awaitable[Any]]) -> None:
+        self.name = name
+        self.group = group
+        self.interval = interval
+        self.offset = offset
+        self.factory = factory
+        self.running = False
+        self.stats = JobStats(name=name, group=group, interval=interval)
+
+class Scheduler:
+    """
+    Простой планировщик периодических задач в event loop.
+
+    - у каждой задачи свой интервал, первые запуски задач одной группы разнесены равномерно по интервалу, группы сдвинуты друг относительно друга (+ небольшой jitter),
+      что бы все маркетплейсы не били в Grafana/Redash одновременно
+    - если предыдущий запуск задачи еще идет - цикл пропускается (stats.skipped), задачи не копятся
+    - для каждого запуска считается отставание от расписания (lag) и длительность
+    """
+
+    def __init__(self, jitter : float = 0.1, on_result : Callable[[ScheduledJob, Any, str | None], None] | None = None) -> None:
+        """
+        Args:
+            jitter(float): случайная добавка к смещению первого запуска, доля интервала (0.1 = до 10% интервала)
+            on_result(Callable|None): вызывается после каждого запуска с (задача, результат, ошибка или None)
+        """
+        self.jitter = jitter
+        self.on_result = on_result
+        self.jobs : list[ScheduledJob] = []
+        self._tasks : set[asyncio.Task] = set()
+
+    def add(self, name : str, interval : float, factory : Callable[[], Awaitable[Any]], group : str = "default") -> ScheduledJob:
+        """
+        Регистрирует периодическую задачу. Смещения первых запусков пересчитываются в start()
+
+        Args:
+            name(str): уникальное имя задачи (например "Ютека:stors")
+            interval(float): период в секундах
+            factory(Callable): функция без аргументов которая возвращает корутину одного запуска
+            group(str): группа (семейство метрик) - внутри группы старты разносятся по интервалу
+        """
+        job = ScheduledJob(name=name, group=group, interval=interval, offset=0.0, factory=factory)
+        self.jobs.append(job)
+        return job
+
+    def _spread(self) -> None:
+        """
+        Разносит первые запуски задач каждой группы равномерно по интервалу группы.
+        Группы дополнительно сдвинуты друг относительно друга на долю шага внутри группы,
+        что бы первые задачи всех групп не стартовали одновременно
+        """
+        groups : dict[str, list[ScheduledJob]] = {}
+        for job in self.jobs:
+            groups.setdefault(job.group, []).append(job)
+        for g, jobs in enumerate(groups.values()):
+            shift = g / len(groups)
+            for i, job in enumerate(jobs):
+                job.offset = job.interval * (i + shift) / len(jobs) + random.uniform(0, job.interval * self.jitter)
+
+    async def _execute(self, job : ScheduledJob, lag : float) -> None:
+        start = time.perf_counter()
+        result, error = None, None
+        try:
+            result = await job.factory()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            log_msg(f"[{job.name}] запуск упал: {error}", LogLevel.ERORR)
+        finally:
+            job.running = False
+
+        duration = time.perf_counter() - start
+        s = job.stats
+        s.runs += 1
+        s.failures += error is not None
+        s.last_duration = duration
+        s.max_duration = max(s.max_duration, duration)
+        s.total_duration += duration
+        s.last_lag = lag
+        s.max_lag = max(s.max_lag, lag)
+
+        if self.on_result is not None:
+            try:
+                self.on_result(job, result, error)
+            except Exception as e:
+                log_msg(f"[{job.name}] ошибка обработки результата: {e}", LogLevel.ERORR)
+
+    async def _job_loop(self, job : ScheduledJob) -> None:
+        loop = asyncio.get_running_loop()
+        next_run = loop.time() + job.offset
+        while True:
+            await asyncio.sleep(max(0.0, next_run - loop.time()))
+            lag = loop.time() - next_run
+
+            if job.running:
+                job.stats.skipped += 1
+                log_msg(f"[{job.name}] предыдущий запуск еще идет → пропускаем цикл", LogLevel.WARN)
+            else:
+                job.running = True
+                task = asyncio.create_task(self._execute(job, lag), name=job.name)
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            next_run += job.interval
+            # если loop был занят дольше интервала - не догоняем пропущенные слоты пачкой
+            while next_run <= loop.time():
+                next_run += job.interval
+                job.stats.skipped += 1
+
+    async def _report_loop(self, every : float) -> None:
+        while True:
+            await asyncio.sleep(every)
+            log_msg(f"Планировщик:\n{self.format_stats()}", LogLevel.INFO)
+
+    async def run(self, report_every : float | None = None) -> None:
+        """
+        Запускает все задачи и работает до отмены
+
+        Args:
+            report_every(float|None): как часто (секунды) писать в лог статистику задач. None - не писать
+        """
+        self._spread()
+        loops = [asyncio.create_task(self._job_loop(job), name=f"loop:{job.name}") for job in self.jobs]
+        if report_every:
+            loops.append(asyncio.create_task(self._report_loop(report_every), name="scheduler-report"))
+        try:
+            await asyncio.gather(*loops)
+        finally:
+            for task in loops + list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*loops, *self._tasks, return_exceptions=True)
+
+    def snapshot(self) -> list[JobStats]:
+        return [job.stats.model_copy() for job in self.jobs]
+
+    def format_stats(self) -> str:
+        """
+        Статистика по группам: запуски, пропуски, ошибки, средняя/максимальная длительность и максимальное отставание
+        """
+        groups : dict[str, list[JobStats]] = {}
+        for job in self.jobs:
+            groups.setdefault(job.group, []).append(job.stats)
+
+        lines = []
+        for group, stats in groups.items():
+            runs = sum(s.runs for s in stats)
+            avg = sum(s.total_duration for s in stats) / runs if runs else 0.0
+            lines.append(
+                f"  {group}: запусков {runs}, пропущено {sum(s.skipped for s in stats)}, ошибок {sum(s.failures for s in stats)}, "
+                f"длительность ср. {avg:.1f}с / макс. {max(s.max_duration for s in stats):.1f}с, "
+                f"отставание макс. {max(s.max_lag for s in stats):.2f}с"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,197 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+class Span:
+    """
+    Один отрезок трассы: фаза отчета, HTTP запрос или состояние Job'а Redash.
+    Время - time.perf_counter() в секундах, атрибуты - то что поможет понять почему отрезок долгий (РК, отрезок в минутах, размер тела)
+    """
+    __slots__ = ("trace", "name", "cat", "start", "end", "attrs", "parent", "tid", "depth")
+
+    def __init__(self, trace : "Trace", name : str, cat : str, parent : "Span | None", tid : int, attrs : dict, start : float | None = None) -> None:
+        self.trace = trace
+        self.name = name
+        self.cat = cat
+        self.start = time.perf_counter() if start is None else start
+        self.end : float | None = None
+        self.attrs = attrs
+        self.parent = parent
+        self.tid = tid
+        self.depth = parent.depth + 1 if parent is not None else 0
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    @property
+    def path(self) -> str:
+        """
+        Имя с именами родителей без корня: grafana.stors
+        """
+        names = []
+        span = self
+        while span is not None and span.parent is not None:
+            names.append(span.name)
+            span = span.parent
+        return ".".join(reversed(names))
+
+class _NoopSpan:
+    """
+    Заглушка когда трасса не ведется: span() ничего не пишет и почти ничего не стоит
+    """
+    __slots__ = ()
+
+    def set(self, **attrs) -> None:
+        pass
+
+_NOOP = _NoopSpan()
+
+class Trace:
+    """
+    Трасса одного отчета: все отрезки по всем задачам (asyncio.Task), в Chrome trace каждая задача - отдельная дорожка (tid)
+    """
+
+    def __init__(self, name : str, **attrs) -> None:
+        self.name = name
+        self.spans : list[Span] = []
+        self._tids : dict[int, int] = {}
+        self._lock = threading.Lock() # спаны бывают и из потоков (in_thread)
+        self.root = self._add(name, "report", None, attrs)
+
+    def _tid(self) -> int:
+        try:
+            owner = asyncio.current_task()
+        except RuntimeError:
+            owner = None
+        key = id(owner) if owner is not None else threading.get_ident()
+        with self._lock:
+            return self._tids.setdefault(key, len(self._tids) + 1)
+
+    def _add(self, name : str, cat : str, parent : Span | None, attrs : dict, start : float | None = None, tid : int | None = None) -> Span:
+        span = Span(self, name, cat, parent, self._tid() if tid is None else tid, attrs, start)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @property
+    def duration(self) -> float:
+        return self.root.duration
+
+    def summary(self, depth : int = 2) -> dict[str, float]:
+        """
+        Тайминги для отчета: длительность фаз и метрик (отрезки до глубины depth, ключ - путь вида grafana.stors)
+        и суммарное время HTTP запросов и состояний Job'ов по имени (ключ "Σ <имя>").
+        Суммы считаются по параллельным отрезкам, поэтому могут быть больше длительности отчета
+        """
+        children : dict[int, list[Span]] = {}
+        totals : dict[str, float] = {}
+        for span in self.spans:
+            if span.end is None or span.parent is None:
+                continue
+            if span.depth <= depth:
+                children.setdefault(id(span.parent), []).append(span)
+            if span.cat in ("http", "job"):
+                key = f"Σ {span.name}"
+                totals[key] = totals.get(key, 0.0) + span.duration
+
+        # обход в глубину - метрики идут сразу под своей фазой
+        phases : dict[str, float] = {}
+        stack = list(reversed(sorted(children.get(id(self.root), []), key=lambda span: span.start)))
+        while stack:
+            span = stack.pop()
+            phases[span.path] = span.duration
+            stack.extend(reversed(sorted(children.get(id(span), []), key=lambda child: child.start)))
+        phases["total"] = self.duration
+        return phases | dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def to_chrome(self) -> dict:
+        """
+        Трасса в формате Chrome trace-event (открывается в chrome://tracing или ui.perfetto.dev)
+        """
+        origin = self.root.start
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": "report" if tid == 1 else f"task {tid}"}}
+            for tid in sorted(set(self._tids.values()) | {span.tid for span in self.spans})
+        ]
+        for span in self.spans:
+            events.append({
+                "name": span.name,
+                "cat": span.cat,
+                "ph": "X",
+                "ts": round((span.start - origin) * 1_000_000, 1),
+                "dur": round(span.duration * 1_000_000, 1),
+                "pid": 1,
+                "tid": span.tid,
+                "args": {key: value if isinstance(value, (int, float, bool, str)) or value is None else str(value) for key, value in span.attrs.items()}
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace": self.name}}
+
+    def save(self, path : str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.to_chrome(), file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+_TRACE : contextvars.ContextVar[Trace | None] = contextvars.ContextVar("trace", default=None)
+_SPAN : contextvars.ContextVar[Span | None] = contextvars.ContextVar("span", default=None)
+
+@contextmanager
+def trace(name : str, **attrs) -> Iterator[Trace]:
+    """
+    Начинает трассу (корневой отрезок). Все span() внутри, в том числе в задачах созданных внутри, попадают в нее
+    """
+    current = Trace(name, **attrs)
+    trace_token = _TRACE.set(current)
+    span_token = _SPAN.set(current.root)
+    try:
+        yield current
+    finally:
+        current.root.end = time.perf_counter()
+        _SPAN.reset(span_token)
+        _TRACE.reset(trace_token)
+
+@contextmanager
+def span(name : str, cat : str = "internal", **attrs) -> Iterator[Span | _NoopSpan]:
+    """
+    Вложенный отрезок трассы. Если трасса не ведется - ничего не делает.
+    Исключение помечается в атрибутах (error) и пробрасывается дальше
+    """
+    current = _TRACE.get()
+    if current is None:
+        yield _NOOP
+        return
+
+    item = current._add(name, cat, _SPAN.get(), attrs)
+    token = _SPAN.set(item)
+    try:
+        yield item
+    except BaseException as e:
+        item.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        item.end = time.perf_counter()
+        _SPAN.reset(token)
+
+def current_span() -> Span | None:
+    """
+    Текущий отрезок (None если трасса не ведется). Нужен что бы потом записать отрезок задним числом через record()
+    """
+    return _SPAN.get() if _TRACE.get() is not None else None
+
+def record(parent : Span | None, name : str, start : float, end : float, cat : str = "internal", **attrs) -> None:
+    """
+    Записывает уже прошедший отрезок под parent (например состояния Job'а которые видит фоновый цикл опроса)
+    """
+    if parent is None:
+        return
+    item = parent.trace._add(name, cat, parent, attrs, start=start, tid=parent.tid)
+    item.end = end
@@ -1,15 +1,47 @@
+import asyncio
+import os
+import sys
+import time
+
 from app import App
+from src.daemon import CollectorDaemon
 from src.loger import setup_logging, log_msg, LogLevel
 
+RESTART_DELAY = 5 # секунд между рестартами после падения
+
 def start(): 
     setup_logging(level=LogLevel.INFO, enable_calls=True)
-    try: 
-        app = App()
-        app.start_app()
-    except Exception as e:
-        log_msg(f"Ошибка в main: {e} \nДелаем рестарт...", LogLevel.ERORR)
-        print("\n\n\n")
-        start()
+    while True: # рестарт циклом, а не рекурсией - иначе каждое падение углубляет стек
+        try: 
+            app = App()
+            app.start_app()
+            return
+        except KeyboardInterrupt:
+            return
+        except Exception as e:
+            log_msg(f"Ошибка в main: {e} \nДелаем рестарт...", LogLevel.ERORR)
+            print("\n\n\n")
+            time.sleep(RESTART_DELAY)
+
+def start_daemon():
+    """
+    Headless режим: периодический сбор по всем активным МП без меню (python start.py --daemon)
+    """
+    setup_logging(level=LogLevel.INFO, enable_calls=False)
+    while True:
+        try:
+            asyncio.run(CollectorDaemon().run())
+            return
+        except KeyboardInterrupt:
+            return
+        except Exception as e:
+            log_msg(f"Демон упал: {e} \nДелаем рестарт...", LogLevel.ERORR)
+            time.sleep(RESTART_DELAY)
 
 if __name__ == "__main__":
-    start()
+    if "--fresh" in sys.argv[1:]:
+        os.environ["REDASH_NO_CACHE"] = "true" # все RedashClient процесса идут мимо кэша (и клиентского, и сохраненных результатов Redash)
+    if "--daemon" in sys.argv[1:]:
+        start_daemon()
+    else:
+        start()
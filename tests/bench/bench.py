@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Any, Awaitable, Callable
+
+from pydantic import BaseModel
+
+from src.loger import LogLevel, setup_logging, flush_logs
+from src.models import Env, Marketplace
+from src.regions import Region
+from src.fleet import percentile
+from src.grafana.grafana import GrafanaClient
+from src.grafana.grafana_auth import GRAFANA_AUTH
+from src.redash.redash import RedashClient
+from src.redash.redash_cache import RESULT_CACHE
+from src.pipeline import AnaliticPipeline
+from tests.bench.stand_in import StandIn, StandInSettings
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+class BenchResult(BaseModel):
+    """
+    Замер одного бенчмарка: длительности прогонов в секундах и сколько HTTP запросов на каждый endpoint делает один прогон
+    """
+    name : str
+    runs : int
+    errors : int = 0
+    last_error : str | None = None
+    min : float = 0.0
+    median : float = 0.0
+    p95 : float = 0.0
+    mean : float = 0.0
+    requests : dict[str, float] = {}
+
+class BenchReport(BaseModel):
+    commit : str
+    created : str
+    settings : StandInSettings
+    regions : int
+    results : list[BenchResult]
+
+Bench = Callable[[GrafanaClient, RedashClient, Marketplace], Awaitable[Any]]
+
+async def _do_analitic(g : GrafanaClient, r : RedashClient, marketplace : Marketplace) -> None:
+    from app import App # app тянет меню - импортируем только когда нужен
+    with contextlib.redirect_stdout(io.StringIO()): # сам отчет не печатаем
+        await App()._do_analitic(marketplace)
+        flush_logs()
+
+async def _pipeline(g : GrafanaClient, r : RedashClient, marketplace : Marketplace) -> None:
+    await AnaliticPipeline().collect_with(g, r, marketplace)
+
+# имя → прогон. Клиенты открыты один раз на весь набор (как в fleet), _do_analitic открывает свои сам
+BENCHMARKS : dict[str, Bench] = {
+    "app._do_analitic" : _do_analitic,
+    "pipeline.collect_with" : _pipeline,
+    "grafana.get_count_stors" : lambda g, r, mp: g.get_count_stors(mp),
+    "grafana.get_count_stors(grouped=False)" : lambda g, r, mp: g.get_count_stors(mp, grouped=False),
+    "grafana.get_status_cache" : lambda g, r, mp: g.get_status_cache(mp),
+    "grafana.get_value_exchanges_batch" : lambda g, r, mp: g.get_value_exchanges_batch([(mp, req) for req in AnaliticPipeline.EXCHANGES_REQ_MAP.values()]),
+    "grafana.get_value_exchanges_by_req(single_query=False)" : lambda g, r, mp: g.get_value_exchanges_by_req(mp, AnaliticPipeline.EXCHANGES_REQ_MAP["orders"], single_query=False),
+    "grafana.get_celary_queues" : lambda g, r, mp: g.get_celary_queues(),
+    "redash.get_schedules_by_mp" : lambda g, r, mp: r.get_schedules_by_mp(mp),
+    "redash.get_info_about_problem_regions" : lambda g, r, mp: r.get_info_about_problem_regions(mp),
+    "redash.get_info_about_history" : lambda g, r, mp: r.get_info_about_history(mp),
+    "redash.get_info_discrepancy_stors_by_regions" : lambda g, r, mp: r.get_info_discrepancy_stors_by_regions(mp),
+}
+
+def bench_marketplace(regions : int = len(Region)) -> Marketplace:
+    return Marketplace(active=True, id=5, guid="00000000-0000-0000-0000-000000000005", name="Bench", elk_name="bench",
+                       regions=list(Region)[:regions], env=Env.LTS)
+
+async def _measure(name : str, bench : Bench, stand_in : StandIn, g : GrafanaClient, r : RedashClient, marketplace : Marketplace,
+                   repeat : int, warmup : int) -> BenchResult:
+    durations : list[float] = []
+    result = BenchResult(name=name, runs=repeat)
+    calls_before = None
+    for i in range(warmup + repeat):
+        if i == warmup:
+            calls_before = stand_in.calls.copy()
+        RESULT_CACHE.invalidate() # каждый прогон - честный поход в Redash
+        start = time.perf_counter()
+        try:
+            await bench(g, r, marketplace)
+        except Exception as e:
+            result.errors += i >= warmup
+            result.last_error = f"{type(e).__name__}: {e}"
+        if i >= warmup:
+            durations.append(time.perf_counter() - start)
+
+    result.min = min(durations)
+    result.median = statistics.median(durations)
+    result.p95 = percentile(durations, 95)
+    result.mean = statistics.fmean(durations)
+    result.requests = {endpoint: round((count - calls_before[endpoint]) / repeat, 2) for endpoint, count in stand_in.calls.items()
+                       if count - calls_before[endpoint] > 0}
+    return result
+
+async def run_benchmarks(settings : StandInSettings, repeat : int = 5, warmup : int = 1, only : list[str] | None = None,
+                         regions : int = len(Region)) -> BenchReport:
+    """
+    Поднимает стенд и прогоняет бенчмарки по очереди (не параллельно - иначе они мешают друг другу)
+
+    Args:
+        settings(StandInSettings): поведение стенда (латентность, длительность Job'ов, строки, ошибки)
+        repeat(int): сколько замеряемых прогонов на бенчмарк
+        warmup(int): сколько прогонов перед замерами не учитывать
+        only(list[str]|None): запускать только бенчмарки в имени которых есть одна из подстрок
+        regions(int): сколько РК у тестового маркетплейса
+    Returns:
+        BenchReport: результаты замеров
+    """
+    marketplace = bench_marketplace(regions)
+    selected = {name: bench for name, bench in BENCHMARKS.items() if not only or any(part in name for part in only)}
+
+    # сессия Grafana стенда не должна попасть в настоящий grafana_config.json
+    saved_auth = (GRAFANA_AUTH.path_to_config, GRAFANA_AUTH.session, GRAFANA_AUTH.expires_at, GRAFANA_AUTH._loaded)
+    with tempfile.TemporaryDirectory() as tmp:
+        GRAFANA_AUTH.path_to_config = os.path.join(tmp, "grafana_config.json")
+        GRAFANA_AUTH.session, GRAFANA_AUTH.expires_at, GRAFANA_AUTH._loaded = None, None, True
+        try:
+            async with StandIn(settings) as stand_in, GrafanaClient() as g, RedashClient() as r:
+                results = [await _measure(name, bench, stand_in, g, r, marketplace, repeat, warmup) for name, bench in selected.items()]
+        finally:
+            GRAFANA_AUTH.path_to_config, GRAFANA_AUTH.session, GRAFANA_AUTH.expires_at, GRAFANA_AUTH._loaded = saved_auth
+
+    return BenchReport(commit=_git_commit(), created=datetime.datetime.now().isoformat(timespec="seconds"),
+                       settings=settings, regions=regions, results=results)
+
+def _git_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+# ---------------------------------------------------------------------------→ СОХРАНЕНИЕ И СРАВНЕНИЕ ↓
+def save_report(report : BenchReport, results_dir : str = RESULTS_DIR) -> str:
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{datetime.datetime.now():%Y%m%d_%H%M%S}_{report.commit}.json")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(report.model_dump_json(indent=2))
+    return path
+
+def latest_report(results_dir : str = RESULTS_DIR) -> str | None:
+    """
+    Последний сохраненный прогон (имена начинаются с даты - поэтому хватает сортировки по имени)
+    """
+    if not os.path.isdir(results_dir):
+        return None
+    files = sorted(name for name in os.listdir(results_dir) if name.endswith(".json"))
+    return os.path.join(results_dir, files[-1]) if files else None
+
+def load_report(path : str) -> BenchReport:
+    with open(path, "r", encoding="utf-8") as file:
+        return BenchReport.model_validate_json(file.read())
+
+def format_report(report : BenchReport, baseline : BenchReport | None = None, threshold : float = 10.0) -> tuple[str, list[str]]:
+    """
+    Таблица результатов (медиана, p95, запросы за прогон) и сравнение медиан с baseline.
+    Регрессия - медиана выросла больше чем на threshold процентов (и больше чем на 5мс - меньше это шум таймера и планировщика)
+
+    Returns:
+        tuple[str, list[str]]: текст таблицы и имена бенчмарков с регрессией
+    """
+    previous = {result.name: result for result in baseline.results} if baseline else {}
+    lines = [f"commit {report.commit}" + (f" vs {baseline.commit}" if baseline else "")]
+    regressions = []
+    for result in report.results:
+        line = (f"{result.name:<58} median {result.median * 1000:8.1f}мс  p95 {result.p95 * 1000:8.1f}мс  "
+                f"запросов {sum(result.requests.values()):6.1f}")
+        if result.errors:
+            line += f"  ошибок {result.errors}/{result.runs} ({result.last_error})"
+        old = previous.get(result.name)
+        if old is not None and old.median > 0:
+            delta = (result.median - old.median) / old.median * 100
+            line += f"  {delta:+6.1f}%"
+            if delta > threshold and result.median - old.median > 0.005:
+                regressions.append(result.name)
+                line += "  ← РЕГРЕССИЯ"
+        lines.append(line)
+    return "\n".join(lines), regressions
+
+# ---------------------------------------------------------------------------→ CLI ↓
+def main(argv : list[str] | None = None) -> int:
+    defaults = StandInSettings()
+    parser = argparse.ArgumentParser(prog="python -m tests.bench", description="Бенчмарки клиентов Grafana/Redash на локальном стенде")
+    parser.add_argument("--repeat", type=int, default=5, help="замеряемых прогонов на бенчмарк")
+    parser.add_argument("--warmup", type=int, default=1, help="прогонов прогрева (не учитываются)")
+    parser.add_argument("--only", action="append", help="только бенчмарки с этой подстрокой в имени (можно несколько)")
+    parser.add_argument("--regions", type=int, default=len(Region), help="РК у тестового маркетплейса")
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="задержка каждого ответа стенда, сек")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="разброс задержки, доля от latency")
+    parser.add_argument("--job-queue", type=float, default=defaults.job_queue, help="сколько Job висит в PENDING, сек")
+    parser.add_argument("--job-duration", type=float, default=defaults.job_duration, help="сколько Job в STARTED, сек")
+    parser.add_argument("--rows", type=int, default=defaults.rows, help="строк в результате Redash")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="доля ответов 500")
+    parser.add_argument("--job-failure-rate", type=float, default=defaults.job_failure_rate, help="доля Job'ов FAILURE")
+    parser.add_argument("--cache-ok", action="store_true", help="кэш остатков SUCCESS (без запроса детальной статистики)")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="куда сохранять результаты")
+    parser.add_argument("--baseline", help="с каким файлом результатов сравнивать. По умолчанию - последний в results-dir")
+    parser.add_argument("--threshold", type=float, default=10.0, help="рост медианы в процентах который считается регрессией")
+    parser.add_argument("--no-save", action="store_true", help="не сохранять результаты")
+    parser.add_argument("--log-level", default="ERORR", choices=[level.name for level in LogLevel])
+    args = parser.parse_args(argv)
+
+    setup_logging(LogLevel[args.log_level])
+    settings = StandInSettings(latency=args.latency, jitter=args.jitter, job_queue=args.job_queue, job_duration=args.job_duration,
+                               rows=args.rows, error_rate=args.error_rate, job_failure_rate=args.job_failure_rate,
+                               cache_ok=args.cache_ok, seed=args.seed)
+
+    baseline_path = args.baseline or latest_report(args.results_dir)
+    baseline = load_report(baseline_path) if baseline_path else None
+    if baseline is not None and (baseline.settings != settings or baseline.regions != args.regions):
+        print(f"Настройки стенда в {baseline_path} отличаются - сравнение может быть нечестным")
+
+    report = asyncio.run(run_benchmarks(settings, args.repeat, args.warmup, args.only, args.regions))
+    text, regressions = format_report(report, baseline, args.threshold)
+    print(text)
+    if not args.no_save:
+        print(f"Результаты сохранены: {save_report(report, args.results_dir)}")
+    return 1 if regressions else 0
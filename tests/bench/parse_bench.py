@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import random
+import re
+import statistics
+import time
+
+from src.loger import LogLevel, log_call, setup_logging
+from src.redash.redash_parse import parse_problem_region
+from src.regions import Region
+
+# ---------------------------------------------------------------------------------→ КАК БЫЛО ↓
+# разбор до redash_parse.py: корутина под log_call на каждую строку, 4 регулярки и _filter посимвольно
+@log_call
+async def _legacy_parse(data : dict) -> dict:
+    region = re.sub(r'<[^>]+>', '', data.get("organization_name", "")).strip()
+    clean_text = re.sub(r'<[^>]+>', '', data.get("Кол-во заказов", ""))
+    value_match = re.search(r':\s*(\d+)', clean_text)
+    change_match = re.search(r'\(([^)]+)\)', clean_text)
+    return {
+        "region": region,
+        "value": float(value_match.group(1)) if value_match else None,
+        "change": change_match.group(1) if change_match else None
+    }
+
+def _legacy_filter(items : list[dict]) -> list[dict]:
+    result = []
+    for item in items:
+        cleaned = ''.join(c for c in (item.get("change") or "") if c in '+-.0123456789')
+        if float(cleaned) < 0:
+            result.append(item)
+    return result
+
+async def legacy(rows : list[dict]) -> list[dict]:
+    results = []
+    for row in rows:
+        results.extend(_legacy_filter([await _legacy_parse(row)]))
+    return results
+
+async def current(rows : list[dict]) -> list:
+    results = []
+    for row in rows:
+        item = parse_problem_region(row, negative_only=True)
+        if item is not None:
+            results.append(item)
+    return results
+
+# ---------------------------------------------------------------------------------
+def synthetic_rows(count : int, seed : int = 0) -> list[dict]:
+    """
+    Строки в формате дашборда 9021: HTML в значениях, примерно половина с падением заказов
+    """
+    rnd = random.Random(seed)
+    regions = list(Region)
+    rows = []
+    for i in range(count):
+        region = regions[i % len(regions)]
+        sign = rnd.choice("+-")
+        rows.append({
+            "organization_name": f"<b style=\"color: #333\">{region.value[0]}</b>",
+            "Кол-во заказов": f"<span class=\"orders\">Заказы: {rnd.randint(0, 5000)}</span> <i style=\"color: {'red' if sign == '-' else 'green'}\">"
+                              f"({sign}{rnd.randint(0, 99)}.{rnd.randint(0, 99)}% {'↓' if sign == '-' else '↑'})</i>"
+        })
+    return rows
+
+def _measure(parse, rows : list[dict], repeat : int) -> list[float]:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        asyncio.run(parse(rows))
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def main(argv : list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m tests.bench.parse_bench", description="Микро-бенчмарк разбора проблемных РК (query 9021)")
+    parser.add_argument("--rows", type=int, default=5000, help="синтетических строк")
+    parser.add_argument("--repeat", type=int, default=20, help="замеров на вариант")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    setup_logging(LogLevel.ERORR)
+    rows = synthetic_rows(args.rows, args.seed)
+
+    old = asyncio.run(legacy(rows))
+    new = asyncio.run(current(rows))
+    assert [(item["region"], item["value"]) for item in old] == [(item.region, item.value) for item in new], "разбор разошелся со старым"
+
+    medians = {}
+    for name, parse in (("legacy", legacy), ("redash_parse", current)):
+        durations = _measure(parse, rows, args.repeat)
+        medians[name] = statistics.median(durations)
+        print(f"{name:<14} median {medians[name] * 1000:8.2f} мс   {medians[name] / len(rows) * 1_000_000:6.2f} мкс/строка   min {min(durations) * 1000:8.2f} мс")
+    print(f"строк: {len(rows)}, проблемных: {len(new)}, ускорение x{medians['legacy'] / medians['redash_parse']:.1f}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
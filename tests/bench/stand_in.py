@@ -0,0 +1,251 @@
+import asyncio
+import datetime
+import json
+import random
+import re
+import time
+import uuid
+from collections import Counter
+
+from aiohttp import web
+from pydantic import BaseModel
+
+from src.grafana.grafana_api import GrafanaAPI
+from src.redash.redash_api import RedashAPI
+from src.regions import Region
+
+class StandInSettings(BaseModel):
+    """
+    Поведение локальных Grafana и Redash
+    """
+    latency : float = 0.05 # секунд на каждый ответ
+    jitter : float = 0.0 # разброс латентности: ±доля от latency
+    job_queue : float = 0.0 # сколько секунд Job Redash висит в PENDING
+    job_duration : float = 0.5 # сколько секунд Job Redash в STARTED
+    rows : int = 100 # строк в ответе /api/query_results/<id>
+    error_rate : float = 0.0 # доля ответов 500 (кроме /login)
+    job_failure_rate : float = 0.0 # доля Job'ов которые заканчиваются FAILURE
+    cache_ok : bool = False # статус кэша остатков. False - клиент идет еще и за детальной статистикой
+    seed : int = 0
+
+class _Job:
+    __slots__ = ("created", "failed")
+
+    def __init__(self, created : float, failed : bool) -> None:
+        self.created = created
+        self.failed = failed
+
+class StandIn:
+    """
+    Grafana и Redash на одном локальном aiohttp сервере: отвечают в формате настоящих API на все запросы клиентов.
+    На время работы (async with) подменяет GrafanaAPI.Endpoints.BASE_URL и RedashAPI.Endpoints.BASE_URL.
+
+    calls - сколько запросов пришло на каждый endpoint (по нему видно сколько HTTP запросов делает метод)
+    """
+    _IN = re.compile(r"IN \(([\d, ]+)\)")
+
+    def __init__(self, settings : StandInSettings | None = None) -> None:
+        self.settings = settings or StandInSettings()
+        self.calls : Counter[str] = Counter()
+        self.url = ""
+        self._random = random.Random(self.settings.seed)
+        self._jobs : dict[str, _Job] = {}
+        self._result_body : bytes | None = None
+        self._runner : web.AppRunner | None = None
+        self._saved_urls : tuple[str, str] | None = None
+
+    async def __aenter__(self) -> "StandIn":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.stop()
+
+    async def start(self, host : str = "127.0.0.1", port : int = 0) -> str:
+        """
+        Запускает сервер (port=0 - любой свободный) и направляет на него клиентов. Возвращает базовый URL
+        """
+        app = web.Application()
+        app.router.add_post(GrafanaAPI.Endpoints.AUTH_ENDPONT, self._login)
+        app.router.add_post(GrafanaAPI.Endpoints.QUERY_ENDPOINT, self._ds_query)
+        app.router.add_post(GrafanaAPI.Endpoints.ELK_MULTI_SEARCH_ENDPOINT.format(source_id="{source_id}"), self._msearch)
+        app.router.add_post(RedashAPI.Endpoints.START_JOB_ENDPOINT.format(query="{query}"), self._start_job)
+        app.router.add_post(RedashAPI.Endpoints.START_SQL_JOB, self._start_job)
+        app.router.add_get(RedashAPI.Endpoints.GET_STATUS_JOB_ENDPOINT + "{job_id}", self._job_status)
+        app.router.add_delete(RedashAPI.Endpoints.GET_STATUS_JOB_ENDPOINT + "{job_id}", self._cancel_job)
+        app.router.add_get(RedashAPI.Endpoints.GET_RESULT_JOB_ENDPOINT.format(query_result_id="{query_result_id}"), self._query_result)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_host, bound_port = self._runner.addresses[0][:2]
+        self.url = f"http://{bound_host}:{bound_port}"
+
+        self._saved_urls = (GrafanaAPI.Endpoints.BASE_URL, RedashAPI.Endpoints.BASE_URL)
+        GrafanaAPI.Endpoints.BASE_URL = self.url
+        RedashAPI.Endpoints.BASE_URL = self.url
+        return self.url
+
+    async def stop(self) -> None:
+        if self._saved_urls is not None:
+            GrafanaAPI.Endpoints.BASE_URL, RedashAPI.Endpoints.BASE_URL = self._saved_urls
+            self._saved_urls = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # ---------------------------------------------------------------------------
+    async def _delay(self) -> None:
+        jitter = self.settings.jitter
+        await asyncio.sleep(self.settings.latency * (1 + self._random.uniform(-jitter, jitter)))
+
+    def _failed(self) -> bool:
+        return self._random.random() < self.settings.error_rate
+
+    @staticmethod
+    def _error() -> web.Response:
+        return web.json_response({"message": "stand-in: внутренняя ошибка"}, status=500)
+
+    # ---------------------------------------------------------------------------→ GRAFANA ↓
+    async def _login(self, request : web.Request) -> web.Response:
+        self.calls["POST /login"] += 1
+        await self._delay()
+        await request.read() # логин и пароль не проверяем - creds.env на стенде не нужен
+        response = web.json_response({"message": "Logged in"})
+        response.set_cookie("grafana_session", uuid.uuid4().hex, max_age=3600)
+        return response
+
+    async def _ds_query(self, request : web.Request) -> web.Response:
+        self.calls["POST /api/ds/query"] += 1
+        await self._delay()
+        if self._failed():
+            return self._error()
+        body = await request.json()
+        results = {query["refId"]: {"frames": self._frames(query)} for query in body.get("queries") or []}
+        return web.json_response({"results": results})
+
+    def _frames(self, query : dict) -> list[dict]:
+        """
+        Ответ на один query в зависимости от того что это за query (по refId и тексту)
+        """
+        ref_id = query["refId"]
+        if ref_id.startswith("STORS_"):
+            org_ids, mp_ids = ([int(value) for value in group.split(",")] for group in self._IN.findall(query["rawSQL"])[:2])
+            rows = [(org_id, mp_id, self._random.randint(0, 60)) for org_id in org_ids for mp_id in mp_ids]
+            return [{"data": {"values": [list(column) for column in zip(*rows)] if rows else [[], [], []]}}]
+        if ref_id == "CACHE_STATUS":
+            return [{"data": {"values": [["SUCCESS" if self.settings.cache_ok else "FAIL"]]}}]
+        if ref_id == "CACHE_DETAILS":
+            names = [region.value[0] for region in Region]
+            db = [self._random.randint(1000, 5000) for _ in names]
+            cache = [self._random.randint(0, count) for count in db]
+            return [{"data": {"values": [names, db, cache, [round((d - c) / d * 100, 1) for d, c in zip(db, cache)]]}}]
+        if query.get("expr"):
+            # Prometheus: по frame на очередь, колонки время | длина
+            points = min(int(query.get("maxDataPoints") or 31), 1000)
+            now_ms = int(time.time() * 1000)
+            step_ms = int(query.get("intervalMs") or 60000)
+            times = [now_ms - (points - 1 - i) * step_ms for i in range(points)]
+            return [
+                {
+                    "schema": {"fields": [{"name": "Time"}, {"name": "Value", "labels": {"queue_name": f"queue_{i}"}}]},
+                    "data": {"values": [times, [self._random.randint(0, 50) + j * i for j in range(points)]]}
+                }
+                for i in range(5)
+            ]
+        return [{"data": {"values": [[self._random.randint(0, 60)]]}}]
+
+    async def _msearch(self, request : web.Request) -> web.Response:
+        self.calls["POST _msearch"] += 1
+        await self._delay()
+        if self._failed():
+            return self._error()
+        lines = [line for line in (await request.text()).split("\n") if line]
+        responses = []
+        for body in lines[1::2]: # строки через одну: заголовок поиска, тело поиска
+            histogram = json.loads(body)["aggs"]["2"]["date_histogram"]
+            bounds = histogram["extended_bounds"]
+            step = int(histogram["fixed_interval"].removesuffix("ms"))
+            buckets = [
+                {"key": key, "doc_count": self._random.choice((0, 0, 0, 1, 3))}
+                for key in range(bounds["min"] - bounds["min"] % step, bounds["max"] + 1, step)
+            ]
+            responses.append({
+                "hits": {"total": {"value": sum(bucket["doc_count"] for bucket in buckets)}},
+                "aggregations": {"2": {"buckets": buckets}},
+                "status": 200
+            })
+        return web.json_response({"responses": responses})
+
+    # ---------------------------------------------------------------------------→ REDASH ↓
+    async def _start_job(self, request : web.Request) -> web.Response:
+        self.calls["POST start job"] += 1
+        await self._delay()
+        if self._failed():
+            return self._error()
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = _Job(time.monotonic(), self._random.random() < self.settings.job_failure_rate)
+        return web.json_response({"job": {"id": job_id, "status": RedashAPI.JobStatus.PENDING.value}})
+
+    async def _job_status(self, request : web.Request) -> web.Response:
+        self.calls["GET /api/jobs"] += 1
+        await self._delay()
+        if self._failed():
+            return self._error()
+        job_id = request.match_info["job_id"]
+        job = self._jobs.get(job_id)
+        if job is None:
+            return web.json_response({"message": "Job не найден"}, status=404)
+
+        elapsed = time.monotonic() - job.created
+        query_result_id = None
+        if elapsed < self.settings.job_queue:
+            status = RedashAPI.JobStatus.PENDING.value
+        elif elapsed < self.settings.job_queue + self.settings.job_duration:
+            status = RedashAPI.JobStatus.STARTED.value
+        elif job.failed:
+            status = RedashAPI.JobStatus.FAILURE.value
+        else:
+            status = RedashAPI.JobStatus.SUCCESS.value
+            query_result_id = 1
+        return web.json_response({"job": {"id": job_id, "status": status, "query_result_id": query_result_id}})
+
+    async def _cancel_job(self, request : web.Request) -> web.Response:
+        self.calls["DELETE /api/jobs"] += 1
+        self._jobs.pop(request.match_info["job_id"], None)
+        return web.Response(status=204)
+
+    async def _query_result(self, request : web.Request) -> web.Response:
+        self.calls["GET /api/query_results"] += 1
+        await self._delay()
+        if self._failed():
+            return self._error()
+        if self._result_body is None:
+            self._result_body = self._build_result()
+        return web.Response(body=self._result_body, content_type="application/json")
+
+    def _build_result(self) -> bytes:
+        """
+        Один ответ на все query: в каждой строке есть колонки всех запросов отчета (история, проблемные РК, расписания, расхождения).
+        Собирается один раз - что бы в замер не попадало время сериализации на стороне стенда
+        """
+        today = datetime.date.today()
+        regions = list(Region)
+        rows = []
+        for i in range(self.settings.rows):
+            region = regions[i % len(regions)]
+            sign = "-" if i % 3 == 0 else "+"
+            rows.append({
+                "data": (today - datetime.timedelta(days=i)).strftime("%Y-%m-%d"),
+                "organization_name": f"<b>{region.value[0]}</b>",
+                "Кол-во заказов": f"<span>Заказы: {100 + i}</span> <i>({sign}{i % 40}.5%)</i>",
+                "status_name": "Расписание сформировано" if i % 4 else "Ошибка",
+                "num": i % 7,
+                "rk": region.name,
+                "РК": region.name,
+                "1С": 50 + i % 10,
+                "Ecom": 48 + i % 10,
+                "Доля схождений": 96.0
+            })
+        return json.dumps({"query_result": {"id": 1, "query": "select ...", "data": {"columns": [], "rows": rows}}}, ensure_ascii=False).encode()
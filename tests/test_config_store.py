@@ -0,0 +1,111 @@
+import json
+import os
+
+from src.config_store import ConfigStore, latest_records
+from src.models import Env, Marketplace
+from src.regions import Region
+
+def _mp(id : int = 5, guid : str = "guid-5", name : str = "Ютека", **fields) -> Marketplace:
+    return Marketplace(**({"active": True, "id": id, "guid": guid, "name": name, "elk_name": "uteka",
+                           "regions": [Region.MSK.name, Region.SPB.name], "env": Env.LTS.value} | fields))
+
+def _lines(path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+def test_upsert_then_get(tmp_path):
+    path = tmp_path / "cfg.jsonl"
+    store = ConfigStore(str(path))
+
+    assert store.upsert(_mp())
+    assert store.upsert(_mp(id=6, guid="guid-6", name="Другой"))
+
+    assert store.get(id=5).name == "Ютека"
+    assert store.get(guid="guid-6").name == "Другой"
+    assert store.get(id=7) is None
+    assert os.path.exists(store.index_path)
+    assert [line["id"] for line in _lines(path)] == [5, 6]
+
+def test_unchanged_upsert_writes_nothing(tmp_path):
+    path = tmp_path / "cfg.jsonl"
+    store = ConfigStore(str(path))
+    store.upsert(_mp())
+    size = path.stat().st_size
+
+    assert not store.upsert(_mp())
+    assert path.stat().st_size == size
+
+def test_same_guid_latest_wins_and_compacts(tmp_path):
+    path = tmp_path / "cfg.jsonl"
+    store = ConfigStore(str(path), compact_min_stale=3, compact_ratio=1.0)
+    store.upsert(_mp(id=6, guid="guid-6", name="Другой"))
+
+    for i in range(4):
+        store.upsert(_mp(name=f"Ютека {i}"))
+    # 5 строк, 3 устаревших при 2 живых - сжатие до последней записи на ключ
+    assert [line["name"] for line in _lines(path)] == ["Другой", "Ютека 3"]
+    assert store.stats() == {"records": 2, "live": 2, "size": path.stat().st_size}
+
+    store.upsert(_mp(name="Ютека 4"))
+    assert len(_lines(path)) == 3 # порог еще не достигнут
+    assert store.get(guid="guid-5").name == "Ютека 4"
+    assert store.get(id=5).name == "Ютека 4"
+    assert store.compact() == {"before": 3, "after": 2}
+    assert store.get(id=5).name == "Ютека 4"
+    assert store.get(id=6).name == "Другой"
+
+def test_record_matching_two_old_records_replaces_both():
+    records = [{"id": 1, "guid": "a"}, {"id": 2, "guid": "b"}, {"id": 1, "guid": "b", "name": "new"}]
+    assert latest_records(records) == [{"id": 1, "guid": "b", "name": "new"}]
+
+def test_index_rebuilt_after_truncation(tmp_path):
+    path = tmp_path / "cfg.jsonl"
+    store = ConfigStore(str(path))
+    store.upsert(_mp(name="Старое"))
+    first_size = path.stat().st_size
+    store.upsert(_mp(name="Новое"))
+    assert store.get(id=5).name == "Новое"
+
+    # файл обрезали в обход стора - индекс указывает за конец файла и должен перестроиться
+    with open(path, "r+b") as file:
+        file.truncate(first_size)
+    assert store.get(id=5).name == "Старое"
+
+def test_index_extended_after_external_append(tmp_path):
+    path = tmp_path / "cfg.jsonl"
+    store = ConfigStore(str(path))
+    store.upsert(_mp())
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(ConfigStore._dump(_mp(name="Руками")) + "\n")
+
+    assert store.get(id=5).name == "Руками"
+
+def test_get_does_not_write_index(tmp_path):
+    path = tmp_path / "cfg.jsonl"
+    content = ConfigStore._dump(_mp()) + "\n"
+    path.write_text(content, encoding="utf-8")
+    store = ConfigStore(str(path))
+
+    assert store.get(id=5).name == "Ютека"
+    assert not os.path.exists(store.index_path)
+    assert path.read_text(encoding="utf-8") == content
+
+def test_torn_final_line_is_ignored_and_repaired_on_upsert(tmp_path):
+    path = tmp_path / "cfg.jsonl"
+    store = ConfigStore(str(path))
+    store.upsert(_mp(name="Целая"))
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(ConfigStore._dump(_mp(name="Оборванная"))[:40]) # запись оборвалась посередине
+
+    assert store.get(id=5).name == "Целая"
+
+    store.upsert(_mp(id=6, guid="guid-6", name="После"))
+    assert store.get(id=6).name == "После"
+    assert store.get(id=5).name == "Целая"
+    assert path.read_text(encoding="utf-8").endswith("\n")
+
+def test_corrupt_record_returns_none(tmp_path):
+    path = tmp_path / "cfg.jsonl"
+    line = json.loads(ConfigStore._dump(_mp())) | {"regions": ["NOPE"]}
+    path.write_text(json.dumps(line) + "\n", encoding="utf-8")
+
+    assert ConfigStore(str(path)).get(id=5) is None
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from src.daemon import _JsonlWriter
+from src.scheduler import Scheduler
+
+async def _noop() -> None:
+    return None
+
+def test_spread_staggers_groups_and_jobs():
+    scheduler = Scheduler(jitter=0.0)
+    families = ["stors", "cache", "exchanges"]
+    for mp in ["a", "b"]:
+        for family in families:
+            scheduler.add(f"{mp}:{family}", 600, _noop, group=family)
+    scheduler._spread()
+
+    offsets = {job.name: job.offset for job in scheduler.jobs}
+    # внутри семейства шаг - половина интервала, семейства сдвинуты на треть этого шага
+    assert offsets == pytest.approx({
+        "a:stors": 0.0, "b:stors": 300.0,
+        "a:cache": 100.0, "b:cache": 400.0,
+        "a:exchanges": 200.0, "b:exchanges": 500.0,
+    })
+
+def test_jsonl_writer_appends_in_order(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text('{"job": "old"}\n', encoding="utf-8")
+    writer = _JsonlWriter(str(path))
+    for i in range(50):
+        writer.write({"job": f"mp:{i}", "result": {"Москва": i}})
+    writer.flush()
+
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [line["job"] for line in lines] == ["old"] + [f"mp:{i}" for i in range(50)]
+    assert lines[-1]["result"] == {"Москва": 49}
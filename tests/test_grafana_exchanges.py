@@ -0,0 +1,62 @@
+import asyncio
+import json
+import random
+
+from src.grafana.grafana import GrafanaClient
+from src.models import Env, Marketplace
+from src.regions import Region
+
+MINUTE = 60 * 1000
+NOW = 28_333_334 * MINUTE # кратно минуте - как верхняя граница в get_value_exchanges_batch
+TIME_MAP = [5, 10, 15, 30, 60]
+
+def _response(buckets : dict[int, int]) -> dict:
+    return {"aggregations": {"2": {"buckets": [{"key": key, "doc_count": count} for key, count in sorted(buckets.items())]}}}
+
+def _buckets(docs : list[int], interval_ms : int = MINUTE) -> dict[int, int]:
+    buckets : dict[int, int] = {}
+    for ts in docs:
+        key = ts - ts % interval_ms
+        buckets[key] = buckets.get(key, 0) + 1
+    return buckets
+
+def test_bucket_on_lower_boundary_is_inside_span():
+    client = GrafanaClient()
+    response = _response({NOW - 5 * MINUTE: 2, NOW - 6 * MINUTE: 7})
+    assert client._smallest_span_with_hits(response, TIME_MAP, MINUTE, NOW) == (2, 5)
+
+def test_bucket_before_span_is_not_counted():
+    client = GrafanaClient()
+    response = _response({NOW - 6 * MINUTE: 3, NOW - 11 * MINUTE: 4})
+    assert client._smallest_span_with_hits(response, TIME_MAP, MINUTE, NOW) == (3, 10)
+
+def test_straddling_bucket_is_clipped_when_bound_is_not_aligned():
+    # граница не кратна шагу: бакет начался за 5.5 минут до конца - в отрезок 5 минут не входит целиком и не учитывается
+    client = GrafanaClient()
+    now = NOW + 30 * 1000
+    response = _response({NOW - 5 * MINUTE: 1, NOW - 4 * MINUTE: 0})
+    assert client._smallest_span_with_hits(response, TIME_MAP, MINUTE, now) == (1, 10)
+
+def test_buckets_after_upper_bound_are_ignored():
+    client = GrafanaClient()
+    response = _response({NOW + MINUTE: 5})
+    assert client._smallest_span_with_hits(response, TIME_MAP, MINUTE, NOW) == (0, TIME_MAP[-1])
+
+def test_hits_match_range_total_for_every_span():
+    # с границей кратной шагу сумма бакетов = hits.total поиска за [now - span, now]
+    client = GrafanaClient()
+    rnd = random.Random(1)
+    docs = [NOW - rnd.randint(0, 70 * MINUTE) for _ in range(500)] + [NOW, NOW - 5 * MINUTE, NOW - 5 * MINUTE - 1]
+    response = _response(_buckets(docs))
+    for span in TIME_MAP:
+        total = sum(1 for ts in docs if NOW - span * MINUTE <= ts <= NOW)
+        assert client._smallest_span_with_hits(response, [span], MINUTE, NOW) == (total, span)
+
+def test_payload_uses_given_upper_bound():
+    client = GrafanaClient()
+    marketplace = Marketplace(active=True, id=5, guid="guid-5", name="Ютека", elk_name="uteka", regions=[Region.MSK.name], env=Env.LTS.value)
+    payload = asyncio.run(client._gen_msearch_payload(marketplace, 60, {Env.LTS.value: "mp:{mp_name}"}, MINUTE, NOW))
+    body = json.loads(payload.splitlines()[1])
+    bounds = body["query"]["bool"]["filter"][0]["range"]["@timestamp"]
+    assert bounds == {"gte": NOW - 60 * MINUTE, "lte": NOW}
+    assert body["aggs"]["2"]["date_histogram"]["extended_bounds"] == {"min": NOW - 60 * MINUTE, "max": NOW}
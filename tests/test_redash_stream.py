@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import pytest
+
+from src.redash.redash_stream import iter_json_rows
+
+class _FakeContent:
+    """
+    Замена resp.content: отдает тело заранее заданными кусками байт (размер из iter_chunked игнорируется)
+    """
+
+    def __init__(self, chunks : list[bytes]) -> None:
+        self.chunks = chunks
+
+    async def iter_chunked(self, n : int):
+        for chunk in self.chunks:
+            yield chunk
+
+def _collect(chunks : list[bytes]) -> list[dict]:
+    async def collect() -> list[dict]:
+        return [row async for row in iter_json_rows(_FakeContent(chunks))]
+    return asyncio.run(collect())
+
+def _rows(body : str | bytes, chunk : int) -> list[dict]:
+    data = body.encode("utf-8") if isinstance(body, str) else body
+    return _collect([data[i:i + chunk] for i in range(0, len(data), chunk)])
+
+CHUNKS = [1, 2, 3, 7, 64, 1 << 20] # в том числе по байту - разрезаны все токены и многобайтные символы
+
+ROWS = [
+    {"data": "2026-10-18", "Кол-во заказов": "<span>Заказы: 150</span> <i>(-9.81% ↓)</i>"},
+    {"text": "скобки [ и { и кавычка \" внутри", "n": 2, "nested": {"rows": [1, 2]}},
+]
+
+@pytest.mark.parametrize("chunk", CHUNKS)
+def test_rows_after_columns(chunk):
+    body = json.dumps({"query_result": {"id": 1, "data": {"columns": [{"name": "rows"}], "rows": ROWS}}}, ensure_ascii=False)
+    assert _rows(body, chunk) == ROWS
+
+@pytest.mark.parametrize("chunk", CHUNKS)
+def test_rows_before_columns(chunk):
+    body = json.dumps({"query_result": {"data": {"rows": ROWS, "columns": [{"name": "data"}]}, "id": 1}}, ensure_ascii=False)
+    assert _rows(body, chunk) == ROWS
+
+@pytest.mark.parametrize("chunk", CHUNKS)
+def test_strings_that_look_like_rows(chunk):
+    # "rows" в тексте query, экранированные кавычки и скобки в строках не должны сбивать поиск массива
+    query = 'select \\"rows\\" from t where x = \'[\' or y = \'{\' -- "rows": ['
+    body = (
+        '{"query_result": {"query": "' + query + '", "rows": "не тот rows", '
+        '"data\\"x": {"rows": [{"bad": 1}]}, '
+        '"data": {"columns": [], "rows": ' + json.dumps(ROWS, ensure_ascii=False) + '}}}'
+    )
+    assert _rows(body, chunk) == ROWS
+
+def test_multibyte_char_split_across_chunks():
+    body = json.dumps({"query_result": {"data": {"rows": [{"РК": "Москва"}]}}}, ensure_ascii=False).encode("utf-8")
+    split = body.index("Москва".encode("utf-8")) + 1 # посередине двухбайтной "М"
+    assert _collect([body[:split], body[split:]]) == [{"РК": "Москва"}]
+
+@pytest.mark.parametrize("chunk", CHUNKS)
+def test_empty_rows(chunk):
+    assert _rows('{"query_result": {"data": {"columns": [], "rows": []}}}', chunk) == []
+
+def test_response_without_rows():
+    assert _rows('{"message": "Query not found"}', 8) == []
+
+@pytest.mark.parametrize("cut", [0.3, 0.6, 0.95])
+@pytest.mark.parametrize("chunk", [1, 64])
+def test_truncated_input_raises(cut, chunk):
+    body = json.dumps({"query_result": {"data": {"columns": [], "rows": ROWS}}}, ensure_ascii=False).encode("utf-8")
+    with pytest.raises(ValueError):
+        _rows(body[:int(len(body) * cut)], chunk)
+
+def test_truncated_before_rows_raises():
+    with pytest.raises(ValueError):
+        _rows('{"query_result": {"data": {"colu', 4)